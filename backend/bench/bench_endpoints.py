@@ -0,0 +1,57 @@
+# pytest-benchmark microbenchmarks for the endpoints and load_into_db.
+# Purpose: the same requests as bench/run.py, for people who prefer pytest-benchmark's statistics,
+# --benchmark-compare and histogram output. Not collected by the regular test run (the file
+# name doesn't match test_*.py); run it explicitly:
+#   pip install pytest-benchmark
+#   BENCH_VENUES=1m python -m pytest bench/bench_endpoints.py --benchmark-autosave
+# Interaction: datasets from bench/synth.prepare(), requests from bench/scenarios.ENDPOINTS.
+
+import contextlib
+import io
+import os
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from bench import synth  # noqa: E402
+from bench.scenarios import ENDPOINTS  # noqa: E402
+
+VENUES = synth.parse_venues(os.environ.get('BENCH_VENUES', '10k'))
+CSV_PATH, DB_PATH = synth.prepare(VENUES)  # also points FOOT_TRAFFIC_DB at the benchmark database
+
+from fastapi.testclient import TestClient  # noqa: E402
+from load_csv import load_into_db  # noqa: E402
+from src import startup  # noqa: E402
+from src.app import app  # noqa: E402
+from src.cache import response_cache  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def client():
+    with TestClient(app) as c:
+        assert startup.wait_ready(timeout=600), startup.status()
+        yield c
+
+
+@pytest.mark.parametrize('name', list(ENDPOINTS))
+def test_endpoint(benchmark, client, name):
+    method, url, body = ENDPOINTS[name]
+
+    def call():
+        response_cache.clear()
+        return client.request(method, url, json=body)
+
+    assert call().status_code == 200
+    assert benchmark(call).status_code == 200
+
+
+@pytest.mark.parametrize('workers', [1, os.cpu_count() or 2])
+def test_load_into_db(benchmark, tmp_path, workers):
+    def load(db_path):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return load_into_db(CSV_PATH, db_path, defer_indexes=True, workers=workers)
+
+    paths = iter(str(tmp_path / f'load-{i}.db') for i in range(100))
+    result = benchmark.pedantic(load, setup=lambda: ((next(paths),), {}), rounds=3)
+    assert result == 0
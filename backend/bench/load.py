@@ -0,0 +1,76 @@
+# Load scenario: concurrent clients replaying the dashboard's request mix.
+# Purpose: measures throughput and tail latency under concurrency (pool, executors and cache
+# together), which single-request microbenchmarks can't show. Each client loops over requests
+# drawn from scenarios.LOAD_MIX for a fixed duration.
+# Interaction: run against a live server (python -m bench.load --url http://localhost:8000) or
+# in-process through httpx's ASGI transport from bench/run.py (--load-seconds).
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import httpx
+
+from .scenarios import LOAD_MIX, pick
+from .stats import summarize
+
+
+async def _client(http, deadline, rnd, latencies, errors, mix):
+    while time.perf_counter() < deadline:
+        name, method, url, body = pick(rnd, mix)
+        started = time.perf_counter()
+        try:
+            r = await http.request(method, url, json=body)
+            await r.aread()
+            ok = r.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        elapsed = time.perf_counter() - started
+        if ok:
+            latencies.setdefault(name, []).append(elapsed)
+        else:
+            errors[name] = errors.get(name, 0) + 1
+
+
+async def run_load(seconds=10, concurrency=16, seed=0, url=None, app=None, mix=LOAD_MIX):
+    """Run the mix for `seconds` with `concurrency` clients; returns the stats dict.
+
+    Exactly one of `url` (a live server) or `app` (an ASGI app, served in-process) is given.
+    """
+    transport = httpx.ASGITransport(app=app) if app is not None else None
+    latencies, errors = {}, {}
+    async with httpx.AsyncClient(base_url=url or 'http://bench', transport=transport, timeout=60) as http:
+        started = time.perf_counter()
+        deadline = started + seconds
+        await asyncio.gather(*(
+            _client(http, deadline, random.Random(seed * 1000 + i), latencies, errors, mix)
+            for i in range(concurrency)
+        ))
+        wall = time.perf_counter() - started
+    requests = sum(len(v) for v in latencies.values())
+    return {
+        'seconds': round(wall, 2),
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': sum(errors.values()),
+        'throughput_rps': round(requests / wall, 1),
+        'latency': summarize([t for v in latencies.values() for t in v]),
+        'scenarios': {name: {**summarize(v), 'errors': errors.get(name, 0)} for name, v in sorted(latencies.items())},
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description='Replay the dashboard request mix against a running API')
+    p.add_argument('--url', default='http://localhost:8000')
+    p.add_argument('--seconds', type=float, default=30)
+    p.add_argument('--concurrency', type=int, default=32)
+    p.add_argument('--seed', type=int, default=0)
+    args = p.parse_args()
+    result = asyncio.run(run_load(args.seconds, args.concurrency, args.seed, url=args.url))
+    print(json.dumps(result, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+# Benchmark runner: ingest, per-endpoint latency and an optional load scenario in one report.
+# Purpose: gives every change a comparable number. Results go to a JSON file (one entry per
+# benchmark, sorted keys) that can be committed and diffed between revisions, and --compare
+# exits non-zero when a benchmark's median regressed by more than --threshold.
+# Interaction: datasets come from bench/synth.py (generated and loaded once per size, cached in
+# bench/.data); requests from bench/scenarios.py; the load scenario from bench/load.py.
+#
+#   python -m bench.run --venues 10k --out bench/results/10k.json
+#   python -m bench.run --venues 1m --load-seconds 30 --compare bench/results/1m.json
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import synth
+from .stats import compare, read_results, summarize, write_results
+
+
+def git_revision():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=synth.BACKEND, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def data_version(db_path):
+    """meta.data_version of the database at `db_path` (None before the first load)."""
+    if not os.path.exists(db_path):
+        return None
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'data_version';").fetchone()
+        return row and row[0]
+    finally:
+        conn.close()
+
+
+def bench_ingest(csv_path, venues):
+    """Time load_csv.load_into_db (streaming, parallel, unchanged delta) into a scratch database."""
+    from load_csv import load_into_db
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='bench-ingest-') as tmp:
+        runs = [
+            ('ingest_stream', os.path.join(tmp, 'stream.db'), dict(defer_indexes=True)),
+            ('ingest_parallel', os.path.join(tmp, 'parallel.db'), dict(defer_indexes=True, workers=os.cpu_count() or 2)),
+            # re-applying the same feed to stream.db (loaded with row hashes): every row hashes unchanged
+            ('ingest_delta_unchanged', os.path.join(tmp, 'stream.db'), dict(delta=True)),
+        ]
+        for name, db_path, kwargs in runs:
+            version = data_version(db_path)
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                status = load_into_db(csv_path, db_path, **kwargs)
+            elapsed = time.perf_counter() - started
+            if status != 0:
+                raise RuntimeError(f'{name} failed with status {status}')
+            if kwargs.get('delta') and data_version(db_path) != version:
+                raise RuntimeError(f'{name} rewrote rows; it would time an update, not an unchanged feed')
+            results[name] = {**summarize([elapsed]), 'rows_per_s': round(venues / elapsed)}
+    return results
+
+
+def bench_endpoints(client, rounds):
+    """Median/p95 per scenarios.ENDPOINTS entry; the response cache is cleared before each call."""
+    from src.cache import response_cache
+
+    from .scenarios import ENDPOINTS
+
+    results = {}
+    for name, (method, url, body) in ENDPOINTS.items():
+        timings = []
+        for i in range(rounds + 1):
+            response_cache.clear()
+            started = time.perf_counter()
+            r = client.request(method, url, json=body)
+            elapsed = time.perf_counter() - started
+            if r.status_code != 200:
+                raise RuntimeError(f'{name}: {method} {url} returned {r.status_code}: {r.text[:200]}')
+            if i:  # the first call warms the connection, statement cache and in-memory indexes
+                timings.append(elapsed)
+        results[name] = summarize(timings)
+    return results
+
+
+def main():
+    p = argparse.ArgumentParser(description='Run the API and ingest benchmarks')
+    p.add_argument('--venues', default='10k', help='Dataset size, e.g. 10k, 1m, 10m')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--rounds', type=int, default=20, help='Timed calls per endpoint')
+    p.add_argument('--engine', choices=('sqlite', 'columnar'), default='sqlite')
+    p.add_argument('--skip-ingest', action='store_true', help='Skip the load_into_db benchmarks')
+    p.add_argument('--load-seconds', type=float, default=0, help='Also run the load scenario in-process')
+    p.add_argument('--concurrency', type=int, default=16)
+    p.add_argument('--out', help='Write results JSON here')
+    p.add_argument('--compare', help='Baseline results JSON to compare against')
+    p.add_argument('--threshold', type=float, default=0.25, help='Allowed slowdown before flagging (fraction)')
+    args = p.parse_args()
+
+    venues = synth.parse_venues(args.venues)
+    print(f'Preparing {venues:,} venues...', flush=True)
+    csv_path, db_path = synth.prepare(venues, args.seed)
+
+    results = {
+        'meta': {
+            'venues': venues,
+            'seed': args.seed,
+            'engine': args.engine,
+            'rounds': args.rounds,
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'machine': f'{platform.system()} {platform.machine()} ({os.cpu_count()} CPUs)',
+        },
+        'benchmarks': {},
+    }
+    if not args.skip_ingest:
+        print('Benchmarking ingest...', flush=True)
+        results['benchmarks'].update(bench_ingest(csv_path, venues))
+
+    # the app reads its engine from the environment at import time (prepare() set the database)
+    os.environ['FOOT_TRAFFIC_ENGINE'] = args.engine
+    from fastapi.testclient import TestClient
+
+    from src import startup
+    from src.app import app
+    from src.db import DB_PATH
+    assert DB_PATH == db_path, DB_PATH
+
+    print('Benchmarking endpoints...', flush=True)
+    with TestClient(app) as client:
+        if not startup.wait_ready(timeout=600):
+            raise RuntimeError(f'API startup did not finish: {startup.status()}')
+        results['benchmarks'].update(bench_endpoints(client, args.rounds))
+        if args.load_seconds:
+            from .load import run_load
+            print(f'Running load scenario for {args.load_seconds:g}s...', flush=True)
+            results['load'] = asyncio.run(run_load(args.load_seconds, args.concurrency, args.seed, app=app))
+
+    for name, r in sorted(results['benchmarks'].items()):
+        print(f'{name:<28} median {r["median_ms"]:>10.3f} ms   p95 {r["p95_ms"]:>10.3f} ms')
+    if 'load' in results:
+        load = results['load']
+        print(f'load: {load["throughput_rps"]} req/s, p95 {load["latency"].get("p95_ms")} ms, {load["errors"]} errors')
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        write_results(args.out, results)
+        print('Wrote', args.out)
+    if args.compare:
+        lines, regressions = compare(read_results(args.compare), results, args.threshold)
+        print('\n'.join(lines))
+        if regressions:
+            print('Regressions:', ', '.join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
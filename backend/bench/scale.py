@@ -0,0 +1,172 @@
+# Multi-worker scaling benchmark: throughput of /api/venues and /api/venues/summary per worker count.
+# Purpose: shows how far adding uvicorn worker processes scales the column engines, and what each
+# worker costs in memory. For every worker count it starts a real server
+# (uvicorn --workers N), replays scenarios.SCALE_MIX from several client processes (one event
+# loop can't saturate many workers) and reports req/s, speedup and efficiency against one worker,
+# plus the workers' summed RSS and PSS (PSS splits shared pages between the processes mapping them,
+# so with the mapped engine it stays near one copy of the data while RSS counts it N times).
+# The response cache is disabled so every request runs the engine.
+# Interaction: datasets from bench/synth.py; the load from bench/load.py. Needs as many free cores
+# as the largest worker count plus the client processes to show anything but contention.
+#
+#   python -m bench.scale --venues 1m --workers 1,2,4,8 --seconds 20 --out bench/results/scale-1m.json
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+
+from . import synth
+from .stats import write_results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers, port, env):
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'src.app:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning', '--no-access-log'],
+        cwd=synth.BACKEND, env=env)
+
+
+def wait_ready(url, workers, timeout=600):
+    """Wait until /api/ready answers 200 several times in a row (requests land on any worker)."""
+    deadline = time.monotonic() + timeout
+    streak = 0
+    while time.monotonic() < deadline:
+        try:
+            streak = streak + 1 if httpx.get(f'{url}/api/ready', timeout=5).status_code == 200 else 0
+        except httpx.HTTPError:
+            streak = 0
+        if streak >= 4 * workers:
+            return
+        time.sleep(0.05 if streak else 0.5)
+    raise RuntimeError(f'server at {url} did not become ready')
+
+
+def worker_pids(pid):
+    """The worker processes of a uvicorn supervisor (Linux; empty elsewhere)."""
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children', encoding='ascii') as fh:
+            children = [int(p) for p in fh.read().split()]
+    except OSError:
+        return []
+    return children or [pid]
+
+
+def memory_mb(pids):
+    """Summed Rss and Pss of `pids` in MiB, from /proc/<pid>/smaps_rollup (None where unavailable)."""
+    totals = {'Rss': 0, 'Pss': 0}
+    try:
+        for pid in pids:
+            with open(f'/proc/{pid}/smaps_rollup', encoding='ascii') as fh:
+                for line in fh:
+                    key, _, value = line.partition(':')
+                    if key in totals:
+                        totals[key] += int(value.split()[0])
+    except OSError:
+        return {'rss_mb': None, 'pss_mb': None}
+    return {'rss_mb': round(totals['Rss'] / 1024, 1), 'pss_mb': round(totals['Pss'] / 1024, 1)}
+
+
+def _client_process(url, seconds, concurrency, seed):
+    from .load import run_load
+    from .scenarios import SCALE_MIX
+    return asyncio.run(run_load(seconds, concurrency, seed, url=url, mix=SCALE_MIX))
+
+
+def drive(url, seconds, clients, concurrency, seed):
+    """Run the mix from `clients` processes at once; returns the combined result."""
+    with ProcessPoolExecutor(clients) as executor:
+        runs = list(executor.map(_client_process, [url] * clients, [seconds] * clients,
+                                 [concurrency] * clients, range(seed * 100, seed * 100 + clients)))
+    wall = max(r['seconds'] for r in runs)
+    requests = sum(r['requests'] for r in runs)
+    return {
+        'requests': requests,
+        'errors': sum(r['errors'] for r in runs),
+        'throughput_rps': round(requests / wall, 1),
+        # the slowest client's percentiles, so a saturated worker isn't averaged away
+        'p50_ms': max(r['latency'].get('median_ms', 0) for r in runs),
+        'p95_ms': max(r['latency'].get('p95_ms', 0) for r in runs),
+    }
+
+
+def prebuild(engine):
+    """Write the column file before the first server starts, so no step measures building it."""
+    if engine != 'mapped':
+        return
+    from src import mapped
+    from src.db import DB_PATH, connect, get_data_version
+    conn = connect(DB_PATH)
+    try:
+        mapped.build(conn, DB_PATH, get_data_version(conn))
+    finally:
+        conn.close()
+
+
+def main():
+    p = argparse.ArgumentParser(description='Throughput of the venue endpoints per number of worker processes')
+    p.add_argument('--venues', default='100k', help='Dataset size, e.g. 100k, 1m')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--engine', choices=('sqlite', 'columnar', 'mapped'), default='mapped')
+    p.add_argument('--workers', default='1,2,4', help='Comma-separated worker counts')
+    p.add_argument('--seconds', type=float, default=15, help='Measured seconds per worker count')
+    p.add_argument('--warmup', type=float, default=3, help='Unmeasured seconds after startup')
+    p.add_argument('--clients', type=int, default=0, help='Client processes (default: the worker count)')
+    p.add_argument('--concurrency', type=int, default=8, help='Concurrent requests per client process')
+    p.add_argument('--out', help='Write results JSON here')
+    args = p.parse_args()
+
+    venues = synth.parse_venues(args.venues)
+    print(f'Preparing {venues:,} venues...', flush=True)
+    _, db_path = synth.prepare(venues, args.seed)
+    prebuild(args.engine)
+    env = {**os.environ, 'FOOT_TRAFFIC_DB': db_path, 'FOOT_TRAFFIC_ENGINE': args.engine,
+           'FOOT_TRAFFIC_CACHE_SIZE': '0'}
+
+    steps = []
+    for workers in [int(w) for w in args.workers.split(',')]:
+        port = free_port()
+        url = f'http://127.0.0.1:{port}'
+        server = start_server(workers, port, env)
+        try:
+            wait_ready(url, workers)
+            clients = args.clients or workers
+            if args.warmup:
+                drive(url, args.warmup, clients, args.concurrency, args.seed)
+            result = drive(url, args.seconds, clients, args.concurrency, args.seed)
+            result.update(workers=workers, clients=clients, **memory_mb(worker_pids(server.pid)))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        base = steps[0]['throughput_rps'] / steps[0]['workers'] if steps else result['throughput_rps'] / workers
+        result['speedup'] = round(result['throughput_rps'] / (base or 1), 2)
+        result['efficiency'] = round(result['speedup'] / workers, 2)
+        steps.append(result)
+        print(f'{workers:>3} workers: {result["throughput_rps"]:>9.1f} req/s  speedup {result["speedup"]:>5.2f}  '
+              f'efficiency {result["efficiency"]:>4.2f}  p95 {result["p95_ms"]:>8.1f} ms  '
+              f'rss {result["rss_mb"]} MiB  pss {result["pss_mb"]} MiB  errors {result["errors"]}', flush=True)
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        write_results(args.out, {'meta': {'venues': venues, 'seed': args.seed, 'engine': args.engine,
+                                          'seconds': args.seconds, 'concurrency': args.concurrency,
+                                          'machine': f'{os.cpu_count()} CPUs'},
+                                 'steps': steps})
+        print('Wrote', args.out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
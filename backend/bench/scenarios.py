@@ -0,0 +1,82 @@
+# Requests replayed by the benchmarks.
+# Purpose: ENDPOINTS is the fixed set of microbenchmarks (one representative request per endpoint
+# and access path); LOAD_MIX is the weighted mix of requests the dashboard produces, used by the
+# load scenario. Filter values are drawn from the chains / states present in every dataset
+# generated by bench/synth.py.
+# Interaction: bench/run.py, bench/load.py, bench/scale.py and bench/bench_endpoints.py.
+
+import random
+
+# name -> (method, url, json body or None)
+ENDPOINTS = {
+    'venues_page1': ('GET', '/api/venues?per_page=50', None),
+    'venues_page500': ('GET', '/api/venues?per_page=500', None),
+    'venues_page500_columns': ('GET', '/api/venues?per_page=500&shape=columns', None),
+    'venues_deep_offset': ('GET', '/api/venues?per_page=50&page=100', None),
+    'venues_contains': ('GET', '/api/venues?chain=mart&per_page=50', None),
+    'venues_exact_multi': ('GET', '/api/venues?chain=Walmart&chain=Target&match=exact&per_page=50', None),
+    'summary_unfiltered': ('GET', '/api/venues/summary', None),
+    'summary_contains_open': ('GET', '/api/venues/summary?chain=mart&open_status=open', None),
+    'summary_bbox': ('GET', '/api/venues/summary?bbox=-107,25.8,-93.5,36.5', None),
+    'aggregate_chain': ('GET', '/api/venues/aggregate?group_by=chain&metric=count&metric=sum:foot_traffic&limit=10', None),
+    'aggregate_state_p90': ('GET', '/api/venues/aggregate?group_by=state&metric=p90:foot_traffic&limit=50', None),
+    'distinct_chain_q': ('GET', '/api/distinct/chain?q=ma', None),
+    'nearest_k10': ('GET', '/api/venues/nearest?lat=31.4&lon=-103.5&k=10', None),
+    'export_csv_state': ('GET', '/api/venues/export?state=Texas&compress=none', None),
+    'batch_dashboard': ('POST', '/api/batch', {
+        'filters': {'chain': ['Walmart']}, 'items': {'per_page': 50}, 'summary': True,
+        'aggregates': [{'group_by': 'state', 'limit': 10}],
+    }),
+}
+
+CHAINS = ['Walmart', 'Target', 'Costco', 'Kroger', 'mart', 'wal', 'tar']
+STATES = ['Texas', 'California', 'Florida', 'New York', 'Ohio']
+PREFIXES = ['w', 'wa', 'wal', 'ta', 'co', 'kr', 'ma', 'lo']
+
+
+def _filters(rnd):
+    filters = {}
+    if rnd.random() < 0.6:
+        filters['chain'] = rnd.sample(CHAINS, rnd.choice((1, 1, 2)))
+    if rnd.random() < 0.3:
+        filters['state'] = rnd.choice(STATES)
+    if rnd.random() < 0.2:
+        filters['open_status'] = rnd.choice(('open', 'closed'))
+    return filters
+
+
+def _query(filters):
+    parts = []
+    for key, value in filters.items():
+        for v in value if isinstance(value, list) else [value]:
+            parts.append(f'{key}={v.replace(" ", "%20")}')
+    return '&'.join(parts)
+
+
+# What the dashboard does: a batch per filter change, typeahead per keystroke, paging, charts
+# and the occasional export. Each entry builds (method, url, body) from a Random.
+LOAD_MIX = [
+    ('batch', 40, lambda rnd: ('POST', '/api/batch', {
+        'filters': _filters(rnd), 'items': {'per_page': 50}, 'summary': True})),
+    ('typeahead', 30, lambda rnd: ('GET', f'/api/distinct/{rnd.choice(("chain", "city", "dma"))}?q={rnd.choice(PREFIXES)}', None)),
+    ('page', 15, lambda rnd: ('GET', f'/api/venues?page={rnd.randint(2, 20)}&per_page=50&{_query(_filters(rnd))}', None)),
+    ('aggregate', 10, lambda rnd: ('GET', f'/api/venues/aggregate?group_by={rnd.choice(("chain", "state", "open_year"))}'
+                                          f'&metric=count&metric=sum:foot_traffic&{_query(_filters(rnd))}', None)),
+    ('nearest', 4, lambda rnd: ('GET', f'/api/venues/nearest?lat={rnd.uniform(26, 48):.3f}'
+                                       f'&lon={rnd.uniform(-122, -72):.3f}&k=10', None)),
+    ('export', 1, lambda rnd: ('GET', f'/api/venues/export?state={rnd.choice(STATES).replace(" ", "%20")}', None)),
+]
+
+
+# Just the endpoints the column engines serve, filtered like the dashboard; bench/scale.py
+# measures how their throughput grows with the number of worker processes.
+SCALE_MIX = [
+    ('summary', 50, lambda rnd: ('GET', f'/api/venues/summary?{_query(_filters(rnd))}', None)),
+    ('page', 50, lambda rnd: ('GET', f'/api/venues?page={rnd.randint(1, 20)}&per_page=50&{_query(_filters(rnd))}', None)),
+]
+
+
+def pick(rnd: random.Random, mix=LOAD_MIX):
+    """Draw (scenario name, method, url, body) from `mix` (default LOAD_MIX)."""
+    name, _, build = rnd.choices(mix, weights=[w for _, w, _ in mix])[0]
+    return (name, *build(rnd))
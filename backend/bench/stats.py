@@ -0,0 +1,67 @@
+# Timing summaries and result-file comparison for the benchmarks.
+# Purpose: results are plain JSON with sorted keys and one benchmark per entry, so two runs (e.g.
+# the files committed for two revisions) can be diffed directly or compared with compare(),
+# which flags benchmarks whose median got slower than a threshold.
+# Interaction: bench/run.py writes and compares result files; bench/load.py summarizes latencies.
+
+import json
+import statistics
+
+
+def summarize(seconds):
+    """Summary of a list of durations in seconds, reported in milliseconds."""
+    if not seconds:
+        return {'rounds': 0}
+    ordered = sorted(seconds)
+    ms = lambda s: round(s * 1000, 3)  # noqa: E731
+    return {
+        'rounds': len(ordered),
+        'min_ms': ms(ordered[0]),
+        'median_ms': ms(statistics.median(ordered)),
+        'mean_ms': ms(statistics.fmean(ordered)),
+        'p95_ms': ms(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]),
+        'max_ms': ms(ordered[-1]),
+    }
+
+
+def write_results(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def read_results(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold=0.25):
+    """Return (lines, regressions) comparing benchmark medians of two result dicts.
+
+    A benchmark regresses when its median is more than `threshold` (a fraction) slower than the
+    baseline; load throughput regresses when it drops by more than `threshold`.
+    """
+    lines = [f'{"benchmark":<28} {"baseline ms":>12} {"current ms":>12} {"change":>8}']
+    regressions = []
+    old, new = baseline.get('benchmarks', {}), current.get('benchmarks', {})
+    for name in sorted(set(old) | set(new)):
+        if name not in old or name not in new:
+            lines.append(f'{name:<28} {"only in " + ("current" if name in new else "baseline"):>34}')
+            continue
+        a, b = old[name]['median_ms'], new[name]['median_ms']
+        change = (b - a) / a if a else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        lines.append(f'{name:<28} {a:>12.3f} {b:>12.3f} {change:>+8.0%}{flag}')
+    a = baseline.get('load', {}).get('throughput_rps')
+    b = current.get('load', {}).get('throughput_rps')
+    if a and b:
+        change = (b - a) / a
+        flag = ''
+        if change < -threshold:
+            regressions.append('load')
+            flag = '  REGRESSION'
+        lines.append(f'{"load throughput (req/s)":<28} {a:>12.1f} {b:>12.1f} {change:>+8.0%}{flag}')
+    return lines, regressions
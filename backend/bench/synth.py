@@ -0,0 +1,175 @@
+# Synthetic venue data for benchmarks.
+# Purpose: scales the Bigbox Stores Metrics CSV (a few hundred rows) to 10k / 1M / 10M venues with
+# the same schema and realistic value distributions, so latency and throughput can be measured
+# at the sizes the app is meant to serve. Output is deterministic for a given size and seed.
+# Interaction: bench/run.py and bench/bench_endpoints.py generate their datasets through
+# prepare(), which also loads them with load_csv.load_into_db; usable standalone:
+#   python -m bench.synth --venues 1m --out /tmp/venues-1m.csv
+
+import argparse
+import csv
+import hashlib
+import os
+import random
+import sys
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND not in sys.path:
+    sys.path.insert(0, BACKEND)
+
+TEMPLATE_CSV = os.path.join(os.path.dirname(BACKEND), 'Bigbox Stores Metrics.csv')
+
+# Default location for generated CSVs and databases (reused across runs of the same size).
+WORK_DIR = os.environ.get('FOOT_TRAFFIC_BENCH_DIR', os.path.join(BACKEND, 'bench', '.data'))
+
+SCALES = {'k': 1_000, 'm': 1_000_000}
+
+# Share of generated venues that belong to a synthetic long-tail chain rather than a real one,
+# so typeahead and group-by cardinality grow with the dataset like real feeds do.
+LONG_TAIL_SHARE = 0.3
+LONG_TAIL_CHAINS = 5000
+CLOSED_SHARE = 0.1
+JITTER_DEGREES = 0.5
+
+NUMERIC_FIELDS = ('foot_traffic', 'sales', 'avg_dwell_time_min', 'area_sqft', 'ft_per_sqft')
+
+
+def parse_venues(text):
+    """'10k' / '1m' / '250000' -> number of venues."""
+    text = str(text).strip().lower().replace('_', '')
+    if text and text[-1] in SCALES:
+        return int(float(text[:-1]) * SCALES[text[-1]])
+    return int(text)
+
+
+def label(venues):
+    for suffix, size in sorted(SCALES.items(), key=lambda s: -s[1]):
+        if venues >= size and venues % size == 0:
+            return f'{venues // size}{suffix}'
+    return str(venues)
+
+
+def load_templates(path=TEMPLATE_CSV):
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = [r for r in csv.DictReader(f) if r.get('geolocation')]
+    if not rows:
+        raise ValueError(f'no template rows in {path}')
+    return rows
+
+
+def _point(geolocation):
+    lon, lat = geolocation.strip()[len('POINT ('):-1].split()
+    return float(lat), float(lon)
+
+
+def synth_rows(venues, seed=0, templates=None):
+    """Yield `venues` CSV rows (dicts keyed by FIELD_ORDER) modelled on the template rows."""
+    templates = templates or load_templates()
+    rnd = random.Random(seed)
+    chains = sorted({t['chain_name'] for t in templates if t['chain_name']})
+    for i in range(venues):
+        t = rnd.choice(templates)
+        row = dict(t)
+        row['entity_id'] = hashlib.blake2b(f'{seed}:{i}'.encode(), digest_size=12).hexdigest()
+        row['store_id'] = str(i)
+        if rnd.random() < LONG_TAIL_SHARE:
+            n = int(rnd.paretovariate(1.2)) % LONG_TAIL_CHAINS
+            row['chain_name'] = row['name'] = f'{random.Random(n).choice(chains)} Local {n}'
+            row['chain_id'] = hashlib.blake2b(row['chain_name'].encode(), digest_size=12).hexdigest()
+        lat, lon = _point(t['geolocation'])
+        lat = max(-90.0, min(90.0, lat + rnd.uniform(-JITTER_DEGREES, JITTER_DEGREES)))
+        lon = max(-180.0, min(180.0, lon + rnd.uniform(-JITTER_DEGREES, JITTER_DEGREES)))
+        row['geolocation'] = f'POINT ({lon} {lat})'
+        scale = rnd.lognormvariate(0, 0.3)
+        for field in NUMERIC_FIELDS:
+            if row[field]:
+                value = float(row[field]) * scale
+                row[field] = str(int(value)) if field == 'foot_traffic' else f'{value:.2f}'
+        row['date_opened'] = f'{rnd.randint(1990, 2023)}-{rnd.randint(1, 12):02d}-01 00:00:00.000000 UTC'
+        row['date_closed'] = (f'{rnd.randint(2020, 2024)}-{rnd.randint(1, 12):02d}-01 00:00:00.000000 UTC'
+                              if rnd.random() < CLOSED_SHARE else '')
+        yield row
+
+
+def generate(path, venues, seed=0, progress=None):
+    """Write a synthetic CSV with `venues` rows to path; returns the elapsed seconds."""
+    from src.ingest import FIELD_ORDER
+
+    started = time.perf_counter()
+    tmp = path + '.tmp'
+    with open(tmp, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELD_ORDER, extrasaction='ignore')
+        writer.writeheader()
+        for i, row in enumerate(synth_rows(venues, seed), 1):
+            writer.writerow(row)
+            if progress and i % 1_000_000 == 0:
+                progress(i, time.perf_counter() - started)
+    os.replace(tmp, path)
+    return time.perf_counter() - started
+
+
+def dataset_paths(venues, seed=0, work_dir=WORK_DIR):
+    """(csv_path, db_path) of the benchmark dataset for this size and seed."""
+    base = os.path.join(work_dir, f'venues-{label(venues)}-{seed}')
+    return base + '.csv', base + '.db'
+
+
+def dataset_csv(venues, seed=0, work_dir=WORK_DIR):
+    """Path of the synthetic CSV for this size, generating it on first use."""
+    os.makedirs(work_dir, exist_ok=True)
+    path = dataset_paths(venues, seed, work_dir)[0]
+    if not os.path.exists(path):
+        generate(path, venues, seed)
+    return path
+
+
+def use_database(db_path):
+    """Point the app at db_path; must run before anything imports src.db, which reads it once."""
+    loaded = sys.modules.get('src.db')
+    if loaded is not None and os.path.abspath(loaded.DB_PATH) != os.path.abspath(db_path):
+        raise RuntimeError(f'src.db was imported before the benchmark database was selected ({loaded.DB_PATH})')
+    os.environ['FOOT_TRAFFIC_DB'] = db_path
+
+
+def prepare(venues, seed=0, work_dir=WORK_DIR):
+    """Return (csv_path, db_path) for a loaded benchmark database of this size.
+
+    The database is built once per size and seed with load_into_db and reused afterwards, and
+    FOOT_TRAFFIC_DB is pointed at it (see use_database), so the app never opens src/data.db.
+    """
+    import contextlib
+    import io
+
+    csv_path, db_path = dataset_paths(venues, seed, work_dir)
+    use_database(db_path)
+    from load_csv import load_into_db
+
+    dataset_csv(venues, seed, work_dir)
+    if not os.path.exists(db_path):
+        tmp = db_path + '.tmp'
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(tmp + suffix):
+                os.remove(tmp + suffix)
+        with contextlib.redirect_stdout(io.StringIO()):
+            load_into_db(csv_path, tmp, defer_indexes=True)
+        os.replace(tmp, db_path)
+    return csv_path, db_path
+
+
+def main():
+    p = argparse.ArgumentParser(description='Generate a synthetic Bigbox-schema venues CSV')
+    p.add_argument('--venues', default='10k', help='Number of venues, e.g. 10k, 1m, 10m')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--out', help='Output CSV path (default: bench/.data/venues-<size>-<seed>.csv)')
+    args = p.parse_args()
+    venues = parse_venues(args.venues)
+    out = args.out or dataset_paths(venues, args.seed)[0]
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    seconds = generate(out, venues, args.seed,
+                       progress=lambda n, s: print(f'{n:,} rows ({n / s:,.0f} rows/s)', flush=True))
+    print(f'Wrote {venues:,} venues to {out} in {seconds:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
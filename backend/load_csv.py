@@ -3,140 +3,226 @@
 Load the Bigbox Stores Metrics CSV into the backend SQLite database used by the app.
 
 Usage:
-  python load_csv.py [--csv PATH] [--db PATH] [--dry-run] [--clear]
+  python load_csv.py [--csv PATH|DIR|GLOB] [--db PATH] [--dry-run] [--clear]
+                     [--batch-size N] [--resume] [--defer-indexes] [--workers N] [--chunk-mb N]
+                     [--delta [--no-tombstone]] [--metrics] [--snapshot]
 
 Defaults:
   csv: ../Bigbox Stores Metrics.csv  (relative to backend/)
   db:  src/data.db
 
-This script inserts rows into the `venues` table. If --clear is provided the table
-will be truncated before inserting.
+This script streams rows into the `venues` table in batches of --batch-size rows, each
+committed in its own transaction, and reports progress in rows/sec. If --clear is provided
+the table will be truncated before inserting. --resume continues an interrupted load of the
+same (unchanged) file from its last committed batch. --defer-indexes drops the secondary
+indexes during the load and rebuilds them once at the end (recommended for large files).
+Rows whose entity_id is already in the table (from an earlier load, or another file of the
+same feed) are skipped and counted; use --delta to update them.
+
+--csv may also be a directory (every *.csv in it) or a quoted glob such as "metrics/*.csv".
+With --workers N > 1, files are split into --chunk-mb byte ranges that are parsed in N worker
+processes while this process writes the rows; a throughput report (parse CPU vs writer time)
+is printed at the end to help size the pool.
+
+--delta refreshes the table in place instead of appending: rows are upserted on entity_id and
+only written when their content hash changed; open entities missing from the files are closed
+(date_closed set to today) unless --no-tombstone is given, e.g. for a partial regional feed.
+
+--metrics loads metrics history instead of venues: files with entity_id, date, foot_traffic,
+sales and avg_dwell_time_min columns (one row per store and day) are streamed into the
+venue_metrics table behind /api/venues/timeseries. Rows are matched to loaded venues on
+entity_id and upserted on (venue, day), so re-sending a period replaces it. Clearing venues
+with --clear drops their history as well.
+
+--snapshot leaves the served file alone: the load goes into a new file under snapshots/ next
+to --db (empty for a full reload, a copy of the current data with --delta or --metrics), which
+is compacted with VACUUM INTO and then published. API workers running with
+FOOT_TRAFFIC_SNAPSHOTS=1 switch to it within a second, without blocking any request.
 """
-import csv
 import argparse
-import sqlite3
+import json
 import os
 import sys
 
+from src.db import bump_data_version, connect, ensure_schema, writer_lock
+from src.snapshot import build, current_path
+from src.timeseries import forget_range
+from src.ingest import (BATCH_SIZE, CHUNK_BYTES, ROW_FIELDS, expand_sources, ingest_csv, ingest_delta,
+                        ingest_metrics, ingest_parallel, iter_metric_rows, iter_rows)
+# row parsing helpers now live in src/ingest.py; re-exported for existing callers
+from src.ingest import normalize_row, parse_float, parse_int  # noqa: F401
 
-FIELD_ORDER = [
-    'entity_id','entity_type','name','foot_traffic','sales','avg_dwell_time_min','area_sqft','ft_per_sqft',
-    'geolocation','country','state_code','state_name','city','postal_code','formatted_city','street_address',
-    'sub_category','dma','cbsa','chain_id','chain_name','store_id','date_opened','date_closed'
-]
 
+def ensure_table(conn):
+    # shared with the API so both create the same table, filter indexes and FTS index
+    ensure_schema(conn)
 
-def parse_int(v):
-    if v is None or v == '':
-        return None
-    try:
-        return int(v)
-    except Exception:
+
+def load_into_db(csv_path, db_path, dry_run=False, clear=False, batch_size=BATCH_SIZE, resume=False,
+                 defer_indexes=False, workers=1, chunk_bytes=CHUNK_BYTES, delta=False, tombstone=True, metrics=False,
+                 snapshot=False):
+    paths = expand_sources(csv_path)
+    if not paths:
+        print('CSV not found:', csv_path)
+        return 1
+    if resume and workers > 1:
+        print('--resume is only supported with --workers 1')
+        return 1
+    if delta and (clear or resume or workers > 1):
+        print('--delta cannot be combined with --clear, --resume or --workers')
+        return 1
+    if metrics:
+        if clear or resume or delta or defer_indexes or workers > 1:
+            print('--metrics cannot be combined with --clear, --resume, --delta, --defer-indexes or --workers')
+            return 1
+        return load_metrics(paths, db_path, dry_run, batch_size, snapshot)
+    if snapshot and (clear or resume):
+        print('--snapshot cannot be combined with --clear or --resume (a snapshot starts empty unless --delta)')
+        return 1
+
+    if dry_run:
+        # validate every file without writing, show a sample
+        errors = {'count': 0, 'samples': []}
+        sample = []
+        rows = 0
+        for path in paths:
+            for row in iter_rows(path, errors):
+                if len(sample) < 10:
+                    sample.append(dict(zip(ROW_FIELDS, row)))
+                rows += 1
+        print(f'Read {rows} rows, {errors["count"]} errors')
+        for line, msg in errors['samples'][:5]:
+            print('Err row', line, msg)
+        print(json.dumps(sample, indent=2, ensure_ascii=False))
+        return 0
+
+    if snapshot:
+        # a new file nobody reads yet: build indexes once at the end unless refreshing in place
+        return build_snapshot(db_path, lambda conn: write_rows(
+            conn, paths, 'snapshot', False, batch_size, False, defer_indexes or not delta, workers, chunk_bytes,
+            delta, tombstone), base='copy' if delta else 'empty')
+
+    warn_if_snapshotted(db_path)
+    # one writer at a time: API workers migrating or seeding the same file wait for this load
+    with writer_lock(db_path):
+        conn = connect(db_path)
         try:
-            return int(float(v))
-        except Exception:
-            return None
+            return write_rows(conn, paths, db_path, clear, batch_size, resume, defer_indexes, workers, chunk_bytes,
+                              delta, tombstone)
+        finally:
+            conn.close()
 
 
-def parse_float(v):
-    if v is None or v == '':
-        return None
+def build_snapshot(db_path, load, base):
+    def run(conn):
+        if load(conn) != 0:
+            raise RuntimeError('load failed; snapshot not published')
     try:
-        return float(v)
-    except Exception:
-        return None
-
-
-def normalize_row(r):
-    # normalize keys to lower/strip and map to FIELD_ORDER names
-    row = {k.strip(): (v.strip() if isinstance(v, str) else v) for k, v in r.items()}
-    out = []
-    for key in FIELD_ORDER:
-        val = row.get(key, '')
-        # numeric conversions for known fields
-        if key in ('foot_traffic',):
-            out.append(parse_int(val))
-        elif key in ('sales','avg_dwell_time_min','area_sqft','ft_per_sqft'):
-            out.append(parse_float(val))
-        else:
-            out.append(val if val != '' else None)
-    return out
+        path = build(run, db_path, base=base)
+    except RuntimeError as e:
+        print(e)
+        return 1
+    print('Published snapshot', path)
+    return 0
 
 
-def ensure_table(conn):
-    cur = conn.cursor()
-    cur.execute('''CREATE TABLE IF NOT EXISTS venues (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        entity_id TEXT,
-        entity_type TEXT,
-        name TEXT,
-        foot_traffic INTEGER,
-        sales REAL,
-        avg_dwell_time_min REAL,
-        area_sqft REAL,
-        ft_per_sqft REAL,
-        geolocation TEXT,
-        country TEXT,
-        state_code TEXT,
-        state_name TEXT,
-        city TEXT,
-        postal_code TEXT,
-        formatted_city TEXT,
-        street_address TEXT,
-        sub_category TEXT,
-        dma TEXT,
-        cbsa TEXT,
-        chain_id TEXT,
-        chain_name TEXT,
-        store_id TEXT,
-        date_opened TEXT,
-        date_closed TEXT
-    );''')
-    conn.commit()
-
-
-def load_into_db(csv_path, db_path, dry_run=False, clear=False):
-    if not os.path.exists(csv_path):
-        print('CSV not found:', csv_path)
-        return 1
+def warn_if_snapshotted(db_path):
+    if current_path(db_path) != db_path:
+        print(f'Note: the API serves snapshots of {db_path} in snapshot mode; use --snapshot to refresh them')
+
 
-    conn = sqlite3.connect(db_path)
+def write_rows(conn, paths, target, clear, batch_size, resume, defer_indexes, workers, chunk_bytes, delta, tombstone):
     ensure_table(conn)
-    cur = conn.cursor()
 
     if clear:
-        cur.execute('DELETE FROM venues;')
+        conn.execute('DELETE FROM venues;')
+        forget_range(conn)
+        bump_data_version(conn)
         conn.commit()
 
-    to_insert = []
-    errors = []
-    with open(csv_path, newline='', encoding='utf-8') as fh:
-        reader = csv.DictReader(fh)
-        for i, r in enumerate(reader, start=1):
-            try:
-                row = normalize_row(r)
-                to_insert.append(row)
-            except Exception as e:
-                errors.append((i, r, str(e)))
-
-    print(f'Read {len(to_insert)} rows, {len(errors)} errors')
-    if errors:
-        for e in errors[:5]:
-            print('Err row', e[0], e[2])
+    if delta:
+        try:
+            stats = ingest_delta(conn, paths, batch_size=batch_size, tombstone=tombstone)
+        except ValueError as e:
+            print(e)
+            return 1
+        print(f'Delta: {stats["inserted"]} inserted, {stats["updated"]} updated, '
+              f'{stats["unchanged"]} unchanged, {stats["tombstoned"]} tombstoned, '
+              f'{stats["missing_id"]} without entity_id, {stats["errors"]} errors')
+        for line, msg in stats['error_samples'][:5]:
+            print('Err row', line, msg)
+        return 0
+
+    if workers > 1:
+        stats = ingest_parallel(conn, paths, workers=workers, chunk_bytes=chunk_bytes, batch_size=batch_size,
+                                defer_indexes=defer_indexes)
+    else:
+        stats = {'inserted': 0, 'existing': 0, 'skipped': 0, 'errors': 0, 'error_samples': [], 'seconds': 0.0}
+        for path in paths:
+            if len(paths) > 1:
+                print('Loading', path)
+            part = ingest_csv(conn, path, batch_size=batch_size, resume=resume, defer_indexes=defer_indexes)
+            for key in ('inserted', 'existing', 'skipped', 'errors', 'seconds'):
+                stats[key] += part[key]
+            stats['error_samples'] += part['error_samples']
+    if stats['skipped']:
+        print(f'Resumed after {stats["skipped"]} previously committed rows')
+    print(f'Read {stats["inserted"] + stats["existing"] + stats["errors"]} rows, {stats["errors"]} errors')
+    for line, msg in stats['error_samples'][:5]:
+        print('Err row', line, msg)
+    print('Inserted', stats['inserted'], 'rows into', target)
+    if stats['existing']:
+        print(f'Skipped {stats["existing"]} rows whose entity_id is already loaded (use --delta to update them)')
+    if workers > 1:
+        print_throughput(stats)
+    return 0
+
 
+def load_metrics(paths, db_path, dry_run, batch_size, snapshot_mode=False):
     if dry_run:
-        # show sample
-        import json
-        print(json.dumps([dict(zip(FIELD_ORDER, r)) for r in to_insert[:10]], indent=2, ensure_ascii=False))
+        errors = {'count': 0, 'samples': []}
+        try:
+            rows = sum(1 for path in paths for _ in iter_metric_rows(path, errors))
+        except ValueError as e:
+            print(e)
+            return 1
+        print(f'Read {rows} metrics rows, {errors["count"]} errors')
+        for line, msg in errors['samples'][:5]:
+            print('Err row', line, msg)
         return 0
 
-    placeholders = ','.join('?' for _ in FIELD_ORDER)
-    sql = f'INSERT INTO venues ({",".join(FIELD_ORDER)}) VALUES ({placeholders})'
-    cur.executemany(sql, to_insert)
-    conn.commit()
-    conn.close()
-    print('Inserted', len(to_insert), 'rows into', db_path)
-    return 0
+    def write(conn):
+        try:
+            stats = ingest_metrics(conn, paths, batch_size=batch_size)
+        except ValueError as e:
+            print(e)
+            return 1
+        print(f'Metrics: {stats["rows"]} rows, {stats["written"]} written, '
+              f'{stats["unknown"]} for unknown entity_id, {stats["errors"]} errors')
+        for line, msg in stats['error_samples'][:5]:
+            print('Err row', line, msg)
+        return 0
+
+    if snapshot_mode:
+        return build_snapshot(db_path, write, base='copy')
+    warn_if_snapshotted(db_path)
+    with writer_lock(db_path):
+        conn = connect(db_path)
+        try:
+            return write(conn)
+        finally:
+            conn.close()
+
+
+def print_throughput(stats):
+    # parse CPU close to workers * wall means the pool is saturated (add workers);
+    # writer time close to wall means the single SQLite writer is the bottleneck.
+    wall = stats['seconds'] or 1e-9
+    print(f'Throughput: {(stats["inserted"] + stats["existing"]) / wall:,.0f} rows/s over {wall:.2f}s '
+          f'({stats["files"]} files, {stats["chunks"]} chunks, {stats["workers"]} workers)')
+    print(f'  parse: {stats["parse_cpu_seconds"]:.2f} CPU-s '
+          f'({stats["parse_cpu_seconds"] / (wall * stats["workers"]):.0%} of pool capacity)')
+    print(f'  write: {stats["write_seconds"]:.2f}s ({stats["write_seconds"] / wall:.0%} of wall time)')
 
 
 def main():
@@ -145,12 +231,25 @@ def main():
     p.add_argument('--db', default=os.path.join(os.path.dirname(__file__), 'src', 'data.db'))
     p.add_argument('--dry-run', action='store_true')
     p.add_argument('--clear', action='store_true', help='Clear venues table before inserting')
+    p.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows per committed batch')
+    p.add_argument('--resume', action='store_true', help='Skip rows already committed by an interrupted load of this file')
+    p.add_argument('--defer-indexes', action='store_true', help='Drop secondary indexes during the load and rebuild them at the end')
+    p.add_argument('--workers', type=int, default=1, help='Parser processes; >1 enables parallel ingest')
+    p.add_argument('--delta', action='store_true', help='Upsert on entity_id, writing only changed rows')
+    p.add_argument('--no-tombstone', action='store_true', help='With --delta, keep entities missing from the files open')
+    p.add_argument('--snapshot', action='store_true', help='Load into a new snapshot file and publish it (API snapshot mode)')
+    p.add_argument('--metrics', action='store_true', help='Load metrics history (entity_id, date, ...) into venue_metrics')
+    p.add_argument('--chunk-mb', type=float, default=CHUNK_BYTES / (1024 * 1024), help='Byte-range size per parse task (MB)')
     args = p.parse_args()
 
     csv_path = os.path.abspath(args.csv)
     db_path = os.path.abspath(args.db)
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    rc = load_into_db(csv_path, db_path, dry_run=args.dry_run, clear=args.clear)
+    rc = load_into_db(csv_path, db_path, dry_run=args.dry_run, clear=args.clear,
+                      batch_size=args.batch_size, resume=args.resume, defer_indexes=args.defer_indexes,
+                      workers=args.workers, chunk_bytes=int(args.chunk_mb * 1024 * 1024),
+                      delta=args.delta, tombstone=not args.no_tombstone, metrics=args.metrics,
+                      snapshot=args.snapshot)
     if rc != 0:
         sys.exit(rc)
 
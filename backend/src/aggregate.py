@@ -0,0 +1,163 @@
+# Server-side group-by aggregation for /api/venues/aggregate.
+# Purpose: dashboards get pre-aggregated rows (e.g. [{chain: 'Walmart', sum_foot_traffic: 1234}])
+# instead of downloading every venue and aggregating in the browser.
+# Interaction: app.py compiles the filters with filters.build_where and passes the WHERE clause here.
+
+import math
+
+from fastapi import HTTPException
+
+# group_by param -> SQL expression
+GROUP_COLUMNS = {
+    'chain': 'chain_name',
+    'category': 'sub_category',
+    'dma': 'dma',
+    'state': 'state_name',
+    'city': 'city',
+    'open_year': 'substr(date_opened, 1, 4)',
+}
+
+# Numeric columns metrics can be computed over.
+METRIC_COLUMNS = ('foot_traffic', 'sales', 'avg_dwell_time_min', 'ft_per_sqft', 'area_sqft')
+
+# Aggregates SQLite computes natively in the GROUP BY pass; pNN percentiles are computed
+# from a second, ordered pass over the same filtered rows (only those of the output groups when
+# the GROUP BY pass already picked the top N).
+SQL_FUNCS = {'sum': 'SUM', 'avg': 'AVG', 'min': 'MIN', 'max': 'MAX'}
+
+MAX_LIMIT = 1000
+
+
+class Metric:
+    """One requested metric, parsed from 'count' or '<func>:<column>' (func: sum/avg/min/max/pNN)."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        if spec == 'count':
+            self.func, self.column, self.name, self.percentile = 'count', None, 'count', None
+            return
+        func, _, column = spec.partition(':')
+        if column not in METRIC_COLUMNS:
+            raise HTTPException(status_code=400, detail=f'unsupported metric column: {column or spec}')
+        percentile = None
+        if func.startswith('p') and func[1:].isdigit() and 0 < int(func[1:]) < 100:
+            percentile = int(func[1:])
+        elif func not in SQL_FUNCS:
+            raise HTTPException(status_code=400, detail=f'unsupported metric: {spec}')
+        self.func, self.column, self.percentile = func, column, percentile
+        self.name = f'{func}_{column}'
+
+    def sql(self):
+        if self.func == 'count':
+            return 'COUNT(*)'
+        return f'{SQL_FUNCS[self.func]}({self.column})'
+
+
+def parse_metrics(specs):
+    metrics = [Metric(s) for s in (specs or ['count'])]
+    seen = set()
+    unique = []
+    for m in metrics:
+        if m.name not in seen:
+            seen.add(m.name)
+            unique.append(m)
+    return unique
+
+
+def percentile(sorted_values, pct):
+    # linear interpolation between closest ranks (numpy's default method)
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * pct / 100.0
+    lo = math.floor(pos)
+    hi = math.ceil(pos)
+    if lo == hi:
+        return sorted_values[lo]
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def _fill_percentiles(cur, group_expr, where_sql, params, metrics, groups, limited=False):
+    # One ordered pass per percentile column; values stream in group order, so only one
+    # group's values are held in memory at a time. With `limited`, `groups` holds only some of
+    # the groups and the pass reads just their rows.
+    keys_sql, keys = '', []
+    if limited:
+        keys = [g for g in groups if g is not None]
+        in_sql = f"{group_expr} IN ({', '.join('?' * len(keys))})" if keys else '0'
+        keys_sql = f" AND ({in_sql}{f' OR {group_expr} IS NULL' if None in groups else ''})"
+    by_column = {}
+    for m in metrics:
+        if m.percentile is not None:
+            by_column.setdefault(m.column, []).append(m)
+    for column, column_metrics in by_column.items():
+        cond = f"{column} IS NOT NULL"
+        sql = (f"SELECT {group_expr} AS g, {column} FROM venues"
+               f"{where_sql + ' AND ' if where_sql else ' WHERE '}{cond}{keys_sql} ORDER BY g, {column};")
+        current, values = object(), []
+
+        def flush():
+            row = groups.get(current)
+            if row is not None:
+                for m in column_metrics:
+                    row[m.name] = percentile(values, m.percentile)
+
+        for g, v in cur.execute(sql, [*params, *keys]):
+            if g != current:
+                flush()
+                current, values = g, []
+            values.append(v)
+        flush()
+        for row in groups.values():
+            for m in column_metrics:
+                row.setdefault(m.name, None)
+
+
+def aggregate(conn, where_sql, params, group_by, metric_specs, order_by=None, descending=True, limit=50):
+    """Group the filtered venues by `group_by` and compute the requested metrics.
+
+    Groups are sorted by `order_by` (a metric spec, default: the first metric) and cut to
+    the top `limit`. Returns {'group_by', 'metrics', 'groups': [{<group_by>: value, <metric>: ...}]}.
+    """
+    group_expr = GROUP_COLUMNS.get(group_by)
+    if not group_expr:
+        raise HTTPException(status_code=400, detail='unsupported group_by')
+    metrics = parse_metrics(metric_specs)
+    order_metric = Metric(order_by) if order_by else metrics[0]
+    if order_metric.name not in {m.name for m in metrics}:
+        metrics.append(order_metric)
+
+    sql_metrics = [m for m in metrics if m.percentile is None]
+    select = ', '.join([f"{group_expr} AS g"] + [f"{m.sql()} AS {m.name}" for m in sql_metrics])
+    sql = f"SELECT {select} FROM venues{where_sql} GROUP BY g"
+    sql_params = list(params)
+    # top-N in SQL unless the ordering needs the percentile pass
+    if order_metric.percentile is None:
+        direction = 'DESC' if descending else 'ASC'
+        sql += f" ORDER BY {order_metric.name} IS NULL, {order_metric.name} {direction}, g LIMIT ?"
+        sql_params.append(limit)
+    else:
+        sql += " ORDER BY g"
+    cur = conn.cursor()
+    cur.execute(sql + ';', sql_params)
+    groups = {}
+    for r in cur.fetchall():
+        row = {group_by: r[0]}
+        for m, v in zip(sql_metrics, r[1:]):
+            row[m.name] = v
+        groups[r[0]] = row
+
+    if any(m.percentile is not None for m in metrics):
+        _fill_percentiles(cur, group_expr, where_sql, params, metrics, groups,
+                          limited=order_metric.percentile is None)
+
+    rows = list(groups.values())
+    if order_metric.percentile is not None:
+        present = [r for r in rows if r[order_metric.name] is not None]
+        missing = [r for r in rows if r[order_metric.name] is None]
+        present.sort(key=lambda r: r[order_metric.name], reverse=descending)
+        rows = (present + missing)[:limit]
+    return {
+        'group_by': group_by,
+        'metrics': [m.name for m in metrics],
+        'groups': rows,
+    }
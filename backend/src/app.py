@@ -1,17 +1,24 @@
 # This file implements a FastAPI backend for managing and querying foot traffic data. It defines
 # endpoints to retrieve points of interest (POIs), visit records, summary statistics.
 
-from fastapi import FastAPI, Query, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import Depends, FastAPI, Query, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional, List
-import sqlite3
-import os
-import csv
-import io
-
-# Path to the SQLite database file.
-DB_PATH = os.path.join(os.path.dirname(__file__), "data.db")
+import dataclasses
+import datetime
+
+from . import approx, batch, columnar, export, metrics, ranking, serialize, snapshot, startup, typeahead
+from .aggregate import GROUP_COLUMNS, MAX_LIMIT, aggregate
+from .cache import etag_matches, make_etag, response_cache
+from .db import DB_PATH, PoolTimeout, connect, get_data_version, pool
+from .executor import Overloaded, QueryTimeout, db_executor, export_executor
+from .filters import MATCH_PATTERN, VenueFilter, compile_filter
+from .geo import NEAREST_MAX_MI, nearest, parse_bbox
+from .pagination import (ORDER_PATTERN, SHAPE_PATTERN, SORT_METRICS, SORT_PATTERN, decode_cursor, fetch_page,
+                         finish_page, parse_sort, sort_where)
+from .rollups import rollup_summary, rollup_where
+from .timeseries import INTERVAL_PATTERN, timeseries, to_day
 
 # Initialize FastAPI app with CORS middleware to allow all origins.
 # Purpose: sets up the web server and enables cross-origin requests for frontend access.
@@ -26,384 +33,534 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Return a new SQLite connection for local DB access.
-# Purpose: centralizes DB connection creation so other functions can open the DB consistently.
-# Interaction: used by all route handlers and init_db() to access backend/src/data.db.
+# 503 for data endpoints while the schema is still being created (see GET /api/ready).
+app.add_middleware(startup.ReadinessGate)
+
+# Per-request latency, DB / serialization time, rows and cache outcomes for GET /metrics.
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Snapshot mode (FOOT_TRAFFIC_SNAPSHOTS=1): serve the published snapshot of the DB and switch to
+# newer ones as load_csv.py --snapshot publishes them (src/snapshot.py).
+if snapshot.ENABLED:
+    pool.follow(snapshot.current_path, snapshot.POLL_SECONDS)
+
+# The file being served: the DB itself, or its current snapshot in snapshot mode.
+def serving_path():
+    return snapshot.current_path() if snapshot.ENABLED else DB_PATH
+
+# Return a new (unpooled) SQLite connection for writes.
+# Purpose: for ad-hoc writes (tests, maintenance scripts); opens a tuned WAL connection.
 def get_conn():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+    return connect(DB_PATH)
+
+# Map data-access failures to HTTP errors.
+# Purpose: route handlers await their queries on db_executor (src/executor.py), which runs them on
+# pooled connections; a full queue or an exhausted pool is a 503, an interrupted query a 504.
+@app.exception_handler(PoolTimeout)
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Exception):
+    return JSONResponse(status_code=503, content={'detail': str(exc)})
+
+@app.exception_handler(QueryTimeout)
+async def query_timeout_handler(request: Request, exc: QueryTimeout):
+    return JSONResponse(status_code=504, content={'detail': str(exc)})
 
 # Initialize the DB schema and seed sample data when empty.
-# Purpose: ensures the 'venues' table exists and provides deterministic seed rows for development.
-# Interaction: called on startup to prepare the SQLite file used by all routes; it writes to data.db.
-# normalize and parse numeric fields
+# Purpose: migrates the 'venues' schema to the current version and seeds it from the CSV for
+# development, synchronously; used by the tests and scripts that need the data before serving.
+# Interaction: the same steps on_startup runs in the background (src/startup.py); seeding goes
+# through the same streaming pipeline as load_csv.py (src/ingest.py).
 def init_db():
-    conn = get_conn()
-    cur = conn.cursor()
-    # Create venues table if it doesn't exist.
-    cur.execute('''CREATE TABLE IF NOT EXISTS venues (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        entity_id TEXT,
-        entity_type TEXT,
-        name TEXT,
-        foot_traffic INTEGER,
-        sales REAL,
-        avg_dwell_time_min REAL,
-        area_sqft REAL,
-        ft_per_sqft REAL,
-        geolocation TEXT,
-        country TEXT,
-        state_code TEXT,
-        state_name TEXT,
-        city TEXT,
-        postal_code TEXT,
-        formatted_city TEXT,
-        street_address TEXT,
-        sub_category TEXT,
-        dma TEXT,
-        cbsa TEXT,
-        chain_id TEXT,
-        chain_name TEXT,
-        store_id TEXT,
-        date_opened TEXT,
-        date_closed TEXT
-    );''')
-    # seed venues if empty and CSV exists at repo root
-    cur.execute("SELECT COUNT(*) FROM venues;")
-    if cur.fetchone()[0] == 0:
-        # look for CSV in backend/ and in project root (repo root may contain the CSV)
-        csv_candidates = [
-            os.path.join(os.path.dirname(os.path.dirname(__file__)), 'Bigbox Stores Metrics.csv'),
-            os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'Bigbox Stores Metrics.csv'),
-        ]
-        csv_path = None
-        for c in csv_candidates:
-            if os.path.exists(c):
-                csv_path = c
-                break
-        # seed from CSV if found
-        if csv_path:
-            # seed venues from CSV
-            try:
-                with open(csv_path, newline='', encoding='utf-8') as fh:
-                    reader = csv.DictReader(fh) 
-                    to_insert = []
-                    for r in reader:
-                        # normalize and parse numeric fields
-                        def ival(key):
-                            v = r.get(key, '')
-                            try:
-                                return int(v) if v not in (None, '') else None
-                            except Exception:
-                                try:
-                                    return int(float(v))
-                                except Exception:
-                                    return None
-                        def fval(key):
-                            v = r.get(key, '')
-                            try:
-                                return float(v) if v not in (None, '') else None
-                            except Exception:
-                                return None
-                        to_insert.append((
-                            r.get('entity_id'),
-                            r.get('entity_type'),
-                            r.get('name'),
-                            ival('foot_traffic'),
-                            fval('sales'),
-                            fval('avg_dwell_time_min'),
-                            fval('area_sqft'),
-                            fval('ft_per_sqft'),
-                            r.get('geolocation'),
-                            r.get('country'),
-                            r.get('state_code'),
-                            r.get('state_name'),
-                            r.get('city'),
-                            r.get('postal_code'),
-                            r.get('formatted_city'),
-                            r.get('street_address'),
-                            r.get('sub_category'),
-                            r.get('dma'),
-                            r.get('cbsa'),
-                            r.get('chain_id'),
-                            r.get('chain_name'),
-                            r.get('store_id'),
-                            r.get('date_opened'),
-                            r.get('date_closed')
-                        ))
-                cur.executemany(
-                    "INSERT INTO venues (entity_id, entity_type, name, foot_traffic, sales, avg_dwell_time_min, area_sqft, ft_per_sqft, geolocation, country, state_code, state_name, city, postal_code, formatted_city, street_address, sub_category, dma, cbsa, chain_id, chain_name, store_id, date_opened, date_closed) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
-                    to_insert
-                )
-                conn.commit()
-            except Exception as e:
-                # don't fail startup on CSV parse errors; leave venues empty
-                print('Warning: failed to seed venues from CSV:', e)
-    conn.close()
-
-# Startup event handler to initialize DB on application boot.
+    startup.run(serving_path())
+
+# Load the in-memory indexes so the first request doesn't pay for building them.
+def warm_caches():
+    with pool.connection() as conn:
+        version = get_data_version(conn)
+        typeahead.get_index(conn, version)
+        ranking.get_chain_ranks(conn, 'foot_traffic', version)
+        if columnar.enabled():
+            columnar.get_store(conn, version)
+    if columnar.ENGINE != 'sqlite' and not columnar.enabled():
+        print(f'Warning: FOOT_TRAFFIC_ENGINE={columnar.ENGINE} requires numpy; using SQLite')
+
+# Startup event handler.
+# Purpose: returns immediately so the worker starts accepting connections; migrations, seeding
+# and cache warmup run in a background thread (GET /api/ready reports when they are done).
 @app.on_event("startup")
 def on_startup():
-    init_db()
+    startup.start(serving_path(), warm=warm_caches)
+
+# Shutdown event handler to stop the DB executors and close pooled connections.
+@app.on_event("shutdown")
+def on_shutdown():
+    db_executor.shutdown()
+    export_executor.shutdown()
+    pool.close_all()
+
+# GET /api/ready
+# Purpose: readiness probe for load balancers and deploy scripts. 200 once this worker migrated,
+# seeded and warmed its caches; 503 before that, with the startup phase and the rows committed so
+# far by a seeding load (in any worker).
+@app.get("/api/ready")
+async def ready():
+    body = startup.status()
+    if body['phase'] == 'seeding':
+        body['rows_loaded'] = await db_executor.run(startup.rows_loaded)
+    return JSONResponse(status_code=200 if body['ready'] else 503, content=body)
+
+# GET /api/stats/pool
+# Purpose: exposes connection pool counters (hits, waits, open connections) for scraping, plus
+# the file being served and snapshot swaps / drained connections in snapshot mode.
+@app.get("/api/stats/pool")
+def pool_stats():
+    return pool.stats()
+
+# GET /api/stats/executor
+# Purpose: exposes DB executor counters (queue depth, running jobs, rejections, timeouts, wait time).
+@app.get("/api/stats/executor")
+def executor_stats():
+    return {'query': db_executor.stats(), 'export': export_executor.stats()}
+
+# GET /api/stats/cache
+# Purpose: exposes response cache counters (hits, misses, evictions, invalidations) and the
+# filter compiler's cache counters under `compiled_filters`.
+@app.get("/api/stats/cache")
+def cache_stats():
+    return {**response_cache.stats(), 'compiled_filters': compile_filter.cache_info()._asdict()}
+
+# GET /api/stats/slow-queries
+# Purpose: the most recent statements slower than FOOT_TRAFFIC_SLOW_QUERY_MS with their SQL,
+# parameters and EXPLAIN QUERY PLAN, newest first (they are also logged as warnings).
+@app.get("/api/stats/slow-queries")
+def slow_query_stats():
+    return list(reversed(metrics.slow_queries))
+
+# GET /metrics
+# Purpose: Prometheus scrape endpoint: request latency histograms per route, DB and JSON encoding
+# time, rows fetched, SQLite VM steps, cache outcomes and slow queries (src/metrics.py), plus the
+# pool, executor and response cache counters as gauges.
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    gauges = [
+        ('db_pool', 'Connection pool counters.', {
+            (('stat', k),): v for k, v in pool.stats().items() if isinstance(v, (int, float))}),
+        ('db_executor', 'DB executor counters per lane.', {
+            (('executor', ex.name), ('stat', k)): v
+            for ex in (db_executor, export_executor) for k, v in ex.stats().items()}),
+        ('response_cache', 'Response cache counters.', {
+            (('stat', k),): v for k, v in response_cache.stats().items() if isinstance(v, (int, float))}),
+    ]
+    return PlainTextResponse(metrics.render(gauges), media_type='text/plain; version=0.0.4')
 
 # GET /api/pois
 # Purpose: returns a sorted list of distinct POI names present in the venues table.
 # NOTE: this endpoint is no longer used by the frontend. It is kept for
 # backward-compatibility. 
 @app.get("/api/pois", deprecated=True)
-def get_pois():
+async def get_pois():
     """Return distinct venue names (POIs) from the venues table.
 
     Deprecated: frontend uses `/api/venues` and `/api/distinct/{field}` instead.
     """
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT DISTINCT name FROM venues ORDER BY name;")
-    rows = [r[0] for r in cur.fetchall()]
-    conn.close()
-    return rows
+    def work(conn):
+        cur = conn.cursor()
+        cur.execute("SELECT DISTINCT name FROM venues ORDER BY name;")
+        return [r[0] for r in cur.fetchall()]
+
+    return await db_executor.run(work)
 
 # GET /api/distinct/{field}
 # Purpose: returns distinct values for specified fields with optional filtering.
 # in used by frontend to populate filter dropdowns for chain, category, DMA.
+# Suggestions come from the in-memory typeahead index (src/typeahead.py), rebuilt when the data
+# version changes: values starting with `q` rank first, then other values containing it, each
+# group ordered by venue count. `counts=true` returns [{"value", "count"}] instead of strings.
 @app.get("/api/distinct/{field}")
-def get_distinct(field: str, q: Optional[str] = Query(default=None)):
-    """Return distinct values for supported fields: 'chain', 'category', 'dma', 'name'.
+async def get_distinct(
+    field: str,
+    q: Optional[str] = Query(default=None),
+    limit: Optional[int] = Query(default=None, ge=1, le=500),
+    counts: bool = Query(default=False),
+):
+    """Return distinct values for supported fields: 'chain', 'category', 'dma', 'city', 'state', 'name'.
     Optional query `q` filters suggestions using partial, case-insensitive match.
     """
-    # supported suggestion fields for frontend filters
-    mapping = {
-        'chain': 'chain_name',
-        'category': 'sub_category',
-        'dma': 'dma',
-    }
-    col = mapping.get(field)
-    if not col:
+    if field not in typeahead.FIELDS:
         raise HTTPException(status_code=400, detail='unsupported field')
 
-    conn = get_conn()
-    cur = conn.cursor()
+    # the index is only (re)built when the data version changed
+    index = (await db_executor.run(lambda conn: typeahead.get_index(conn, get_data_version(conn)))).fields[field]
     if q:
-        sql = f"SELECT DISTINCT {col} FROM venues WHERE {col} IS NOT NULL AND {col} <> '' AND {col} LIKE ? COLLATE NOCASE ORDER BY {col} LIMIT 100;"
-        cur.execute(sql, (f"%{q}%",))
+        pairs = index.suggest(q, limit or 100)
     else:
-        sql = f"SELECT DISTINCT {col} FROM venues WHERE {col} IS NOT NULL AND {col} <> '' ORDER BY {col} LIMIT 500;"
-        cur.execute(sql)
-    rows = [r[0] for r in cur.fetchall()]
-    conn.close()
-    return rows
+        pairs = index.listing(limit or 500)
+    if counts:
+        return [{"value": v, "count": c} for v, c in pairs]
+    return [v for v, _ in pairs]
+
+
+# Parse the location filters shared by the venue endpoints.
+# Purpose: `bbox` is 'west,south,east,north' in degrees (west > east crosses the antimeridian);
+# `lat` + `lon` + `radius_mi` select the venues within radius_mi miles of a point. Returns
+# (bbox, radius) tuples for VenueFilter.
+def geo_filters(bbox, lat, lon, radius_mi):
+    box = None
+    if bbox:
+        try:
+            box = parse_bbox(bbox)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f'invalid bbox: {e}')
+    radius = None
+    if radius_mi is not None:
+        if lat is None or lon is None:
+            raise HTTPException(status_code=400, detail='radius_mi needs lat and lon')
+        radius = (lat, lon, radius_mi)
+    return box, radius
+
+# Filter params shared by the venue endpoints.
+# Purpose: endpoints take `f: VenueFilter = Depends(venue_filter)` (or base_filter, without the
+# location filters) instead of repeating the params. The canonical VenueFilter is compiled once
+# by filters.compile_filter and is the filter part of every cache key.
+async def base_filter(
+    chain: Optional[List[str]] = Query(default=None),
+    category: Optional[List[str]] = Query(default=None),
+    dma: Optional[List[str]] = Query(default=None),
+    city: Optional[str] = Query(default=None),
+    state: Optional[str] = Query(default=None),
+    open_status: Optional[str] = Query(default=None),  # 'open'|'closed'|'all'
+    match: str = Query(default='contains', pattern=MATCH_PATTERN),  # 'exact'|'prefix'|'contains'
+) -> VenueFilter:
+    return VenueFilter.create(chain, category, dma, city, state, open_status, match)
+
+async def venue_filter(
+    base: VenueFilter = Depends(base_filter),
+    bbox: Optional[str] = Query(default=None),  # 'west,south,east,north'
+    lat: Optional[float] = Query(default=None, ge=-90, le=90),
+    lon: Optional[float] = Query(default=None, ge=-180, le=180),
+    radius_mi: Optional[float] = Query(default=None, gt=0, le=NEAREST_MAX_MI),
+) -> VenueFilter:
+    box, radius = geo_filters(bbox, lat, lon, radius_mi)
+    return dataclasses.replace(base, bbox=box, radius=radius)
+
+# Serve a JSON body from the response cache, with ETag / If-None-Match support.
+# Purpose: the ETag is derived from the data version and the canonical key, so a client
+# revalidating an unchanged result gets a 304 without the query (or the cache) being touched.
+def cached_json(request: Request, version, key, compute):
+    etag = make_etag(version, key)
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        metrics.record_cache('revalidated')
+        return Response(status_code=304, headers=headers)
+    computed = False
+
+    def render():
+        nonlocal computed
+        computed = True
+        data = compute()
+        with metrics.serialize_time():
+            return serialize.dumps(data)
+
+    body = response_cache.get_or_compute(version, key, render)
+    metrics.record_cache('miss' if computed else 'hit')
+    return Response(content=body, media_type='application/json', headers=headers)
+
+# Run compute(conn, version) on the DB executor and serve it through cached_json.
+# Purpose: the data version lookup, the cache check and the query share one pooled connection
+# and one worker thread, so the event loop only awaits the finished response.
+async def run_cached(request: Request, key, compute):
+    def work(conn):
+        version = get_data_version(conn)
+        return cached_json(request, version, key, lambda: compute(conn, version))
+    return await db_executor.run(work)
 
 
 # GET /api/venues
 # Purpose: returns a paginated list of venues with optional filtering by chain, category, DMA.
+# Pagination is either by `page` (LIMIT/OFFSET) or by the `after` cursor returned as
+# `next_cursor` on every page; cursor pages cost the same no matter how deep they are.
+# `count` controls the total: 'exact' (COUNT(*) per request), 'cached' (reuse the count for
+# the same filters until the data changes) or 'none' (total is null).
+# `shape=columns` returns {"columns": [...], "rows": [[...]]} instead of one object per item,
+# which is cheaper to build, encode and parse at large page sizes.
+# `sort` is 'name' (default) or a metric (foot_traffic, sales, avg_dwell_time_min, ft_per_sqft,
+# area_sqft) with `order` desc (default) / asc; metric lists walk the (metric, id) index or sort a
+# few selective matches (ranking.fetch_sorted), or read the column stores' precomputed order.
+# They leave out venues without the metric and page the same way.
+# Responses are cached per canonical filter set and carry an ETag for conditional requests.
 @app.get("/api/venues")
-def list_venues(
+async def list_venues(
+    request: Request,
     page: int = Query(default=1, ge=1),
     per_page: int = Query(default=50, ge=1, le=500),
-    chain: Optional[List[str]] = Query(default=None),
-    category: Optional[List[str]] = Query(default=None),
-    dma: Optional[List[str]] = Query(default=None),
-    city: Optional[str] = Query(default=None),
-    state: Optional[str] = Query(default=None),
-    open_status: Optional[str] = Query(default=None),  # 'open'|'closed'|'all'
+    after: Optional[str] = Query(default=None),
+    count: str = Query(default='exact', pattern='^(exact|cached|none)$'),
+    shape: str = Query(default='objects', pattern=SHAPE_PATTERN),
+    sort: str = Query(default='name', pattern=SORT_PATTERN),
+    order: Optional[str] = Query(default=None, pattern=ORDER_PATTERN),
+    f: VenueFilter = Depends(venue_filter),
+):
+    # Multiple values per field are ORed together and different fields are ANDed.
+    # `match` picks exact / prefix / contains matching for chain, category and dma;
+    # the default 'contains' keeps the original partial, case-insensitive behavior.
+    sort_by = parse_sort(sort, order)
+    where_sql, params = compile_filter(f)
+    where_sql = sort_where(where_sql, sort_by)
+    base_sql = "FROM venues" + where_sql
+
+    cursor = decode_cursor(after, sort_by) if after else None
+    offset = 0 if cursor else (page - 1) * per_page
+
+    def compute(conn, version):
+        # one extra row tells us whether there is a next page
+        if columnar.enabled():
+            store = columnar.get_store(conn, version)
+            mask = store.mask(f)
+            if sort_by is None:
+                rows = store.page(mask, per_page + 1, offset, cursor)
+            else:
+                mask &= store.has_metric(sort_by[0])
+                rows = store.sorted_page(mask, sort_by, per_page + 1, offset, cursor)
+            total = int(mask.sum()) if count != 'none' else None
+        else:
+            cur = conn.cursor()
+            # total count for pagination
+            count_sql = f"SELECT COUNT(*) {base_sql};"
+            total = None
+            if count == 'exact':
+                cur.execute(count_sql, params)
+                total = cur.fetchone()[0]
+            elif count == 'cached':
+                total = response_cache.get_or_compute(
+                    version, ('count', f, sort_by and sort_by[0]), lambda: cur.execute(count_sql, params).fetchone()[0])
+            if sort_by is None:
+                rows = fetch_page(cur, where_sql, params, per_page, offset, cursor)
+            else:
+                rows = ranking.fetch_sorted(cur, f, sort_by, per_page, offset, cursor)
+        body, next_cursor = finish_page(rows, per_page, shape, sort_by)
+
+        return {
+            "page": page,
+            "per_page": per_page,
+            "total": total,
+            "next_cursor": next_cursor,
+            **body,
+        }
+
+    return await run_cached(request, ('venues', f, page, per_page, after, count, shape, sort_by), compute)
+
+
+# GET /api/venues/top
+# Purpose: the k venues with the highest (order=desc, default) or lowest `metric` among the
+# filtered venues, each with its metric `value`, its `rank` in this list and its standing within
+# its chain: `chain_rank` (1 = the chain's highest), `chain_size` and `chain_percentile` (share
+# of the chain's venues at or below it, computed over the whole chain, not just the filtered set).
+# Rows come from the metric-ordered list like /api/venues?sort=<metric>, so large filtered sets
+# are never sorted; chain standings come from per-chain sorted values (src/ranking.py).
+@app.get("/api/venues/top")
+async def top_venues(
+    request: Request,
+    metric: str = Query(default='foot_traffic', pattern='^(' + '|'.join(SORT_METRICS) + ')$'),
+    k: int = Query(default=50, ge=1, le=ranking.TOP_MAX),
+    order: str = Query(default='desc', pattern=ORDER_PATTERN),
+    f: VenueFilter = Depends(venue_filter),
 ):
-    where = []
-    params = []
-    # Support multiple selections for chain/category/dma. Each provided value will be
-    # matched case-insensitively and partially (LIKE '%value%'). Multiple values per
-    # field are ORed together and different fields are ANDed.
-    def add_multi_like(field_vals, column_name):
-        if not field_vals:
-            return
-        # ignore the sentinel 'all' entries
-        vals = [v for v in field_vals if v and v.lower() != 'all']
-        if not vals:
-            return
-        sub = []
-        for v in vals:
-            sub.append(f"{column_name} LIKE ? COLLATE NOCASE")
-            params.append(f"%{v}%")
-        where.append("(" + " OR ".join(sub) + ")")
-
-    add_multi_like(chain, 'chain_name')
-    add_multi_like(category, 'sub_category')
-    add_multi_like(dma, 'dma')
-    if city and city.lower() != 'all':
-        where.append("city = ?")
-        params.append(city)
-    if state and state.lower() != 'all':
-        where.append("state_name = ?")
-        params.append(state)
-    # filter by open/closed status
-    if open_status:
-        if open_status.lower() == 'open':
-            where.append("(date_closed IS NULL OR date_closed = '')")
-        elif open_status.lower() == 'closed':
-            where.append("(date_closed IS NOT NULL AND date_closed <> '')")
-
-    base_sql = "FROM venues"
-    if where:
-        base_sql += " WHERE " + " AND ".join(where)
-
-    conn = get_conn()
-    cur = conn.cursor()
-    # total count for pagination
-    count_sql = f"SELECT COUNT(*) {base_sql};"
-    cur.execute(count_sql, params)
-    total = cur.fetchone()[0]
-
-    # paginated select
-    offset = (page - 1) * per_page
-    select_sql = f"SELECT id, entity_id, name, chain_name, sub_category, dma, city, state_name, foot_traffic, date_opened, date_closed {base_sql} ORDER BY name COLLATE NOCASE ASC LIMIT ? OFFSET ?;"
-    exec_params = list(params) + [per_page, offset]
-    cur.execute(select_sql, exec_params)
-    rows = cur.fetchall()
-    conn.close()
-
-    items = []
-    for r in rows:
-        items.append({
-            "id": r[0],
-            "entity_id": r[1],
-            "name": r[2],
-            "chain_name": r[3],
-            "category": r[4],
-            "dma": r[5],
-            "city": r[6],
-            "state": r[7],
-            "foot_traffic": r[8] or 0,
-            "date_opened": r[9],
-            "date_closed": r[10],
-        })
-
-    return {
-        "page": page,
-        "per_page": per_page,
-        "total": total,
-        "items": items,
-    }
+    sort_by = (metric, order)
+
+    def compute(conn, version):
+        if columnar.enabled():
+            store = columnar.get_store(conn, version)
+            rows = store.sorted_page(store.mask(f), sort_by, k)
+        else:
+            rows = ranking.fetch_sorted(conn.cursor(), f, sort_by, k)[:k]
+        ranks = ranking.get_chain_ranks(conn, metric, version)
+        return {"metric": metric, "order": order, "k": k, "items": ranking.top_items(rows, ranks)}
+
+    return await run_cached(request, ('top', f, metric, k, order), compute)
 
 
 # GET /api/venues/summary
-# Purpose: returns summary statistics about venues with optional filtering.
+# Purpose: returns summary statistics about venues with optional filtering (cached like /api/venues).
+# Unfiltered and exact-match requests read the precomputed rollups instead of the venues table.
+# `accuracy=approx` answers from the stratified sample and per-state sketches (src/approx.py)
+# in milliseconds at any table size: estimated totals plus distinct chains / cities and
+# foot_traffic / ft_per_sqft quantiles, each with a 95% error bound (a rank error in percentile
+# points for quantiles) and its source.
 @app.get("/api/venues/summary")
-def venues_summary(
-    chain: Optional[List[str]] = Query(default=None),
-    category: Optional[List[str]] = Query(default=None),
-    dma: Optional[List[str]] = Query(default=None),
-    city: Optional[str] = Query(default=None),
-    state: Optional[str] = Query(default=None),
-    open_status: Optional[str] = Query(default=None),
+async def venues_summary(
+    request: Request,
+    accuracy: str = Query(default='exact', pattern='^(exact|approx)$'),
+    f: VenueFilter = Depends(venue_filter),
 ):
-    where = []
-    params = []
-    # support multiple values (ORed) and partial case-insensitive matching
-    def add_multi_like(field_vals, column_name):
-        if not field_vals:
-            return
-        vals = [v for v in field_vals if v and v.lower() != 'all']
-        if not vals:
-            return
-        sub = []
-        for v in vals:
-            sub.append(f"{column_name} LIKE ? COLLATE NOCASE")
-            params.append(f"%{v}%")
-        where.append("(" + " OR ".join(sub) + ")")
-
-    add_multi_like(chain, 'chain_name')
-    add_multi_like(category, 'sub_category')
-    add_multi_like(dma, 'dma')
-    if city and city.lower() != 'all':
-        where.append("city = ?")
-        params.append(city)
-    if state and state.lower() != 'all':
-        where.append("state_name = ?")
-        params.append(state)
-    if open_status:
-        if open_status.lower() == 'open':
-            where.append("(date_closed IS NULL OR date_closed = '')")
-        elif open_status.lower() == 'closed':
-            where.append("(date_closed IS NOT NULL AND date_closed <> '')")
-
-    sql = "SELECT COUNT(*), COALESCE(SUM(foot_traffic),0) "
-    sql += "FROM venues"
-    if where:
-        sql += " WHERE " + " AND ".join(where)
-
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(sql, params)
-    cnt, total_ft = cur.fetchone()
-    conn.close()
-    return {"venues": cnt or 0, "total_foot_traffic": total_ft or 0}
-
-    conn.close()
-
-
-
+    where_sql, params = compile_filter(f)
+    sql = "SELECT COUNT(*), COALESCE(SUM(foot_traffic),0) FROM venues" + where_sql
+
+    def compute(conn, version):
+        if accuracy == 'approx':
+            return approx.summarize(conn, f, version)
+        if columnar.enabled():
+            store = columnar.get_store(conn, version)
+            return store.summary(store.mask(f))
+        # exact-match filters on rollup dimensions are answered from venue_rollups
+        rollup = rollup_where(f)
+        if rollup is not None:
+            return rollup_summary(conn, *rollup)
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        cnt, total_ft = cur.fetchone()
+        return {"venues": cnt or 0, "total_foot_traffic": total_ft or 0}
+
+    key = ('summary', f, accuracy)
+    return await run_cached(request, key, compute)
+
+
+
+# GET /api/venues/aggregate
+# Purpose: group-by aggregation over the filtered venues so charts get pre-aggregated rows.
+# `group_by` is one of chain, category, dma, state, city, open_year; `metric` (repeatable) is
+# 'count' or '<func>:<column>' with func sum/avg/min/max/pNN (e.g. p90) and column one of
+# foot_traffic, sales, avg_dwell_time_min, ft_per_sqft, area_sqft. Groups are sorted by
+# `order_by` (default: first metric) and limited to the top `limit`.
+@app.get("/api/venues/aggregate")
+async def venues_aggregate(
+    request: Request,
+    group_by: str = Query(...),
+    metric: Optional[List[str]] = Query(default=None),
+    order_by: Optional[str] = Query(default=None),
+    order: str = Query(default='desc', pattern='^(asc|desc)$'),
+    limit: int = Query(default=50, ge=1, le=MAX_LIMIT),
+    f: VenueFilter = Depends(venue_filter),
+):
+    if group_by not in GROUP_COLUMNS:
+        raise HTTPException(status_code=400, detail='unsupported group_by')
+    where_sql, params = compile_filter(f)
+
+    def compute(conn, version):
+        return aggregate(conn, where_sql, params, group_by, metric, order_by, order == 'desc', limit)
+
+    key = ('aggregate', f, group_by, tuple(metric or ()), order_by, order, limit)
+    return await run_cached(request, key, compute)
+
+
+# GET /api/venues/timeseries
+# Purpose: foot traffic, sales and dwell time over time for the filtered venues, from the
+# metrics history (src/timeseries.py, loaded with load_csv.py --metrics). `start` / `end`
+# (YYYY-MM-DD, default: the stored range) bound the dates; `interval` is day, week, month or
+# auto (the finest with at most 400 points), so charts get pre-aggregated points, not raw rows.
+# Accepts the same filters as /api/venues; cached like /api/venues/summary.
+@app.get("/api/venues/timeseries")
+async def venues_timeseries(
+    request: Request,
+    start: Optional[datetime.date] = Query(default=None),
+    end: Optional[datetime.date] = Query(default=None),
+    interval: str = Query(default='auto', pattern=INTERVAL_PATTERN),
+    f: VenueFilter = Depends(venue_filter),
+):
+    first = None if start is None else to_day(start)
+    last = None if end is None else to_day(end)
+    if first is not None and last is not None and first > last:
+        raise HTTPException(status_code=400, detail='start is after end')
+    where_sql, params = compile_filter(f)
+
+    def compute(conn, version):
+        try:
+            return timeseries(conn, where_sql, params, first, last, interval)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    key = ('timeseries', f, first, last, interval)
+    return await run_cached(request, key, compute)
+
+
+# GET /api/venues/nearest
+# Purpose: the `k` venues closest to (lat, lon), nearest first, each with its distance in miles.
+# Accepts the same filters as /api/venues (e.g. "the 5 nearest open Walmarts"); the search
+# widens an R*Tree window around the point until it holds k matches.
+@app.get("/api/venues/nearest")
+async def venues_nearest(
+    request: Request,
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    k: int = Query(default=10, ge=1, le=100),
+    f: VenueFilter = Depends(base_filter),
+):
+    where_sql, params = compile_filter(f)
+    columns = "id, entity_id, name, chain_name, sub_category, dma, city, state_name, foot_traffic, lat, lon"
+
+    def compute(conn, version):
+        items = []
+        for distance, r in nearest(conn, lat, lon, k, columns, where_sql, params):
+            items.append({
+                "id": r[0],
+                "entity_id": r[1],
+                "name": r[2],
+                "chain_name": r[3],
+                "category": r[4],
+                "dma": r[5],
+                "city": r[6],
+                "state": r[7],
+                "foot_traffic": r[8] or 0,
+                "lat": r[9],
+                "lon": r[10],
+                "distance_mi": round(distance, 3),
+            })
+        return {"lat": lat, "lon": lon, "k": k, "items": items}
+
+    key = ('nearest', f, lat, lon, k)
+    return await run_cached(request, key, compute)
+
+
+# POST /api/batch
+# Purpose: one filter spec, several outputs in one response: a page of items (as /api/venues),
+# the summary, group-by aggregates and per-field facet counts. The filters are compiled once and
+# the matching ids materialized in a temp table shared by every output (src/batch.py).
+# Body: {"filters": {...same fields as the /api/venues params...}, "items": {"page", "per_page",
+# "after", "count"}, "summary": true, "aggregates": [{"group_by", "metric", ...}],
+# "distinct": [{"field", "limit"}]}. Omitted outputs are not computed.
+@app.post("/api/batch")
+async def batch_query(request: Request, spec: batch.BatchRequest):
+    batch.validate(spec)
+    fs = spec.filters
+    f = VenueFilter.create(fs.chain, fs.category, fs.dma, fs.city, fs.state, fs.open_status, fs.match,
+                           *geo_filters(fs.bbox, fs.lat, fs.lon, fs.radius_mi))
+    where_sql, params = compile_filter(f)
+
+    def compute(conn, version):
+        return batch.run_batch(conn, spec, where_sql, params)
+
+    key = ('batch', f, spec.model_dump_json(exclude={'filters'}))
+    return await run_cached(request, key, compute)
+
+
+# GET /api/venues/export
+# Purpose: streams the filtered venues as CSV (default), NDJSON or Parquet (requires pyarrow).
+# `columns` (repeatable or comma-separated) picks the fields, e.g. columns=name,sales,area_sqft.
+# `compress` is auto (negotiated from Accept-Encoding), gzip, zstd (requires zstandard) or none.
+# Rows are streamed in batches (src/export.py) on the export executor, which holds one pooled
+# connection for the stream and runs each chunk in a worker thread, so memory stays flat however
+# many rows match and exports can't take the threads interactive queries run on.
 @app.get("/api/venues/export")
-def export_venues(
-    chain: Optional[List[str]] = Query(default=None),
-    category: Optional[List[str]] = Query(default=None),
-    dma: Optional[List[str]] = Query(default=None),
-    city: Optional[str] = Query(default=None),
-    state: Optional[str] = Query(default=None),
-    open_status: Optional[str] = Query(default=None),
+async def export_venues(
+    request: Request,
+    f: VenueFilter = Depends(venue_filter),
+    format: str = Query(default='csv', pattern='^(csv|ndjson|parquet)$'),
+    columns: Optional[List[str]] = Query(default=None),
+    compress: str = Query(default='auto', pattern='^(auto|gzip|zstd|none)$'),
 ):
-    """Export filtered venues as CSV. Uses the same filter semantics as /api/venues."""
-    where = []
-    params = []
-    def add_multi_like(field_vals, column_name):
-        if not field_vals:
-            return
-        vals = [v for v in field_vals if v and v.lower() != 'all']
-        if not vals:
-            return
-        sub = []
-        for v in vals:
-            sub.append(f"{column_name} LIKE ? COLLATE NOCASE")
-            params.append(f"%{v}%")
-        where.append("(" + " OR ".join(sub) + ")")
-
-    add_multi_like(chain, 'chain_name')
-    add_multi_like(category, 'sub_category')
-    add_multi_like(dma, 'dma')
-    if city and city.lower() != 'all':
-        where.append("city = ?")
-        params.append(city)
-    if state and state.lower() != 'all':
-        where.append("state_name = ?")
-        params.append(state)
-    if open_status:
-        if open_status.lower() == 'open':
-            where.append("(date_closed IS NULL OR date_closed = '')")
-        elif open_status.lower() == 'closed':
-            where.append("(date_closed IS NOT NULL AND date_closed <> '')")
-
-    base_sql = "FROM venues"
-    if where:
-        base_sql += " WHERE " + " AND ".join(where)
-
-    conn = get_conn()
-    cur = conn.cursor()
-    select_sql = f"SELECT id, entity_id, name, chain_name, sub_category, dma, city, state_name, foot_traffic, date_opened, date_closed {base_sql} ORDER BY name COLLATE NOCASE;"
-    cur.execute(select_sql, params)
-    rows = cur.fetchall()
-    conn.close()
-
-    def iter_csv():
-        buf = io.StringIO()
-        writer = csv.writer(buf)
-        headers = ['id', 'entity_id', 'name', 'chain_name', 'category', 'dma', 'city', 'state', 'foot_traffic', 'date_opened', 'date_closed']
-        writer.writerow(headers)
-        yield buf.getvalue()
-        buf.seek(0); buf.truncate(0)
-        for r in rows:
-            writer.writerow([
-                r[0], r[1], r[2], r[3], r[4], r[5], r[6], r[7], r[8] or 0, r[9], r[10]
-            ])
-            yield buf.getvalue()
-            buf.seek(0); buf.truncate(0)
-
-    return StreamingResponse(iter_csv(), media_type='text/csv', headers={
-        'Content-Disposition': 'attachment; filename="venues.csv"'
-    })
\ No newline at end of file
+    """Export filtered venues. Uses the same filter semantics as /api/venues."""
+    where_sql, params = compile_filter(f)
+    try:
+        cols = export.resolve_columns(columns)
+        # Parquet pages are compressed internally
+        encoding = None if format == 'parquet' else export.pick_encoding(compress, request.headers.get('accept-encoding'))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if format == 'parquet' and not export.PARQUET_AVAILABLE:
+        raise HTTPException(status_code=400, detail='parquet export requires the pyarrow package')
+
+    media_type, extension = export.FORMATS[format]
+    headers = {'Content-Disposition': f'attachment; filename="venues.{extension}"', 'Vary': 'Accept-Encoding'}
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    body = export_executor.stream(export.stream, format, cols, where_sql, params, encoding)
+    return StreamingResponse(body, media_type=media_type, headers=headers)
@@ -0,0 +1,384 @@
+# Approximate venue summaries (GET /api/venues/summary?accuracy=approx).
+# Purpose: an exact summary reads every matching venue, which at tens of millions of rows takes
+# seconds. Two structures maintained at ingest answer in milliseconds instead, with error bounds:
+#   venue_sample    a stratified Bernoulli sample (stratum = state, about SAMPLE_SIZE rows with at
+#                   least MIN_PER_STRATUM per state). A venue is in it when a hash of its id falls
+#                   below its stratum's rate, so triggers keep it current on every insert / update
+#                   / delete, and each row carries its inclusion probability p. Count and sum are
+#                   Horvitz-Thompson estimates (each row stands for 1/p venues) with a 95% interval
+#                   from their variance; quantiles come from a t-digest of the weighted rows, with
+#                   a rank error adding the digest's error to the sample's.
+#   venue_sketches  per (state, open/closed) HyperLogLogs of chains and cities and t-digests of
+#                   foot_traffic and ft_per_sqft. Triggers record the states whose venues changed
+#                   in venue_sketch_dirty and a load rebuilds only their sketches. Filters on state
+#                   and open_status alone merge the matching sketches (and read exact totals from
+#                   venue_rollups); quantile errors are the merged digest's rank error.
+# Filters matching fewer than MIN_MATCHES sample rows are answered exactly, from the venues table,
+# since an estimate from a handful of rows has no useful bound.
+# Interaction: db.ensure_schema() installs the tables and triggers (dropped and rebuilt around
+# deferred bulk loads like the other derived structures, after which every sketch is rebuilt); ingest.bulk_load() calls refresh() after
+# each successful load that changed venues and keep_current() after one that only changed metrics;
+# app.venues_summary calls summarize() and ranking.fetch_sorted() plans with estimate_matches().
+# Filters are compiled for the sample with filters.compile_scan_filter(). Data structures:
+# src/sketches.py.
+
+import os
+
+from .aggregate import percentile
+from .filters import compile_filter, compile_scan_filter
+from .rollups import rollup_summary, rollup_where
+from .sketches import HyperLogLog, TDigest
+
+# Target sample rows, spread over states in proportion to their venues.
+SAMPLE_SIZE = int(os.environ.get('FOOT_TRAFFIC_SAMPLE_SIZE', '20000'))
+
+# Smallest sample per state (all of the state's venues when it has fewer).
+MIN_PER_STRATUM = 200
+
+# Below this many matching sample rows the answer is computed exactly.
+MIN_MATCHES = 30
+
+# 95% two-sided normal interval.
+CONFIDENCE = 0.95
+Z = 1.96
+
+QUANTILES = (50, 90, 99)
+QUANTILE_COLUMNS = ('foot_traffic', 'ft_per_sqft')
+
+# Columns copied into the sample: everything compile_scan_filter() and the estimates read.
+SAMPLE_COLUMNS = ('chain_name', 'sub_category', 'dma', 'city', 'state_name', 'date_closed', 'lat', 'lon',
+                  'foot_traffic', 'ft_per_sqft')
+
+SAMPLE_TABLES_SQL = (
+    '''CREATE TABLE IF NOT EXISTS venue_sample_strata (
+        stratum TEXT PRIMARY KEY,
+        venues INTEGER NOT NULL,
+        rate REAL NOT NULL
+    ) WITHOUT ROWID;''',
+    '''CREATE TABLE IF NOT EXISTS venue_sample (
+        id INTEGER PRIMARY KEY,
+        p REAL NOT NULL,
+        chain_name TEXT,
+        sub_category TEXT,
+        dma TEXT,
+        city TEXT,
+        state_name TEXT,
+        date_closed TEXT,
+        lat REAL,
+        lon REAL,
+        foot_traffic INTEGER,
+        ft_per_sqft REAL,
+        chain_key TEXT GENERATED ALWAYS AS (lower(chain_name)) VIRTUAL,
+        category_key TEXT GENERATED ALWAYS AS (lower(sub_category)) VIRTUAL,
+        dma_key TEXT GENERATED ALWAYS AS (lower(dma)) VIRTUAL
+    );''',
+    '''CREATE TABLE IF NOT EXISTS venue_sketches (
+        state_name TEXT NOT NULL,
+        is_closed INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (state_name, is_closed, name)
+    ) WITHOUT ROWID;''',
+    '''CREATE TABLE IF NOT EXISTS venue_sketch_dirty (
+        state_name TEXT PRIMARY KEY
+    ) WITHOUT ROWID;''',
+)
+
+# A multiplicative hash of the id spread over [0, 2**32): deterministic, so the same venue is
+# always in or out of the sample for a given rate, and computable inside a trigger.
+_HASH = '(({r}.id * 2654435761) % 4294967296)'
+
+_COLUMNS = ', '.join(SAMPLE_COLUMNS)
+
+# Venues of a state the sample hasn't seen yet are all kept (rate 1) until the next rebuild.
+_SAMPLE_NEW = f'''INSERT INTO venue_sample (id, p, {_COLUMNS})
+        SELECT new.id, rate, {', '.join('new.' + c for c in SAMPLE_COLUMNS)}
+        FROM (SELECT COALESCE((SELECT rate FROM venue_sample_strata WHERE stratum = COALESCE(new.state_name, '')), 1.0) AS rate)
+        WHERE {_HASH.format(r='new')} < rate * 4294967296;'''
+
+SAMPLE_TRIGGERS = ('venue_sample_ai', 'venue_sample_ad', 'venue_sample_au')
+
+SAMPLE_TRIGGERS_SQL = (
+    f'''CREATE TRIGGER IF NOT EXISTS venue_sample_ai AFTER INSERT ON venues BEGIN
+        {_SAMPLE_NEW}
+    END;''',
+    '''CREATE TRIGGER IF NOT EXISTS venue_sample_ad AFTER DELETE ON venues BEGIN
+        DELETE FROM venue_sample WHERE id = old.id;
+    END;''',
+    f'''CREATE TRIGGER IF NOT EXISTS venue_sample_au AFTER UPDATE OF {_COLUMNS} ON venues BEGIN
+        DELETE FROM venue_sample WHERE id = old.id;
+        {_SAMPLE_NEW}
+    END;''',
+)
+
+# Sketch key: rollups store missing states as '' too.
+_SKETCH_STATE = "COALESCE({r}.state_name, '')"
+_SKETCH_KEY = f"{_SKETCH_STATE.format(r='venues')}, (date_closed IS NOT NULL AND date_closed <> '')"
+
+_SKETCH_COLUMNS = ('state_name', 'date_closed', 'chain_name', 'city', *QUANTILE_COLUMNS)
+
+SKETCH_TRIGGERS = ('venue_sketch_ai', 'venue_sketch_ad', 'venue_sketch_au')
+
+# An upsert clause, unlike INSERT OR IGNORE, isn't overridden by the outer statement's conflict
+# resolution (e.g. ingest's ON CONFLICT DO UPDATE).
+SKETCH_TRIGGERS_SQL = (
+    f'''CREATE TRIGGER IF NOT EXISTS venue_sketch_ai AFTER INSERT ON venues BEGIN
+        INSERT INTO venue_sketch_dirty VALUES ({_SKETCH_STATE.format(r='new')}) ON CONFLICT DO NOTHING;
+    END;''',
+    f'''CREATE TRIGGER IF NOT EXISTS venue_sketch_ad AFTER DELETE ON venues BEGIN
+        INSERT INTO venue_sketch_dirty VALUES ({_SKETCH_STATE.format(r='old')}) ON CONFLICT DO NOTHING;
+    END;''',
+    f'''CREATE TRIGGER IF NOT EXISTS venue_sketch_au AFTER UPDATE OF {', '.join(_SKETCH_COLUMNS)} ON venues BEGIN
+        INSERT INTO venue_sketch_dirty VALUES ({_SKETCH_STATE.format(r='old')}), ({_SKETCH_STATE.format(r='new')})
+            ON CONFLICT DO NOTHING;
+    END;''',
+)
+
+_STRATA_SQL = "SELECT state_name, SUM(venues) FROM venue_rollups GROUP BY state_name;"
+
+_SAMPLE_REBUILD_SQL = f'''INSERT INTO venue_sample (id, p, {_COLUMNS})
+    SELECT v.id, s.rate, {', '.join('v.' + c for c in SAMPLE_COLUMNS)}
+    FROM venues v JOIN venue_sample_strata s ON s.stratum = COALESCE(v.state_name, '')
+    WHERE {_HASH.format(r='v')} < s.rate * 4294967296;'''
+
+
+def ensure_approx(conn):
+    """Create the sample and sketch tables and their triggers; fill a new sample from venues."""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'venue_sample';").fetchone()
+    for sql in SAMPLE_TABLES_SQL + SAMPLE_TRIGGERS_SQL + SKETCH_TRIGGERS_SQL:
+        conn.execute(sql)
+    if not exists:
+        rebuild_sample(conn)
+
+
+def allocate(strata, size=None, minimum=MIN_PER_STRATUM):
+    """Sampling rate per stratum: proportional to its venues, at least `minimum` rows (capped at 1)."""
+    size = SAMPLE_SIZE if size is None else size
+    total = sum(strata.values())
+    rates = {}
+    for stratum, venues in strata.items():
+        if venues <= 0:
+            continue
+        wanted = max(minimum, size * venues / total)
+        rates[stratum] = min(1.0, wanted / venues)
+    return rates
+
+
+def rebuild_sample(conn):
+    """Recompute the strata rates from venue_rollups and redraw the sample; call before commit."""
+    strata = dict(conn.execute(_STRATA_SQL).fetchall())
+    conn.execute('DELETE FROM venue_sample_strata;')
+    conn.executemany('INSERT INTO venue_sample_strata (stratum, venues, rate) VALUES (?, ?, ?);',
+                     [(s, strata[s], rate) for s, rate in allocate(strata).items()])
+    conn.execute('DELETE FROM venue_sample;')
+    conn.execute(_SAMPLE_REBUILD_SQL)
+
+
+def sample_drifted(conn):
+    """True when loads since the last rebuild moved the sample far from its target size.
+
+    Rates are fixed between rebuilds, so the sample grows and shrinks with the data (and venues of
+    new states are all kept); estimates stay unbiased, only their cost or precision changes.
+    """
+    rows = conn.execute('SELECT COUNT(*) FROM venue_sample;').fetchone()[0]
+    strata = dict(conn.execute(_STRATA_SQL).fetchall())
+    expected = sum(rate * strata[s] for s, rate in allocate(strata).items())
+    return not expected * 0.5 <= rows <= expected * 2 + MIN_PER_STRATUM
+
+
+def rebuild_sketches(conn, states=None):
+    """Recompute the (state, open/closed) sketches of `states` ('' for none; default every state)
+    from venues; call before commit."""
+    sketches = {}
+    if states is None:
+        where_sql, params = '', []
+    else:
+        params = sorted(states)
+        if not params:
+            return
+        # unary + keeps the planner on the state index rather than the column's
+        where_sql = f" AND (state_name IN ({', '.join('?' * len(params))}){' OR state_name IS NULL' if '' in params else ''})"
+
+    def get(key, name, factory):
+        return sketches.setdefault((*key, name), factory())
+
+    for column, name in (('chain_name', 'chains'), ('city', 'cities')):
+        # a HyperLogLog only needs each distinct value once
+        for state, closed, value in conn.execute(
+                f"SELECT DISTINCT {_SKETCH_KEY}, {column} FROM venues WHERE +{column} IS NOT NULL{where_sql};", params):
+            get((state, closed), name, HyperLogLog).add(value)
+    for column in QUANTILE_COLUMNS:
+        groups = {}
+        for state, closed, value, count in conn.execute(
+                f"SELECT {_SKETCH_KEY}, {column}, COUNT(*) FROM venues WHERE +{column} IS NOT NULL{where_sql} "
+                f"GROUP BY 1, 2, 3 ORDER BY 1, 2, 3;", params):
+            groups.setdefault((state, closed), []).append((value, count))
+        for key, items in groups.items():
+            sketches[(*key, column)] = TDigest.from_sorted(items)
+    if states is None:
+        conn.execute('DELETE FROM venue_sketches;')
+    else:
+        conn.execute(f"DELETE FROM venue_sketches WHERE state_name IN ({', '.join('?' * len(params))});", params)
+    conn.executemany('INSERT INTO venue_sketches (state_name, is_closed, name, data) VALUES (?, ?, ?, ?);',
+                     [(*key, sketch.to_bytes()) for key, sketch in sketches.items()])
+
+
+def refresh(conn, version):
+    """After a load: redraw a drifted sample and bring the sketches to data `version`, rebuilding
+    only the states the triggers marked dirty (every state when no sketches are valid); commits."""
+    if sample_drifted(conn):
+        rebuild_sample(conn)
+    built = conn.execute("SELECT value FROM meta WHERE key = 'sketch_version';").fetchone()
+    if built is None:
+        rebuild_sketches(conn)
+    elif built[0] != version:
+        rebuild_sketches(conn, [r[0] for r in conn.execute('SELECT state_name FROM venue_sketch_dirty;')])
+    conn.execute('DELETE FROM venue_sketch_dirty;')
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sketch_version', ?);", (version,))
+    conn.commit()
+
+
+def invalidate_sketches(conn):
+    """Mark every sketch stale, for when venues change without the triggers (deferred loads)."""
+    conn.execute("DELETE FROM meta WHERE key = 'sketch_version';")
+
+
+def keep_current(conn, before, version):
+    """After a load that left venues unchanged: sketches built for data version `before` stay
+    valid for `version`, and missing ones are rebuilt; commits."""
+    built = conn.execute("SELECT value FROM meta WHERE key = 'sketch_version';").fetchone()
+    if built is None:
+        refresh(conn, version)
+        return
+    conn.execute("UPDATE meta SET value = ? WHERE key = 'sketch_version' AND value = ?;", (version, before))
+    conn.commit()
+
+
+def estimate_matches(conn, f):
+    """Estimated number of venues matching VenueFilter `f`: the sample's count, without bounds."""
+    where_sql, params = compile_scan_filter(f)
+    return conn.execute(f"SELECT TOTAL(1.0 / p) FROM venue_sample{where_sql};", params).fetchone()[0]
+
+
+def sketch_where(f):
+    """(where_sql, params) over venue_sketches for filters on state / open_status only, else None."""
+    if any(values for _, values in f.multi()) or f.city is not None or f.bbox or f.radius:
+        return None
+    where = []
+    params = []
+    if f.state is not None:
+        where.append('state_name = ?')
+        params.append(f.state)
+    if f.open_status is not None:
+        where.append('is_closed = ?')
+        params.append(1 if f.open_status == 'closed' else 0)
+    return (' AND ' + ' AND '.join(where) if where else ''), params
+
+
+def _from_sketches(conn, where_sql, params):
+    parts = {}
+    for name, data in conn.execute(f"SELECT name, data FROM venue_sketches WHERE 1{where_sql};", params):
+        parts.setdefault(name, []).append(data)
+    distinct = {name: HyperLogLog.union(map(HyperLogLog.from_bytes, parts.get(name, ())))
+                for name in ('chains', 'cities')}
+    digests = {column: TDigest.union(map(TDigest.from_bytes, parts.get(column, ())))
+               for column in QUANTILE_COLUMNS}
+    return ({name: round(h.estimate()) for name, h in distinct.items()},
+            {name: round(h.error(Z)) for name, h in distinct.items()},
+            {column: _quantiles(d) for column, d in digests.items()},
+            {column: _rank_errors(d) for column, d in digests.items()})
+
+
+def _quantiles(digest):
+    return {f'p{q}': _round(digest.quantile(q / 100)) for q in QUANTILES}
+
+
+def _rank_errors(digest, effective_n=None):
+    """Half-width, in percentile points, of the ranks each quantile estimate can have: the digest's
+    rank error plus, for a sample of `effective_n` rows, the 95% interval of a sample quantile."""
+    errors = {}
+    for q in QUANTILES:
+        error = digest.rank_error(q / 100)
+        if error is not None and effective_n:
+            error += Z * (q / 100 * (1 - q / 100) / effective_n) ** 0.5
+        errors[f'p{q}'] = None if error is None else round(100 * error, 2)
+    return errors
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+def _exact(conn, f):
+    """The same response computed from venues, for sets too small to estimate."""
+    where_sql, params = compile_filter(f)
+    venues, total, chains, cities = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(foot_traffic), 0), COUNT(DISTINCT chain_name), COUNT(DISTINCT city) "
+        f"FROM venues{where_sql};", params).fetchone()
+    quantiles = {}
+    for column in QUANTILE_COLUMNS:
+        values = [r[0] for r in conn.execute(
+            f"SELECT {column} FROM venues{where_sql}{' AND' if where_sql else ' WHERE'} {column} IS NOT NULL "
+            f"ORDER BY {column};", params)]
+        quantiles[column] = {f'p{q}': _round(percentile(values, q)) for q in QUANTILES}
+    quantile_error = {column: {f'p{q}': 0 for q in QUANTILES} for column in QUANTILE_COLUMNS}
+    return {
+        'venues': venues, 'total_foot_traffic': total, 'distinct': {'chains': chains, 'cities': cities},
+        'quantiles': quantiles, 'error': {'venues': 0, 'total_foot_traffic': 0, 'chains': 0, 'cities': 0,
+                                          'quantiles': quantile_error},
+        'method': {'totals': 'exact', 'distinct': 'exact', 'quantiles': 'exact'}, 'confidence': CONFIDENCE,
+    }
+
+
+def summarize(conn, f, version):
+    """Approximate summary of the venues matching VenueFilter `f` at data `version`.
+
+    Returns venues, total_foot_traffic, distinct chains / cities and foot_traffic / ft_per_sqft
+    quantiles, each with its source under `method` ('exact', 'rollups', 'sketch' or 'sample')
+    and, under `error`, the half-width of its 95% interval (0 when exact). Quantile errors are
+    rank errors in percentile points: a p90 of 120 with error 1.5 means 120 lies between the 88.5th
+    and 91.5th percentiles. Distinct counts are null when neither the sketches nor an exact answer
+    can give them.
+    """
+    where_sql, params = compile_scan_filter(f)
+    cur = conn.execute(
+        "SELECT COUNT(*), TOTAL(1.0 / p), TOTAL((1.0 - p) / (p * p)), "
+        "TOTAL(COALESCE(foot_traffic, 0) / p), TOTAL((1.0 - p) * COALESCE(foot_traffic, 0) * COALESCE(foot_traffic, 0) / (p * p)) "
+        f"FROM venue_sample{where_sql};", params)
+    matched, venues, venues_var, total, total_var = cur.fetchone()
+    if matched < MIN_MATCHES:
+        return _exact(conn, f)
+
+    method = {'totals': 'sample', 'distinct': None, 'quantiles': 'sample'}
+    error = {'venues': round(Z * venues_var ** 0.5), 'total_foot_traffic': round(Z * total_var ** 0.5),
+             'chains': None, 'cities': None}
+    venues, total = round(venues), round(total)
+    rollup = rollup_where(f)
+    if rollup is not None:
+        exact = rollup_summary(conn, *rollup)
+        venues, total = exact['venues'], exact['total_foot_traffic']
+        error.update(venues=0, total_foot_traffic=0)
+        method['totals'] = 'rollups'
+
+    distinct = None
+    sketch = sketch_where(f)
+    built = conn.execute("SELECT value FROM meta WHERE key = 'sketch_version';").fetchone()
+    if sketch is not None and built is not None and built[0] == version:
+        distinct, distinct_error, quantiles, error['quantiles'] = _from_sketches(conn, *sketch)
+        error.update(distinct_error)
+        method.update(distinct='sketch', quantiles='sketch')
+    else:
+        quantiles, error['quantiles'] = {}, {}
+        for column in QUANTILE_COLUMNS:
+            weighted = conn.execute(
+                f"SELECT {column}, TOTAL(1.0 / p), TOTAL(1.0 / (p * p)) FROM venue_sample{where_sql}"
+                f"{' AND' if where_sql else ' WHERE'} {column} IS NOT NULL GROUP BY 1 ORDER BY 1;", params).fetchall()
+            digest = TDigest.from_sorted((value, weight) for value, weight, _ in weighted)
+            # Kish's effective sample size of the weighted rows
+            squares = sum(r[2] for r in weighted)
+            quantiles[column] = _quantiles(digest)
+            error['quantiles'][column] = _rank_errors(digest, digest.total ** 2 / squares if squares else None)
+    return {
+        'venues': venues, 'total_foot_traffic': total, 'distinct': distinct, 'quantiles': quantiles,
+        'error': error, 'method': method, 'confidence': CONFIDENCE,
+    }
@@ -0,0 +1,140 @@
+# POST /api/batch: several outputs for one filter spec in a single round trip.
+# Purpose: the dashboard needs a page of venues, the summary and often group-bys or facet lists
+# for the same filters. A batch compiles the filters once, materializes the matching ids into a
+# temp table and answers every requested output from it on one connection, inside one read
+# transaction, so all outputs see the same snapshot of the data.
+# Interaction: app.batch_query validates the body (BatchRequest) and runs run_batch() on the DB
+# executor; outputs reuse pagination.py and aggregate.py, so they match the single endpoints.
+
+from typing import List, Literal, Optional
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+
+from .aggregate import GROUP_COLUMNS, MAX_LIMIT, aggregate
+from .geo import NEAREST_MAX_MI
+from .pagination import decode_cursor, fetch_page, finish_page
+from .typeahead import FIELDS as DISTINCT_FIELDS
+
+
+class BatchFilters(BaseModel):
+    """Same filters (and semantics) as the /api/venues query params."""
+    chain: Optional[List[str]] = None
+    category: Optional[List[str]] = None
+    dma: Optional[List[str]] = None
+    city: Optional[str] = None
+    state: Optional[str] = None
+    open_status: Optional[str] = None
+    match: Literal['exact', 'prefix', 'contains'] = 'contains'
+    bbox: Optional[str] = None  # 'west,south,east,north'
+    lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    lon: Optional[float] = Field(default=None, ge=-180, le=180)
+    radius_mi: Optional[float] = Field(default=None, gt=0, le=NEAREST_MAX_MI)
+
+
+class ItemsOutput(BaseModel):
+    page: int = Field(default=1, ge=1)
+    per_page: int = Field(default=50, ge=1, le=500)
+    after: Optional[str] = None
+    count: Literal['exact', 'none'] = 'exact'
+    shape: Literal['objects', 'columns'] = 'objects'
+
+
+class AggregateOutput(BaseModel):
+    group_by: str
+    metric: Optional[List[str]] = None
+    order_by: Optional[str] = None
+    order: Literal['asc', 'desc'] = 'desc'
+    limit: int = Field(default=50, ge=1, le=MAX_LIMIT)
+
+
+class DistinctOutput(BaseModel):
+    """Values of `field` among the filtered venues, most venues first (facet counts)."""
+    field: str
+    limit: int = Field(default=100, ge=1, le=500)
+
+
+class BatchRequest(BaseModel):
+    filters: BatchFilters = BatchFilters()
+    items: Optional[ItemsOutput] = None
+    summary: bool = False
+    aggregates: List[AggregateOutput] = []
+    distinct: List[DistinctOutput] = []
+
+
+# Ids of the filtered venues, filled once per batch; lives in the connection's temp schema and
+# is discarded with the batch's transaction.
+BATCH_IDS_SQL = 'CREATE TEMP TABLE IF NOT EXISTS batch_ids (id INTEGER PRIMARY KEY);'
+BATCH_WHERE = ' WHERE id IN (SELECT id FROM temp.batch_ids)'
+
+
+def validate(spec):
+    for out in spec.aggregates:
+        if out.group_by not in GROUP_COLUMNS:
+            raise HTTPException(status_code=400, detail='unsupported group_by')
+    for out in spec.distinct:
+        if out.field not in DISTINCT_FIELDS:
+            raise HTTPException(status_code=400, detail=f'unsupported distinct field: {out.field}')
+    if spec.items and spec.items.after:
+        decode_cursor(spec.items.after)
+
+
+def run_batch(conn, spec, where_sql, params):
+    """Answer every output of `spec` for the venues matching where_sql / params."""
+    # pooled connections are query_only; the temp table is the only thing written, and the
+    # rollback at the end discards it
+    conn.execute('PRAGMA query_only=OFF;')
+    try:
+        conn.execute('BEGIN;')
+        cur = conn.cursor()
+        total = None
+        if where_sql:
+            cur.execute(BATCH_IDS_SQL)
+            cur.execute(f'INSERT INTO temp.batch_ids SELECT id FROM venues{where_sql};', params)
+            total = cur.rowcount
+            where_sql, params = BATCH_WHERE, []
+        return _outputs(cur, conn, spec, where_sql, params, total)
+    finally:
+        conn.rollback()
+        conn.execute('PRAGMA query_only=ON;')
+
+
+def _outputs(cur, conn, spec, where_sql, params, total):
+    # total: number of filtered venues when already known (the size of temp.batch_ids)
+    result = {}
+    summary = None
+    if spec.summary or (spec.items and spec.items.count == 'exact' and total is None):
+        cnt, foot_traffic = cur.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(foot_traffic), 0) FROM venues{where_sql};", params).fetchone()
+        summary = {"venues": cnt or 0, "total_foot_traffic": foot_traffic or 0}
+        total = summary['venues']
+    if spec.summary:
+        result['summary'] = summary
+    if spec.items:
+        out = spec.items
+        cursor = decode_cursor(out.after) if out.after else None
+        offset = 0 if cursor else (out.page - 1) * out.per_page
+        rows = fetch_page(cur, where_sql, params, out.per_page, offset, cursor)
+        body, next_cursor = finish_page(rows, out.per_page, out.shape)
+        result['items'] = {
+            "page": out.page,
+            "per_page": out.per_page,
+            "total": total if out.count == 'exact' else None,
+            "next_cursor": next_cursor,
+            **body,
+        }
+    if spec.aggregates:
+        result['aggregates'] = [
+            aggregate(conn, where_sql, params, a.group_by, a.metric, a.order_by, a.order == 'desc', a.limit)
+            for a in spec.aggregates
+        ]
+    if spec.distinct:
+        result['distinct'] = {}
+        for out in spec.distinct:
+            column = DISTINCT_FIELDS[out.field]
+            cond = f"{column} IS NOT NULL AND {column} <> ''"
+            rows = cur.execute(
+                f"SELECT {column}, COUNT(*) AS n FROM venues{where_sql + ' AND ' if where_sql else ' WHERE '}{cond} "
+                f"GROUP BY {column} ORDER BY n DESC, {column} LIMIT ?;", list(params) + [out.limit]).fetchall()
+            result['distinct'][out.field] = [{"value": v, "count": n} for v, n in rows]
+    return result
@@ -0,0 +1,114 @@
+# In-process response cache for the read endpoints.
+# Purpose: identical filter combinations (the frontend fires /api/venues and /api/venues/summary
+# together on every filter change) are served from memory instead of re-running the SQL.
+# Interaction: entries are tagged with the DB data version (db.get_data_version), which
+# init_db() and load_csv.py bump after writing to venues, so a write invalidates everything.
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_SIZE = int(os.environ.get('FOOT_TRAFFIC_CACHE_SIZE', '1024'))
+CACHE_TTL = float(os.environ.get('FOOT_TRAFFIC_CACHE_TTL', '300'))
+
+
+def make_etag(version, key):
+    digest = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=8).hexdigest()
+    return f'W/"{version}-{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return etag in [t.strip() for t in if_none_match.split(',')]
+
+
+class ResponseCache:
+    """Thread-safe LRU cache with a TTL, keyed on (data version, canonical key).
+
+    When a newer data version is seen every entry is dropped, since all of them describe
+    the old data; requests still running against an older version bypass the cache.
+    Counters: hits, misses, evictions (LRU), expirations (TTL), invalidations.
+    """
+
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_version(self, version):
+        # returns False for a stale version, whose results must not be cached or served
+        if self._version is None or version > self._version:
+            if self._version is not None:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = version
+        return version == self._version
+
+    def get(self, version, key):
+        with self._lock:
+            if not self._check_version(version):
+                self.misses += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, version, key, value):
+        with self._lock:
+            if not self._check_version(version):
+                return
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, version, key, compute):
+        value = self.get(version, key)
+        if value is None:
+            value = compute()
+            self.put(version, key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'entries': len(self._entries),
+                'data_version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+# Process-wide cache shared by the venue endpoints.
+response_cache = ResponseCache()
@@ -0,0 +1,267 @@
+# Optional in-memory columnar engine for the venue endpoints.
+# Purpose: the venues dataset is small enough to keep in RAM, so summary and list requests can be
+# answered with NumPy boolean masks over column arrays instead of a SQLite query per request.
+# Interaction: enabled with FOOT_TRAFFIC_ENGINE=columnar (requires numpy); FOOT_TRAFFIC_ENGINE=mapped
+# serves the same interface from a memory-mapped file shared by all workers (src/mapped.py). app.py
+# asks get_store() for a store matching the current data version and falls back to SQLite when
+# disabled.
+# Filter semantics mirror filters.compile_filter (exact / prefix / contains, ORed values per field).
+
+import bisect
+import os
+import threading
+
+# numpy, imported by load_numpy() (via enabled()) when a column engine is selected: importing it
+# costs more than the rest of the app's own modules, so workers on the SQLite engine never load it.
+np = None
+
+from .filters import fold
+from .geo import EARTH_RADIUS_MI, lon_ranges
+
+# 'sqlite' (default), 'columnar' (a copy per worker) or 'mapped' (one shared file)
+ENGINE = os.environ.get('FOOT_TRAFFIC_ENGINE', 'sqlite')
+
+# Columns loaded from venues; the first 11 are the row shape used by /api/venues.
+LOAD_SQL = (
+    "SELECT id, entity_id, name, chain_name, sub_category, dma, city, state_name, foot_traffic, "
+    "date_opened, date_closed, sales, area_sqft, lat, lon, avg_dwell_time_min, ft_per_sqft FROM venues;"
+)
+ROW_WIDTH = 11
+
+def load_numpy():
+    """Import numpy for the column classes; False when it isn't installed."""
+    global np
+    if np is None:
+        try:
+            import numpy as np
+        except ImportError:  # numpy is optional; the SQLite engine is used without it
+            return False
+    return True
+
+
+def enabled():
+    return ENGINE in ('columnar', 'mapped') and load_numpy()
+
+
+class DictColumn:
+    """Dictionary-encoded string column: int32 codes into a sorted dictionary (-1 for NULL).
+
+    Predicates are evaluated once per distinct value on the (small) dictionary and then
+    applied to all rows with a single vectorized np.isin over the codes.
+    """
+
+    def __init__(self, values):
+        self._set_dictionary(sorted({v for v in values if v is not None}))
+        self.codes = np.fromiter(
+            (self.index[v] if v is not None else -1 for v in values), dtype=np.int32, count=len(values))
+
+    @classmethod
+    def from_codes(cls, dictionary, codes):
+        """A column over already encoded codes (e.g. a read-only memory map)."""
+        column = cls.__new__(cls)
+        column._set_dictionary(dictionary)
+        column.codes = codes
+        return column
+
+    def _set_dictionary(self, dictionary):
+        self.dictionary = dictionary
+        self.index = {v: i for i, v in enumerate(dictionary)}
+        self.folded = [fold(v) for v in dictionary]
+
+    def value(self, i):
+        code = self.codes[i]
+        return None if code < 0 else self.dictionary[code]
+
+    def match_mask(self, values, match):
+        wanted = [fold(v) for v in values]
+        if match == 'exact':
+            keys = set(wanted)
+            codes = [i for i, d in enumerate(self.folded) if d in keys]
+        elif match == 'prefix':
+            codes = [i for i, d in enumerate(self.folded) if any(d.startswith(w) for w in wanted)]
+        else:
+            codes = [i for i, d in enumerate(self.folded) if any(w in d for w in wanted)]
+        return np.isin(self.codes, np.array(codes, dtype=np.int32))
+
+    def equals_mask(self, value):
+        code = self.index.get(value)
+        if code is None:
+            return np.zeros(len(self.codes), dtype=bool)
+        return self.codes == code
+
+
+class ColumnarStore:
+    """Column arrays for one data version of the venues table."""
+
+    engine = 'columnar'
+
+    def __init__(self, rows, version):
+        self.version = version
+        self.rows = [r[:ROW_WIDTH] for r in rows]
+        n = len(rows)
+        cols = list(zip(*rows)) if rows else [()] * (ROW_WIDTH + 6)
+        ids, names = cols[0], cols[2]
+        self.ids = np.array(ids, dtype=np.int64)
+        self.chain = DictColumn(cols[3])
+        self.category = DictColumn(cols[4])
+        self.dma = DictColumn(cols[5])
+        self.city = DictColumn(cols[6])
+        self.state = DictColumn(cols[7])
+        self.foot_traffic = np.array([v or 0 for v in cols[8]], dtype=np.int64)
+        self.foot_traffic_null = np.array([v is None for v in cols[8]], dtype=bool)
+        self.closed = np.array([bool(v) for v in cols[10]], dtype=bool)
+        self.sales = np.array([np.nan if v is None else v for v in cols[11]], dtype=np.float64)
+        self.area_sqft = np.array([np.nan if v is None else v for v in cols[12]], dtype=np.float64)
+        # NaN coordinates never satisfy a comparison, so unlocated venues drop out of geo filters
+        self.lat = np.array([np.nan if v is None else v for v in cols[13]], dtype=np.float64)
+        self.lon = np.array([np.nan if v is None else v for v in cols[14]], dtype=np.float64)
+        self.avg_dwell_time_min = np.array([np.nan if v is None else v for v in cols[15]], dtype=np.float64)
+        self.ft_per_sqft = np.array([np.nan if v is None else v for v in cols[16]], dtype=np.float64)
+        # metric -> rows with a value, ascending by (value, id); built on first use
+        self.metric_orders = {}
+
+        # ORDER BY name COLLATE NOCASE, id (NULL names first), kept as a permutation of row
+        # positions plus the sorted keys so cursors can be located with a binary search.
+        def sort_key(i):
+            return self.sort_key(names[i], ids[i])
+        order = sorted(range(n), key=sort_key)
+        self.order = np.array(order, dtype=np.int64)
+        self.sorted_keys = [sort_key(i) for i in order]
+
+    @staticmethod
+    def sort_key(name, venue_id):
+        return (name is not None, fold(name or ''), venue_id)
+
+    @classmethod
+    def load(cls, conn, version):
+        return cls(conn.execute(LOAD_SQL).fetchall(), version)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def mask(self, f):
+        """Boolean row mask for a filters.VenueFilter."""
+        mask = np.ones(len(self), dtype=bool)
+        columns = {'chain': self.chain, 'category': self.category, 'dma': self.dma}
+        for field, values in f.multi():
+            if values:
+                mask &= columns[field].match_mask(values, f.match)
+        if f.city is not None:
+            mask &= self.city.equals_mask(f.city)
+        if f.state is not None:
+            mask &= self.state.equals_mask(f.state)
+        if f.open_status == 'open':
+            mask &= ~self.closed
+        elif f.open_status == 'closed':
+            mask &= self.closed
+        if f.bbox:
+            west, south, east, north = f.bbox
+            in_lon = np.zeros(len(self.lon), dtype=bool)
+            for lo, hi in lon_ranges(west, east):
+                in_lon |= (self.lon >= lo) & (self.lon <= hi)
+            mask &= (self.lat >= south) & (self.lat <= north) & in_lon
+        if f.radius:
+            lat, lon, miles = f.radius
+            with np.errstate(invalid='ignore'):
+                mask &= self.distance_mi(lat, lon) <= miles
+        return mask
+
+    def distance_mi(self, lat, lon):
+        # vectorized version of geo.distance_mi
+        p1, p2 = np.radians(lat), np.radians(self.lat)
+        dl = np.radians(self.lon - lon)
+        a = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(dl / 2) ** 2
+        return 2 * EARTH_RADIUS_MI * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+    def summary(self, mask):
+        return {"venues": int(mask.sum()), "total_foot_traffic": int(self.foot_traffic[mask].sum())}
+
+    def page(self, mask, limit, offset=0, after=None):
+        """Return up to `limit` rows of the masked set in list order.
+
+        `after` is a decoded (name, id) cursor; rows strictly after it are returned.
+        """
+        positions = np.flatnonzero(mask[self.order])
+        if after is not None:
+            start = self.position_after(self.sort_key(*after))
+            positions = positions[np.searchsorted(positions, start):]
+        selected = self.order[positions[offset:offset + limit]]
+        return [self.row(i) for i in selected]
+
+    def position_after(self, key):
+        """Index into self.order of the first row sorting after `key`."""
+        return bisect.bisect_right(self.sorted_keys, key)
+
+    def metric(self, name):
+        """Values of a pagination.SORT_METRICS column as float64, NaN where NULL."""
+        if name == 'foot_traffic':
+            return np.where(self.foot_traffic_null, np.nan, self.foot_traffic)
+        return getattr(self, name)
+
+    def metric_order(self, name):
+        order = self.metric_orders.get(name)
+        if order is None:
+            order = self.metric_orders[name] = metric_order(self.metric(name), self.ids)
+        return order
+
+    def has_metric(self, name):
+        return ~np.isnan(self.metric(name))
+
+    def sorted_page(self, mask, sort, limit, offset=0, after=None):
+        """Like page(), in (metric, id) order for sort=(metric, 'asc' | 'desc').
+
+        Only rows with a value are returned, each followed by that value; `after` is a decoded
+        (value, id) cursor. Nothing is sorted per request: the masked rows are read in the order
+        of the precomputed metric_order() (reversed for 'desc').
+        """
+        name, direction = sort
+        order = self.metric_order(name)
+        values = self.metric(name)
+        ranked = order[::-1] if direction == 'desc' else order
+        positions = np.flatnonzero(mask[ranked])
+        if after is not None:
+            value, venue_id = after
+            sorted_values = values[order]
+            lo = int(np.searchsorted(sorted_values, value, 'left'))
+            hi = int(np.searchsorted(sorted_values, value, 'right'))
+            ties = self.ids[order[lo:hi]]
+            if direction == 'desc':
+                start = len(order) - (lo + int(np.searchsorted(ties, venue_id, 'left')))
+            else:
+                start = lo + int(np.searchsorted(ties, venue_id, 'right'))
+            positions = positions[np.searchsorted(positions, start):]
+        selected = ranked[positions[offset:offset + limit]]
+        if name == 'foot_traffic':
+            return [self.row(i) + (int(self.foot_traffic[i]),) for i in selected]
+        return [self.row(i) + (float(values[i]),) for i in selected]
+
+    def row(self, i):
+        return self.rows[i]
+
+
+def metric_order(values, ids):
+    """Row positions with a non-NaN value, ascending by (value, id)."""
+    present = np.flatnonzero(~np.isnan(values))
+    return present[np.lexsort((ids[present], values[present]))]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store(conn, version):
+    """Return the store for `version`, rebuilding it from SQLite when the data changed."""
+    global _store
+    engine = 'mapped' if ENGINE == 'mapped' else 'columnar'
+    store = _store
+    if store is None or store.version != version or store.engine != engine:
+        with _store_lock:
+            store = _store
+            if store is None or store.version != version or store.engine != engine:
+                if engine == 'mapped':
+                    from . import mapped
+                    store = mapped.open_store(conn, version)
+                else:
+                    store = ColumnarStore.load(conn, version)
+                _store = store
+    return store
@@ -0,0 +1,488 @@
+# Connection management for the SQLite database used by the API.
+# Purpose: hands out tuned, pooled connections so request handlers don't reopen the DB file,
+# re-parse the schema and start from a cold page cache on every request.
+# Interaction: app.py runs queries on pooled connections through the executors (executor.py) and
+# uses connect() directly for schema setup and seeding; load_csv.py shares ensure_schema().
+# Connections are metrics.TracedConnections, which feed the request metrics and slow-query log.
+# migrate() and writer_lock() coordinate schema changes and loads between API workers and
+# load_csv.py (see startup.py).
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from .approx import SAMPLE_TRIGGERS, SKETCH_TRIGGERS, ensure_approx, invalidate_sketches, rebuild_sample
+from .geo import RTREE_TRIGGERS, distance_mi, ensure_geo, rebuild_rtree
+from .metrics import TracedConnection
+from .rollups import ensure_rollups, rebuild_rollups
+from .timeseries import ensure_timeseries
+
+# Path to the SQLite database file; FOOT_TRAFFIC_DB overrides it (tests point it at a temp file).
+DB_PATH = os.environ.get('FOOT_TRAFFIC_DB', os.path.join(os.path.dirname(__file__), 'data.db'))
+
+# Maximum number of pooled read connections and how long a request waits for one (seconds).
+POOL_SIZE = int(os.environ.get('FOOT_TRAFFIC_POOL_SIZE', '8'))
+POOL_TIMEOUT = float(os.environ.get('FOOT_TRAFFIC_POOL_TIMEOUT', '10'))
+
+# Number of prepared statements sqlite3 keeps per connection. Statements are cached by their
+# SQL text, so handlers should build SQL with placeholders rather than inlining values.
+STATEMENT_CACHE_SIZE = 256
+
+# Per-connection tuning applied on open. mmap lets reads come straight from the OS page cache,
+# cache_size is negative so it is expressed in KiB (64 MB), temp tables and sorts stay in memory.
+PRAGMAS = (
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -64000),
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000),
+)
+
+
+VENUES_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS venues (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    entity_id TEXT,
+    entity_type TEXT,
+    name TEXT,
+    foot_traffic INTEGER,
+    sales REAL,
+    avg_dwell_time_min REAL,
+    area_sqft REAL,
+    ft_per_sqft REAL,
+    geolocation TEXT,
+    country TEXT,
+    state_code TEXT,
+    state_name TEXT,
+    city TEXT,
+    postal_code TEXT,
+    formatted_city TEXT,
+    street_address TEXT,
+    sub_category TEXT,
+    dma TEXT,
+    cbsa TEXT,
+    chain_id TEXT,
+    chain_name TEXT,
+    store_id TEXT,
+    date_opened TEXT,
+    date_closed TEXT,
+    row_hash TEXT,
+    lat REAL,
+    lon REAL
+);'''
+
+# Lowercased shadow columns used by the filter engine (filters.py). They are VIRTUAL generated
+# columns, so inserts don't need to know about them and existing DBs can gain them via ALTER.
+KEY_COLUMNS = (
+    ('chain_key', 'chain_name'),
+    ('category_key', 'sub_category'),
+    ('dma_key', 'dma'),
+)
+
+# Secondary indexes: name -> indexed expression.
+INDEXES = {
+    'idx_venues_chain_key': 'venues(chain_key)',
+    'idx_venues_category_key': 'venues(category_key)',
+    'idx_venues_dma_key': 'venues(dma_key)',
+    'idx_venues_city': 'venues(city)',
+    'idx_venues_state_name': 'venues(state_name)',
+    # keyset pagination order for /api/venues (name, then id as tie-breaker)
+    'idx_venues_name_id': 'venues(name COLLATE NOCASE, id)',
+    # metric orders for /api/venues?sort=<metric> and /api/venues/top: a top-K under unselective
+    # filters reads the first K matching index entries instead of sorting the filtered set
+    'idx_venues_foot_traffic_id': 'venues(foot_traffic, id)',
+    'idx_venues_sales_id': 'venues(sales, id)',
+    'idx_venues_avg_dwell_time_min_id': 'venues(avg_dwell_time_min, id)',
+    'idx_venues_ft_per_sqft_id': 'venues(ft_per_sqft, id)',
+    'idx_venues_area_sqft_id': 'venues(area_sqft, id)',
+}
+
+# Trigram full-text index for substring ("contains") filters. It is an external-content table
+# over venues, kept in sync by triggers, so LIKE '%x%' can be answered without scanning venues.
+FTS_SQL = (
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS venues_fts USING fts5(
+        chain_name, sub_category, dma, content='venues', content_rowid='id', tokenize='trigram'
+    );''',
+    '''CREATE TRIGGER IF NOT EXISTS venues_fts_ai AFTER INSERT ON venues BEGIN
+        INSERT INTO venues_fts(rowid, chain_name, sub_category, dma)
+        VALUES (new.id, new.chain_name, new.sub_category, new.dma);
+    END;''',
+    '''CREATE TRIGGER IF NOT EXISTS venues_fts_ad AFTER DELETE ON venues BEGIN
+        INSERT INTO venues_fts(venues_fts, rowid, chain_name, sub_category, dma)
+        VALUES ('delete', old.id, old.chain_name, old.sub_category, old.dma);
+    END;''',
+    '''CREATE TRIGGER IF NOT EXISTS venues_fts_au AFTER UPDATE OF chain_name, sub_category, dma ON venues BEGIN
+        INSERT INTO venues_fts(venues_fts, rowid, chain_name, sub_category, dma)
+        VALUES ('delete', old.id, old.chain_name, old.sub_category, old.dma);
+        INSERT INTO venues_fts(rowid, chain_name, sub_category, dma)
+        VALUES (new.id, new.chain_name, new.sub_category, new.dma);
+    END;''',
+)
+
+
+# Key/value table for bookkeeping; 'data_version' is bumped after every write to venues so
+# caches in any API process can tell their entries are stale, 'schema_version' records the
+# SCHEMA_VERSION the DB was last migrated to.
+META_SQL = '''CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);'''
+
+
+# Bump whenever ensure_schema() creates or changes something, so existing DBs are migrated once
+# on the next start; DBs already at this version skip schema work entirely (see migrate()).
+SCHEMA_VERSION = 5
+
+
+def ensure_schema(conn):
+    """Create the venues table, filter key columns, indexes, FTS index, R*Tree, rollups, approximate
+    summary tables and metrics history if missing.
+
+    Safe to run on every boot and on DBs created by older versions: missing generated
+    columns are added with ALTER TABLE (lat/lon are backfilled from geolocation) and a
+    newly created FTS index, R*Tree, rollup table or sample is rebuilt from venues.
+    """
+    cur = conn.cursor()
+    cur.execute(VENUES_TABLE_SQL)
+    cur.execute(META_SQL)
+    cur.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('data_version', 1);")
+    existing = {r[1] for r in cur.execute('PRAGMA table_xinfo(venues);')}
+    # columns newer code reads that DBs created from older CSV layouts may lack
+    for column, decl in (('row_hash', 'TEXT'), ('ft_per_sqft', 'REAL'), ('avg_dwell_time_min', 'REAL')):
+        if column not in existing:
+            cur.execute(f'ALTER TABLE venues ADD COLUMN {column} {decl};')
+    for key_col, src_col in KEY_COLUMNS:
+        if key_col not in existing:
+            cur.execute(f'ALTER TABLE venues ADD COLUMN {key_col} TEXT GENERATED ALWAYS AS (lower({src_col})) VIRTUAL;')
+    # entity_id identifies a store across refreshes (delta loads upsert on it); DBs that
+    # already hold duplicates keep working, they just can't take delta loads.
+    try:
+        cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_venues_entity_id ON venues(entity_id);')
+    except sqlite3.IntegrityError:
+        print('Warning: venues has duplicate entity_id values; delta loads are disabled until they are removed')
+    for name, target in INDEXES.items():
+        cur.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target};')
+    fts_exists = cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'venues_fts';").fetchone()
+    for sql in FTS_SQL:
+        cur.execute(sql)
+    if not fts_exists:
+        cur.execute("INSERT INTO venues_fts(venues_fts) VALUES ('rebuild');")
+    ensure_geo(conn, existing)
+    ensure_rollups(conn)
+    ensure_approx(conn)
+    ensure_timeseries(conn)
+    # finish (or recover from an interrupted) deferred bulk load, see drop_derived()
+    stale = cur.execute("SELECT value FROM meta WHERE key = 'derived_stale';").fetchone()
+    if stale and stale[0]:
+        cur.execute("INSERT INTO venues_fts(venues_fts) VALUES ('rebuild');")
+        rebuild_rtree(conn)
+        rebuild_rollups(conn)
+        rebuild_sample(conn)
+        invalidate_sketches(conn)
+        cur.execute("UPDATE meta SET value = 0 WHERE key = 'derived_stale';")
+    cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?);", (SCHEMA_VERSION,))
+    conn.commit()
+
+
+def schema_version(conn):
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'schema_version';").fetchone()
+    except sqlite3.OperationalError:  # no meta table: a new or pre-versioning DB
+        return 0
+    return row[0] if row else 0
+
+
+@contextmanager
+def writer_lock(path=None, blocking=True):
+    """Hold the exclusive lock for schema migrations and loads into the DB at `path`.
+
+    It is an OS file lock on '<db>.lock', shared by every API worker and load_csv.py and released
+    by the OS if the holder dies. Yields True once held; without `blocking`, yields False
+    immediately when another process (or thread) holds it.
+    """
+    with open((path or DB_PATH) + '.lock', 'a+b') as f:
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        except OSError:
+            if blocking:
+                raise
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def migrate(path=None):
+    """Bring the DB at `path` up to SCHEMA_VERSION; returns True if this call ran ensure_schema().
+
+    A DB at the current version is only read, so a restarting worker does no DDL at all. Otherwise
+    the first worker migrates under writer_lock() and the others wait for it and find it done.
+    """
+    conn = connect(path)
+    try:
+        if schema_version(conn) >= SCHEMA_VERSION:
+            return False
+        with writer_lock(path):
+            if schema_version(conn) >= SCHEMA_VERSION:
+                return False
+            ensure_schema(conn)
+            return True
+    finally:
+        conn.close()
+
+
+# Triggers that keep venues_fts, venues_rtree, venue_rollups and the approx tables in sync with
+# venues, row by row.
+DERIVED_TRIGGERS = (
+    'venues_fts_ai', 'venues_fts_ad', 'venues_fts_au',
+    *RTREE_TRIGGERS,
+    'venue_rollups_ai', 'venue_rollups_ad', 'venue_rollups_au',
+    *SAMPLE_TRIGGERS,
+    *SKETCH_TRIGGERS,
+)
+
+
+def drop_derived(conn):
+    """Drop secondary indexes and sync triggers ahead of a bulk load.
+
+    Building indexes once after the load is much cheaper than updating them per row.
+    The 'derived_stale' flag makes the next ensure_schema() recreate them and rebuild the
+    FTS index, R*Tree, rollups, sample and sketches, even if the load was interrupted.
+    """
+    cur = conn.cursor()
+    cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('derived_stale', 1);")
+    for name in INDEXES:
+        cur.execute(f'DROP INDEX IF EXISTS {name};')
+    for name in DERIVED_TRIGGERS:
+        cur.execute(f'DROP TRIGGER IF EXISTS {name};')
+    conn.commit()
+
+
+def get_data_version(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key = 'data_version';").fetchone()
+    return row[0] if row else 0
+
+
+def bump_data_version(conn):
+    """Mark venues as changed; call inside the writing transaction, before commit."""
+    conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'data_version';")
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available within POOL_TIMEOUT."""
+
+
+def connect(path=None, readonly=False):
+    """Open a tuned SQLite connection in WAL mode.
+
+    WAL lets readers keep serving while a writer (init_db, load_csv.py) commits.
+    `readonly` connections additionally refuse writes via PRAGMA query_only.
+    distance_mi(lat1, lon1, lat2, lon2) is registered for the radius / nearest queries.
+    """
+    conn = sqlite3.connect(path or DB_PATH, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE,
+                           factory=TracedConnection)
+    conn.create_function('distance_mi', 4, distance_mi, deterministic=True)
+    conn.execute('PRAGMA journal_mode=WAL;')
+    for name, value in PRAGMAS:
+        conn.execute(f'PRAGMA {name}={value};')
+    if readonly:
+        conn.execute('PRAGMA query_only=ON;')
+    return conn
+
+
+class ConnectionPool:
+    """Bounded pool of read connections shared by the request handlers.
+
+    Connections are opened lazily up to `size` and reused LIFO so the hottest connection
+    (with the warmest page and statement caches) is handed out first. swap() points the pool at
+    another database file: later acquisitions get connections to the new file, idle connections
+    to the old one are closed right away and busy ones when they are released (see snapshot.py).
+    Counters:
+    hits   - acquisitions served by an idle connection
+    opened - connections created
+    waits  - acquisitions that had to block because the pool was exhausted
+    timeouts - waits that gave up after `timeout` seconds
+    swaps  - database files switched to
+    drained - connections closed because their file was swapped out
+    """
+
+    def __init__(self, path=None, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.path = path or DB_PATH
+        self.size = size
+        self.timeout = timeout
+        self.generation = 0  # bumped by swap(); connections remember the generation they were opened in
+        self._idle = queue.LifoQueue()  # connections, or None: a slot freed by a drained connection
+        self._lock = threading.Lock()
+        self._open = 0
+        self._in_use = 0
+        self._resolve = None
+        self._poll = 0.0
+        self._next_check = 0.0
+        self.hits = 0
+        self.opened = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.swaps = 0
+        self.drained = 0
+
+    def follow(self, resolve, poll):
+        """Serve the file named by resolve(), checking it again at most every `poll` seconds."""
+        self._resolve, self._poll = resolve, poll
+        self.swap(resolve())
+
+    def swap(self, path):
+        """Serve `path` from now on; returns False if it is already the current file."""
+        with self._lock:
+            if path == self.path:
+                return False
+            self.path = path
+            self.generation += 1
+            self.swaps += 1
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+        return True
+
+    def _check_source(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self._poll
+        self.swap(self._resolve())
+
+    def _discard(self, conn):
+        if conn is None:
+            return
+        conn.close()
+        with self._lock:
+            self._open -= 1
+            self.drained += 1
+
+    def _take_idle(self, conn):
+        # a connection from the idle queue; None (and closed) when it belongs to a swapped-out file
+        if conn is not None and conn.pool_generation == self.generation:
+            with self._lock:
+                self._in_use += 1
+            return conn
+        self._discard(conn)
+        return None
+
+    def acquire(self):
+        if self._resolve is not None:
+            self._check_source()
+        while True:
+            try:
+                conn = self._take_idle(self._idle.get_nowait())
+            except queue.Empty:
+                break
+            if conn is not None:
+                with self._lock:
+                    self.hits += 1
+                return conn
+
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        while True:
+            with self._lock:
+                can_open = self._open < self.size
+                if can_open:
+                    self._open += 1
+                    self.opened += 1
+                    path, generation = self.path, self.generation
+                elif not waited:
+                    self.waits += 1
+                    waited = True
+            if can_open:
+                try:
+                    conn = connect(path, readonly=True)
+                    conn.count_vm_steps()
+                except Exception:
+                    with self._lock:
+                        self._open -= 1
+                    raise
+                conn.pool_generation = generation
+                with self._lock:
+                    self._in_use += 1
+                return conn
+            try:
+                conn = self._take_idle(self._idle.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                with self._lock:
+                    self.timeouts += 1
+                raise PoolTimeout(f'no database connection available after {self.timeout}s')
+            if conn is not None:
+                return conn
+
+    def release(self, conn):
+        # never hand a connection with an open read transaction to the next request
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._in_use -= 1
+            stale = conn.pool_generation != self.generation
+        if stale:
+            self._discard(conn)
+            self._idle.put(None)  # wake a waiter: it may open a connection to the new file
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """Close all idle connections; called on application shutdown."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if conn is not None:
+                conn.close()
+                with self._lock:
+                    self._open -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'path': self.path,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': self._open - self._in_use,
+                'hits': self.hits,
+                'opened': self.opened,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'swaps': self.swaps,
+                'drained': self.drained,
+            }
+
+
+# Process-wide pool used by the API; connections are opened on first use.
+pool = ConnectionPool()
@@ -0,0 +1,321 @@
+# Async data-access layer: bounded executors that run the blocking sqlite3 work.
+# Purpose: route handlers are async and await DB work on a dedicated, sized thread pool instead of
+# sharing Starlette's default one. Interactive queries and exports get separate executors, so a
+# few heavy exports can't occupy the threads quick summary calls need. Each executor bounds its
+# queue (Overloaded -> 503), times out slow work (QueryTimeout -> 504) and interrupts the
+# running statement (sqlite3 Connection.interrupt) on timeout or client disconnect.
+# Interaction: app.py calls db_executor.run(fn) with fn(conn) doing the queries, and
+# export_executor.stream(...) for /api/venues/export; connections come from db.pool.
+
+import asyncio
+import collections
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+from .db import POOL_SIZE, pool
+
+# Worker threads for exports, which is also the most export streams open at once (each holds a
+# pooled connection for its whole life; later streams wait for one to finish). Interactive
+# queries get the rest of the pool's connections, so their workers never wait on the pool.
+EXPORT_WORKERS = int(os.environ.get('FOOT_TRAFFIC_EXPORT_WORKERS', '2'))
+DB_WORKERS = int(os.environ.get('FOOT_TRAFFIC_DB_WORKERS', str(max(1, POOL_SIZE - EXPORT_WORKERS))))
+
+# Jobs allowed to wait for a worker before new requests are rejected.
+QUEUE_LIMIT = int(os.environ.get('FOOT_TRAFFIC_DB_QUEUE', '100'))
+
+# Seconds a query (or one export chunk) may run before it is interrupted.
+QUERY_TIMEOUT = float(os.environ.get('FOOT_TRAFFIC_QUERY_TIMEOUT', '30'))
+
+
+class Overloaded(Exception):
+    """Raised when an executor's queue is full."""
+
+
+class QueryTimeout(Exception):
+    """Raised when DB work exceeds its timeout; the running statement is interrupted."""
+
+
+class _Job:
+    """One unit of DB work; tracks the connection it runs on so it can be interrupted."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conn = None
+        self.aborted = False
+        self.submitted = time.perf_counter()
+
+    def attach(self, conn):
+        with self.lock:
+            self.conn = conn
+            if self.aborted:
+                conn.interrupt()
+
+    def detach(self):
+        with self.lock:
+            self.conn = None
+
+    def abort(self):
+        with self.lock:
+            self.aborted = True
+            if self.conn is not None:
+                self.conn.interrupt()
+
+
+class _Slots:
+    """Counting semaphore that can be awaited from any event loop, granted in FIFO order.
+
+    asyncio.Semaphore binds to one loop, but the executors are process-wide and test clients
+    run each request on a loop of its own; release() may be called from any thread.
+    """
+
+    def __init__(self, size):
+        self._lock = threading.Lock()
+        self.free = size
+        self._waiters = collections.deque()
+
+    async def acquire(self):
+        with self._lock:
+            if self.free > 0 and not self._waiters:
+                self.free -= 1
+                return
+            loop = asyncio.get_running_loop()
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter not in self._waiters
+                if not granted:
+                    self._waiters.remove(waiter)
+            if granted:
+                # the slot was handed over as we gave up; pass it on
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self.free += 1
+                return
+            loop, future = self._waiters.popleft()
+        try:
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+        except RuntimeError:
+            # the waiter's loop is gone
+            self.release()
+
+
+_DONE = object()
+_UNPOOLED = object()  # submit() conn value for work that needs no connection
+
+
+class DBExecutor:
+    """Sized thread pool for blocking sqlite3 work with queue / latency counters.
+
+    queued / running - jobs waiting for a worker / executing now
+    max_queued       - deepest queue seen
+    rejected         - jobs refused because the queue was full
+    timeouts / cancelled - jobs interrupted after their timeout / because the client went away
+    wait_seconds / run_seconds - total time jobs spent queued / executing
+    streams          - open stream() iterators; at most `workers`, so streams don't drain the pool
+    """
+
+    def __init__(self, name, workers, queue_limit=QUEUE_LIMIT, timeout=QUERY_TIMEOUT, pool=pool):
+        self.name = name
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.pool = pool
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix=f'db-{name}')
+        self._stream_slots = _Slots(workers)
+        self._lock = threading.Lock()
+        self.streams = 0
+        self.queued = 0
+        self.running = 0
+        self.max_queued = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    def _call(self, job, fn, args, conn):
+        started = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_seconds += started - job.submitted
+        ok = False
+        try:
+            with metrics.db_time():
+                if conn is _UNPOOLED:
+                    result = fn(*args)
+                elif conn is None:
+                    with self.pool.connection() as pooled:
+                        result = self._attached(job, fn, pooled, args)
+                else:
+                    result = self._attached(job, fn, conn, args)
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.run_seconds += time.perf_counter() - started
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    @staticmethod
+    def _attached(job, fn, conn, args):
+        job.attach(conn)
+        try:
+            return fn(conn, *args)
+        finally:
+            conn.finish_statements()
+            job.detach()
+
+    def _on_done(self, future):
+        # a job cancelled before it started never reaches _call
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    def submit(self, job, fn, args=(), conn=None):
+        """Queue fn(conn, *args); returns a concurrent.futures.Future. Raises Overloaded.
+
+        conn=None runs on a connection from the pool for the duration of the job.
+        """
+        with self._lock:
+            if self.queued >= self.queue_limit:
+                self.rejected += 1
+                raise Overloaded(f'{self.name} executor queue is full ({self.queue_limit} waiting)')
+            self.queued += 1
+            self.submitted += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        # the job runs in the caller's context so its DB time and rows count towards the request
+        future = self._executor.submit(contextvars.copy_context().run, self._call, job, fn, args, conn)
+        future.add_done_callback(self._on_done)
+        return future
+
+    async def _await(self, job, future, timeout):
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            job.abort()
+            with self._lock:
+                self.timeouts += 1
+            raise QueryTimeout(f'query exceeded {timeout or self.timeout}s and was interrupted')
+        except asyncio.CancelledError:
+            job.abort()
+            with self._lock:
+                self.cancelled += 1
+            raise
+
+    async def run(self, fn, *args, timeout=None):
+        """Run fn(conn, *args) on a pooled connection in a worker thread and return its result."""
+        job = _Job()
+        return await self._await(job, self.submit(job, fn, args), timeout)
+
+    async def stream(self, fn, *args, timeout=None):
+        """Async-iterate the chunks of the sync iterator fn(conn, *args).
+
+        One pooled connection is held for the whole stream, but each chunk is a separate job,
+        so the worker is free between chunks; `timeout` applies per chunk. At most `workers`
+        streams are open at once; a later one waits (up to `timeout`) for a slot before taking
+        a connection, so open streams never hold more of the pool than the executor's share.
+        """
+        try:
+            await asyncio.wait_for(self._stream_slots.acquire(), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise QueryTimeout(f'no {self.name} stream slot within {timeout or self.timeout}s')
+        with self._lock:
+            self.streams += 1
+
+        def close_slot():
+            with self._lock:
+                self.streams -= 1
+            self._stream_slots.release()
+
+        job = _Job()
+        try:
+            acquiring = self.submit(job, self.pool.acquire, conn=_UNPOOLED)
+        except BaseException:
+            close_slot()
+            raise
+        try:
+            conn = await self._await(job, acquiring, timeout)
+        except BaseException:
+            # the acquire may still complete after we gave up on it
+            def release(f):
+                try:
+                    if not f.cancelled() and f.exception() is None:
+                        self.pool.release(f.result())
+                finally:
+                    close_slot()
+            acquiring.add_done_callback(release)
+            raise
+        it = None
+        pending = None
+        try:
+            job = _Job()
+            pending = self.submit(job, lambda c: iter(fn(c, *args)), conn=conn)
+            it = await self._await(job, pending, timeout)
+            while True:
+                job = _Job()
+                pending = self.submit(job, lambda c: next(it, _DONE), conn=conn)
+                chunk = await self._await(job, pending, timeout)
+                if chunk is _DONE:
+                    break
+                yield chunk
+        finally:
+            def cleanup(_=None):
+                try:
+                    if it is not None:
+                        it.close()
+                finally:
+                    self.pool.release(conn)
+                    close_slot()
+            # an interrupted step may still be unwinding in its worker; finish after it
+            if pending is not None and not pending.done():
+                pending.add_done_callback(cleanup)
+            else:
+                cleanup()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_limit': self.queue_limit,
+                'timeout': self.timeout,
+                'queued': self.queued,
+                'running': self.running,
+                'max_queued': self.max_queued,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'cancelled': self.cancelled,
+                'wait_seconds': round(self.wait_seconds, 6),
+                'run_seconds': round(self.run_seconds, 6),
+                'streams': self.streams,
+            }
+
+
+# Process-wide executors used by the API.
+db_executor = DBExecutor('query', DB_WORKERS)
+export_executor = DBExecutor('export', EXPORT_WORKERS)
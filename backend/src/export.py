@@ -0,0 +1,213 @@
+# Streaming exporter for /api/venues/export.
+# Purpose: full-table exports run in constant memory: rows are read from the cursor in
+# fetchmany() batches, encoded (CSV, NDJSON or Parquet) into ~64 KB chunks and optionally
+# compressed (gzip, or zstd when the zstandard package is installed) before being yielded.
+# One stream reads its rows sequentially (one cursor, in list order); the parallelism is across
+# streams (export_executor's workers) and, for zstd, in the compressor's own worker threads, which
+# compress earlier chunks while this thread reads and encodes the next ones.
+# Interaction: app.export_venues validates the request with resolve_columns() / pick_encoding()
+# and streams stream(...) through executor.export_executor, which holds the pooled connection
+# and runs each chunk in a worker thread, so encoding and compression never block the event loop.
+
+import csv
+import io
+import os
+import zlib
+from importlib.util import find_spec
+
+try:
+    import zstandard
+except ImportError:  # optional; gzip is always available
+    zstandard = None
+
+# pyarrow is optional and only needed for format=parquet; it is imported by the first parquet
+# export since importing it takes longer than starting the rest of the app.
+PARQUET_AVAILABLE = find_spec('pyarrow') is not None
+
+from .serialize import dumps_line
+
+# Export column name -> SQL expression over venues.
+COLUMNS = {
+    'id': 'id',
+    'entity_id': 'entity_id',
+    'name': 'name',
+    'chain_name': 'chain_name',
+    'category': 'sub_category',
+    'dma': 'dma',
+    'city': 'city',
+    'state': 'state_name',
+    'foot_traffic': 'COALESCE(foot_traffic, 0)',
+    'date_opened': 'date_opened',
+    'date_closed': 'date_closed',
+    'sales': 'sales',
+    'area_sqft': 'area_sqft',
+    'avg_dwell_time_min': 'avg_dwell_time_min',
+    'ft_per_sqft': 'ft_per_sqft',
+    'street_address': 'street_address',
+    'postal_code': 'postal_code',
+    'cbsa': 'cbsa',
+    'lat': 'lat',
+    'lon': 'lon',
+}
+
+# The columns (and order) of the original CSV export.
+DEFAULT_COLUMNS = ('id', 'entity_id', 'name', 'chain_name', 'category', 'dma', 'city', 'state',
+                   'foot_traffic', 'date_opened', 'date_closed')
+
+# Arrow types for the Parquet schema; everything else is a string.
+ARROW_TYPES = {'id': 'int64', 'foot_traffic': 'int64', 'sales': 'float64', 'area_sqft': 'float64',
+               'avg_dwell_time_min': 'float64', 'ft_per_sqft': 'float64', 'lat': 'float64', 'lon': 'float64'}
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+# Rows per fetchmany() call and the size of the chunks handed to the response.
+FETCH_ROWS = 1000
+CHUNK_BYTES = 64 * 1024
+
+# zstd worker threads per stream, besides the reading thread (0 compresses inline).
+ZSTD_THREADS = int(os.environ.get('FOOT_TRAFFIC_EXPORT_ZSTD_THREADS', str(min(4, os.cpu_count() or 1) - 1)))
+
+# Rows per Parquet row group.
+PARQUET_ROW_GROUP = 50000
+
+
+def resolve_columns(requested):
+    """Expand the repeatable / comma-separated `columns` param; raises ValueError on unknown names."""
+    if not requested:
+        return list(DEFAULT_COLUMNS)
+    names = [c.strip() for value in requested for c in value.split(',') if c.strip()]
+    unknown = [c for c in names if c not in COLUMNS]
+    if unknown:
+        raise ValueError(f"unknown export column(s): {', '.join(unknown)}")
+    return list(dict.fromkeys(names))
+
+
+def available_encodings():
+    return ('zstd', 'gzip') if zstandard is not None else ('gzip',)
+
+
+def pick_encoding(compress, accept_encoding):
+    """Return 'zstd', 'gzip' or None for the `compress` param (auto negotiates via Accept-Encoding)."""
+    if compress == 'none':
+        return None
+    if compress != 'auto':
+        if compress not in available_encodings():
+            raise ValueError(f'{compress} compression requires the zstandard package')
+        return compress
+    accepted = {part.split(';')[0].strip().lower() for part in (accept_encoding or '').split(',')}
+    for encoding in available_encodings():
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def _compressor(encoding):
+    if encoding == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=3, threads=ZSTD_THREADS).compressobj()
+    return None
+
+
+def select_sql(columns, where_sql):
+    exprs = ', '.join(COLUMNS[c] for c in columns)
+    return f"SELECT {exprs} FROM venues{where_sql} ORDER BY name COLLATE NOCASE, id;"
+
+
+def _iter_batches(cur):
+    while True:
+        rows = cur.fetchmany(FETCH_ROWS)
+        if not rows:
+            return
+        yield rows
+
+
+def _csv_chunks(cur, columns):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for rows in _iter_batches(cur):
+        for r in rows:
+            writer.writerow(r)
+            if buf.tell() >= CHUNK_BYTES:
+                yield buf.getvalue().encode('utf-8')
+                buf.seek(0)
+                buf.truncate(0)
+    yield buf.getvalue().encode('utf-8')
+
+
+def _ndjson_chunks(cur, columns):
+    parts, size = [], 0
+    for rows in _iter_batches(cur):
+        for r in rows:
+            line = dumps_line(dict(zip(columns, r)))
+            parts.append(line)
+            size += len(line)
+            if size >= CHUNK_BYTES:
+                yield b''.join(parts)
+                parts, size = [], 0
+    yield b''.join(parts)
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file object collecting what the Parquet writer emits, drained per row group."""
+
+    def __init__(self):
+        self.parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.parts.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data, self.parts = b''.join(self.parts), []
+        return data
+
+
+def _parquet_chunks(cur, columns):
+    import pyarrow
+    import pyarrow.parquet
+
+    schema = pyarrow.schema([(c, getattr(pyarrow, ARROW_TYPES.get(c, 'string'))()) for c in columns])
+    sink = _Sink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd')
+    pending = []
+
+    def flush():
+        table = pyarrow.Table.from_pylist([dict(zip(columns, r)) for r in pending], schema=schema)
+        writer.write_table(table)
+        pending.clear()
+
+    for rows in _iter_batches(cur):
+        pending.extend(rows)
+        if len(pending) >= PARQUET_ROW_GROUP:
+            flush()
+            yield sink.drain()
+    if pending:
+        flush()
+    writer.close()
+    yield sink.drain()
+
+
+ENCODERS = {'csv': _csv_chunks, 'ndjson': _ndjson_chunks, 'parquet': _parquet_chunks}
+
+
+def stream(conn, fmt, columns, where_sql, params, encoding=None):
+    """Yield the export body, read from `conn`, which must stay open until the stream ends."""
+    compressor = _compressor(encoding)
+    cur = conn.cursor()
+    cur.execute(select_sql(columns, where_sql), params)
+    for chunk in ENCODERS[fmt](cur, columns):
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    if compressor is not None:
+        yield compressor.flush()
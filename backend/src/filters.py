@@ -0,0 +1,202 @@
+# Filter compiler shared by every venue endpoint (list, summary, aggregate, nearest, batch, export).
+# Purpose: turns the chain/category/dma/city/state/open_status/location filters into a WHERE clause
+# that SQLite can answer from indexes instead of scanning venues with LIKE '%value%'.
+# VenueFilter is the typed, canonical form of the filters; compile_filter() is the one place that
+# turns it into SQL, so new filters and index-aware rewrites are added here.
+# Interaction: relies on the key columns, B-tree indexes, venues_fts and venues_rtree tables from
+# db.ensure_schema(); the bbox / radius clauses come from geo.py. rollups.rollup_where and
+# columnar.ColumnarStore.mask take the same VenueFilter.
+
+import string
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+from .geo import bbox_clause, radius_clause
+
+# Supported matching modes for chain/category/dma values:
+#   exact    - case-insensitive equality, answered by the *_key B-tree indexes (IN-list)
+#   prefix   - case-insensitive "starts with", answered as a range scan on the same indexes
+#   contains - case-insensitive substring, answered by the venues_fts trigram index
+MATCH_MODES = ('exact', 'prefix', 'contains')
+MATCH_PATTERN = '^(exact|prefix|contains)$'
+
+# Query param name -> (source column, lowercase key column).
+MULTI_COLUMNS = {
+    'chain': ('chain_name', 'chain_key'),
+    'category': ('sub_category', 'category_key'),
+    'dma': ('dma', 'dma_key'),
+}
+
+# The trigram tokenizer can only use its index for patterns with at least 3 characters;
+# shorter substrings fall back to a LIKE over the source column.
+TRIGRAM_MIN = 3
+
+# Compiled filters kept in memory (see compile_filter).
+COMPILE_CACHE_SIZE = 1024
+
+# SQLite's NOCASE collation, LIKE and lower() only fold ASCII letters; fold the same way so
+# Python-side matching, ordering and key-column params agree with SQLite.
+_ASCII_FOLD = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def fold(value):
+    return value.translate(_ASCII_FOLD)
+
+
+def clean_values(values):
+    # ignore empty values and the sentinel 'all' entries
+    if not values:
+        return []
+    return [v for v in values if v and v.lower() != 'all']
+
+
+def _canonical_values(values):
+    # all match modes are case-insensitive and values are ORed, so order, case and
+    # duplicates don't change the result
+    return tuple(sorted({fold(v) for v in clean_values(values)}))
+
+
+def _canonical_scalar(value):
+    if not value or value.lower() == 'all':
+        return None
+    return value
+
+
+@dataclass(frozen=True)
+class VenueFilter:
+    """Canonical venue filters; build with VenueFilter.create() from raw request values.
+
+    Equivalent requests produce equal (and equally hashed) filters, so a VenueFilter is also
+    the cache key for responses and compiled SQL. `bbox` is (west, south, east, north) and
+    `radius` is (lat, lon, miles).
+    """
+    chain: tuple = ()
+    category: tuple = ()
+    dma: tuple = ()
+    city: Optional[str] = None
+    state: Optional[str] = None
+    open_status: Optional[str] = None  # 'open' | 'closed' | None
+    match: str = 'contains'
+    bbox: Optional[tuple] = None
+    radius: Optional[tuple] = None
+
+    @classmethod
+    def create(cls, chain=None, category=None, dma=None, city=None, state=None, open_status=None,
+               match='contains', bbox=None, radius=None):
+        status = (open_status or '').lower()
+        return cls(
+            chain=_canonical_values(chain),
+            category=_canonical_values(category),
+            dma=_canonical_values(dma),
+            city=_canonical_scalar(city),
+            state=_canonical_scalar(state),
+            open_status=status if status in ('open', 'closed') else None,
+            match=match,
+            bbox=tuple(bbox) if bbox else None,
+            radius=tuple(radius) if radius else None,
+        )
+
+    def multi(self):
+        """(field, values) for the multi-value fields, in clause order."""
+        return (('chain', self.chain), ('category', self.category), ('dma', self.dma))
+
+    def shape(self):
+        """Everything the compiled SQL text depends on (values excluded)."""
+        def values_shape(values):
+            if self.match == 'contains':
+                return tuple(len(v) >= TRIGRAM_MIN for v in values)
+            return len(values)
+        return (self.match, *(values_shape(v) for _, v in self.multi()), self.city is not None,
+                self.state is not None, self.open_status, self.bbox is not None, self.radius is not None)
+
+
+class CompiledFilter(NamedTuple):
+    where_sql: str  # '' or ' WHERE ...', appended to 'FROM venues'
+    params: tuple
+
+
+def _prefix_upper(prefix):
+    # smallest string greater than every string starting with prefix
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _multi_clause(values, column, key_column, match, params, indexed=True):
+    if match == 'exact':
+        params.extend(values)
+        return f"{key_column} IN ({','.join('?' for _ in values)})"
+    if match == 'prefix':
+        sub = []
+        for v in values:
+            sub.append(f"({key_column} >= ? AND {key_column} < ?)")
+            params.extend([v, _prefix_upper(v)])
+        return "(" + " OR ".join(sub) + ")"
+    # contains: union of trigram lookups; short values can't use the index
+    fts = [v for v in values if len(v) >= TRIGRAM_MIN] if indexed else []
+    short = [v for v in values if len(v) < TRIGRAM_MIN or not indexed]
+    sub = []
+    if fts:
+        lookups = " UNION ".join(f"SELECT rowid FROM venues_fts WHERE {column} LIKE ?" for _ in fts)
+        sub.append(f"id IN ({lookups})")
+        params.extend(f"%{v}%" for v in fts)
+    for v in short:
+        sub.append(f"{column} LIKE ? COLLATE NOCASE")
+        params.append(f"%{v}%")
+    return "(" + " OR ".join(sub) + ")"
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def compile_filter(f):
+    """Compile a VenueFilter into a CompiledFilter (where_sql, params).
+
+    Multiple values per field are ORed together and different fields are ANDed. The SQL
+    text depends only on f.shape(), never on the values, so every filter of the same shape
+    reuses one prepared statement from sqlite3's per-connection statement cache; compiled
+    filters themselves are memoized per canonical filter.
+    """
+    return _compile(f, indexed=True)
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def compile_scan_filter(f):
+    """Like compile_filter(), for tables with the venue columns but not venues_fts / venues_rtree.
+
+    Substring and location filters are evaluated on each row instead of through those indexes;
+    meant for small tables such as the approximate summary's sample (src/approx.py).
+    """
+    return _compile(f, indexed=False)
+
+
+def _compile(f, indexed):
+    where = []
+    params = []
+    for field, values in f.multi():
+        if values:
+            column, key_column = MULTI_COLUMNS[field]
+            where.append(_multi_clause(values, column, key_column, f.match, params, indexed))
+    if f.city is not None:
+        where.append("city = ?")
+        params.append(f.city)
+    if f.state is not None:
+        where.append("state_name = ?")
+        params.append(f.state)
+    # filter by open/closed status
+    if f.open_status == 'open':
+        where.append("(date_closed IS NULL OR date_closed = '')")
+    elif f.open_status == 'closed':
+        where.append("(date_closed IS NOT NULL AND date_closed <> '')")
+    for clause_fn, spec in ((bbox_clause, f.bbox), (radius_clause, f.radius)):
+        if spec:
+            clause, clause_params = clause_fn(*spec, indexed=indexed)
+            where.append(clause)
+            params.extend(clause_params)
+    if not where:
+        return CompiledFilter('', ())
+    return CompiledFilter(" WHERE " + " AND ".join(where), tuple(params))
+
+
+def build_where(chain=None, category=None, dma=None, city=None, state=None, open_status=None, match='contains',
+                bbox=None, radius=None):
+    """Return (where_sql, params) for raw filter values; shorthand for compile_filter(VenueFilter.create(...))."""
+    where_sql, params = compile_filter(VenueFilter.create(chain, category, dma, city, state, open_status, match, bbox, radius))
+    return where_sql, list(params)
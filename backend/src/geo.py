@@ -0,0 +1,171 @@
+# Geospatial support for venues: parsed coordinates, an R*Tree index and distance helpers.
+# Purpose: geolocation arrives as WKT text ("POINT (lon lat)"); ingestion stores numeric lat/lon,
+# venues_rtree indexes them, and the venue endpoints can filter by bounding box or radius and
+# look up the nearest stores without scanning the table.
+# Interaction: db.ensure_schema() calls ensure_geo(); ingest.normalize_row() uses parse_point();
+# filters.build_where() emits the bbox/radius clauses; db.connect() registers distance_mi().
+
+import math
+
+EARTH_RADIUS_MI = 3958.8
+
+# Miles per degree of latitude (and of longitude at the equator).
+MILES_PER_DEGREE = 69.0
+
+# R*Tree over venue coordinates (points are stored as zero-size boxes), kept in sync by triggers.
+RTREE_SQL = 'CREATE VIRTUAL TABLE IF NOT EXISTS venues_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);'
+
+RTREE_TRIGGERS_SQL = (
+    '''CREATE TRIGGER IF NOT EXISTS venues_rtree_ai AFTER INSERT ON venues WHEN new.lat IS NOT NULL AND new.lon IS NOT NULL BEGIN
+        INSERT INTO venues_rtree (id, min_lat, max_lat, min_lon, max_lon) VALUES (new.id, new.lat, new.lat, new.lon, new.lon);
+    END;''',
+    '''CREATE TRIGGER IF NOT EXISTS venues_rtree_ad AFTER DELETE ON venues BEGIN
+        DELETE FROM venues_rtree WHERE id = old.id;
+    END;''',
+    '''CREATE TRIGGER IF NOT EXISTS venues_rtree_au AFTER UPDATE OF lat, lon ON venues BEGIN
+        DELETE FROM venues_rtree WHERE id = old.id;
+        INSERT INTO venues_rtree (id, min_lat, max_lat, min_lon, max_lon)
+        SELECT new.id, new.lat, new.lat, new.lon, new.lon WHERE new.lat IS NOT NULL AND new.lon IS NOT NULL;
+    END;''',
+)
+
+RTREE_TRIGGERS = ('venues_rtree_ai', 'venues_rtree_ad', 'venues_rtree_au')
+
+
+def parse_point(wkt):
+    """Parse 'POINT (lon lat)' into (lat, lon); returns (None, None) for missing/invalid values."""
+    if not wkt:
+        return None, None
+    text = wkt.strip()
+    if not text.upper().startswith('POINT'):
+        return None, None
+    try:
+        lon, lat = text[text.index('(') + 1:text.rindex(')')].split()
+        lat, lon = float(lat), float(lon)
+    except ValueError:
+        return None, None
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        return None, None
+    return lat, lon
+
+
+def distance_mi(lat1, lon1, lat2, lon2):
+    """Great-circle (haversine) distance in miles; None if any coordinate is missing."""
+    if lat1 is None or lon1 is None or lat2 is None or lon2 is None:
+        return None
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_MI * math.asin(min(1.0, math.sqrt(a)))
+
+
+def circle_bbox(lat, lon, miles):
+    """(west, south, east, north) box enclosing the circle of `miles` around (lat, lon).
+
+    west > east when the box crosses the antimeridian (see lon_ranges); a circle holding a
+    pole gets every longitude.
+    """
+    dlat = miles / MILES_PER_DEGREE
+    south, north = lat - dlat, lat + dlat
+    if south <= -90.0 or north >= 90.0:
+        # the circle holds a pole
+        return -180.0, max(south, -90.0), 180.0, min(north, 90.0)
+    # widest longitude offset of a spherical cap: asin(sin(radius) / cos(lat))
+    dlon = math.degrees(math.asin(min(1.0, math.sin(math.radians(dlat)) / math.cos(math.radians(lat)))))
+    west, east = lon - dlon, lon + dlon
+    if west < -180.0:
+        west += 360.0
+    if east > 180.0:
+        east -= 360.0
+    return west, south, east, north
+
+
+def lon_ranges(west, east):
+    """Longitude ranges of a box from `west` eastwards to `east`: two when it crosses the
+    antimeridian (west > east), e.g. 170..-170 is 170..180 plus -180..-170."""
+    if west <= east:
+        return [(west, east)]
+    return [(west, 180.0), (-180.0, east)]
+
+
+def parse_bbox(text):
+    """Parse 'west,south,east,north' (degrees) into a tuple; raises ValueError if malformed.
+
+    A west edge east of the east edge means the box crosses the antimeridian.
+    """
+    parts = [float(p) for p in text.split(',')]
+    if len(parts) != 4:
+        raise ValueError('bbox needs 4 comma-separated numbers: west,south,east,north')
+    west, south, east, north = parts
+    if not (-180.0 <= west <= 180.0 and -180.0 <= east <= 180.0 and -90.0 <= south <= north <= 90.0):
+        raise ValueError('bbox needs longitudes in [-180, 180] and -90 <= south <= north <= 90')
+    return west, south, east, north
+
+
+def bbox_clause(west, south, east, north, indexed=True):
+    # the R*Tree finds candidates (its float32 boxes may be a hair too wide), the BETWEEN
+    # on the row keeps the result exact; without `indexed` only the BETWEEN is used. A box
+    # across the antimeridian is two longitude ranges (one R*Tree search each).
+    ranges = lon_ranges(west, east)
+    clause = "lat BETWEEN ? AND ? AND " + (
+        "lon BETWEEN ? AND ?" if len(ranges) == 1 else "(lon BETWEEN ? AND ? OR lon BETWEEN ? AND ?)")
+    params = [south, north] + [v for r in ranges for v in r]
+    if not indexed:
+        return clause, params
+    search = "SELECT id FROM venues_rtree WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?"
+    return (
+        f"id IN ({' UNION ALL '.join(search for _ in ranges)}) AND " + clause,
+        [v for lo, hi in ranges for v in (south, north, lo, hi)] + params,
+    )
+
+
+def radius_clause(lat, lon, miles, indexed=True):
+    west, south, east, north = circle_bbox(lat, lon, miles)
+    clause, params = bbox_clause(west, south, east, north, indexed)
+    return clause + " AND distance_mi(lat, lon, ?, ?) <= ?", params + [lat, lon, miles]
+
+
+def ensure_geo(conn, existing_columns):
+    """Add lat/lon columns (backfilled from geolocation), the R*Tree and its triggers."""
+    cur = conn.cursor()
+    if 'lat' not in existing_columns:
+        cur.execute('ALTER TABLE venues ADD COLUMN lat REAL;')
+        cur.execute('ALTER TABLE venues ADD COLUMN lon REAL;')
+        rows = cur.execute('SELECT id, geolocation FROM venues WHERE geolocation IS NOT NULL;').fetchall()
+        cur.executemany('UPDATE venues SET lat = ?, lon = ? WHERE id = ?;',
+                        [(*parse_point(g), i) for i, g in rows])
+    exists = cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'venues_rtree';").fetchone()
+    cur.execute(RTREE_SQL)
+    for sql in RTREE_TRIGGERS_SQL:
+        cur.execute(sql)
+    if not exists:
+        rebuild_rtree(conn)
+
+
+def rebuild_rtree(conn):
+    conn.execute('DELETE FROM venues_rtree;')
+    conn.execute('INSERT INTO venues_rtree (id, min_lat, max_lat, min_lon, max_lon) '
+                 'SELECT id, lat, lat, lon, lon FROM venues WHERE lat IS NOT NULL AND lon IS NOT NULL;')
+
+
+# Nearest-k search: grow a search radius until it holds k matches whose k-th distance is
+# inside the radius (so no closer store can lie outside it), starting small for dense areas.
+NEAREST_START_MI = 5.0
+NEAREST_MAX_MI = 12500.0  # half the Earth's circumference: covers everything
+
+
+def nearest(conn, lat, lon, k, columns, where_sql='', params=()):
+    """Return up to k (distance_mi, row) pairs nearest to (lat, lon) among the filtered venues.
+
+    `columns` is the SELECT list for row; `where_sql`/`params` come from filters.build_where.
+    """
+    miles = NEAREST_START_MI
+    while True:
+        clause, clause_params = radius_clause(lat, lon, miles)
+        sql = (f"SELECT distance_mi(lat, lon, ?, ?) AS d, {columns} FROM venues"
+               f"{where_sql + ' AND ' if where_sql else ' WHERE '}{clause} ORDER BY d, id LIMIT ?;")
+        rows = conn.execute(sql, [lat, lon] + list(params) + clause_params + [k]).fetchall()
+        if len(rows) >= k or miles >= NEAREST_MAX_MI:
+            return [(r[0], r[1:]) for r in rows]
+        miles *= 4
@@ -0,0 +1,561 @@
+# Streaming CSV ingestion into the venues table.
+# Purpose: parses the Bigbox Stores Metrics CSV row by row and inserts it in fixed-size batches,
+# each in its own transaction, so memory stays bounded no matter how large the file is and an
+# interrupted load can resume from the last committed batch.
+# Interaction: used by load_csv.py (CLI) and by init_db() in app.py to seed an empty DB.
+# ingest_delta() refreshes an existing table in place, keyed on entity_id, touching only
+# rows whose content changed.
+# ingest_metrics() streams the per-day metrics history (timeseries.py) into venue_metrics.
+# ingest_parallel() parses many files (or byte ranges of one big file) in a process pool and
+# feeds the parsed rows to a single writer connection, since SQLite allows only one writer.
+
+import csv
+import datetime
+import glob
+import hashlib
+import io
+import itertools
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+
+from . import approx
+from .db import bump_data_version, drop_derived, ensure_schema, get_data_version
+from .geo import parse_point
+from .timeseries import UPSERT_METRICS_SQL, record_range, to_day
+
+FIELD_ORDER = [
+    'entity_id','entity_type','name','foot_traffic','sales','avg_dwell_time_min','area_sqft','ft_per_sqft',
+    'geolocation','country','state_code','state_name','city','postal_code','formatted_city','street_address',
+    'sub_category','dma','cbsa','chain_id','chain_name','store_id','date_opened','date_closed'
+]
+
+# Columns derived from the CSV fields while parsing; normalize_row appends them after FIELD_ORDER.
+DERIVED_FIELDS = ['lat', 'lon']
+ROW_FIELDS = FIELD_ORDER + DERIVED_FIELDS
+GEOLOCATION = FIELD_ORDER.index('geolocation')
+
+# Rows are written with their content hash (row_hash() below) appended, so a later delta load
+# can tell unchanged rows apart whichever path loaded them.
+INSERT_SQL = (f'INSERT INTO venues ({",".join(ROW_FIELDS)}, row_hash) '
+              f'VALUES ({",".join("?" for _ in ROW_FIELDS)}, ?)')
+
+# Plain loads add new entities only: a row whose entity_id is already in venues (loaded earlier,
+# or by another file of the same feed) is skipped and counted, not a constraint error halfway
+# through the load. Use a delta load to update existing entities.
+INSERT_NEW_SQL = INSERT_SQL + ' ON CONFLICT DO NOTHING'
+
+# Rows per transaction; large enough to amortize commits, small enough to keep memory flat.
+BATCH_SIZE = 5000
+
+# Report progress every this many rows.
+PROGRESS_EVERY = 50000
+
+# Keep at most this many parse errors for reporting; the rest are only counted.
+MAX_ERRORS_KEPT = 20
+
+# Resume bookkeeping: rows of `source` committed so far. The file's size and mtime identify the
+# version of the file, so a changed file starts over instead of skipping the wrong rows.
+PROGRESS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS ingest_progress (
+    source TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    rows_committed INTEGER NOT NULL
+);'''
+
+
+def parse_int(v):
+    if v is None or v == '':
+        return None
+    try:
+        return int(v)
+    except Exception:
+        try:
+            return int(float(v))
+        except Exception:
+            return None
+
+
+def parse_float(v):
+    if v is None or v == '':
+        return None
+    try:
+        return float(v)
+    except Exception:
+        return None
+
+
+INT_FIELDS = frozenset(('foot_traffic',))
+FLOAT_FIELDS = frozenset(('sales', 'avg_dwell_time_min', 'area_sqft', 'ft_per_sqft'))
+
+
+def normalize_row(r):
+    # normalize keys to lower/strip and map to FIELD_ORDER names, then append DERIVED_FIELDS
+    row = {k.strip(): (v.strip() if isinstance(v, str) else v) for k, v in r.items()}
+    out = []
+    for key in FIELD_ORDER:
+        val = row.get(key, '')
+        # numeric conversions for known fields
+        if key in INT_FIELDS:
+            out.append(parse_int(val))
+        elif key in FLOAT_FIELDS:
+            out.append(parse_float(val))
+        else:
+            out.append(val if val != '' else None)
+    out.extend(parse_point(out[GEOLOCATION]))
+    return out
+
+
+def row_hash(row):
+    # derived fields follow from the CSV fields, so they don't take part in the hash
+    return hashlib.blake2b(repr(row[:len(FIELD_ORDER)]).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def with_hash(row):
+    """`row` with its row_hash appended, as INSERT_SQL / UPSERT_SQL take it."""
+    return row + [row_hash(row)]
+
+
+def iter_rows(csv_path, errors, skip=0):
+    """Yield normalized rows from the CSV, one at a time.
+
+    Rows that fail to parse are counted in errors['count'] (the first few are kept in
+    errors['samples'] as (line, message)). `skip` drops that many leading data rows.
+    """
+    with open(csv_path, newline='', encoding='utf-8') as fh:
+        reader = csv.DictReader(fh)
+        for i, r in enumerate(reader, start=1):
+            if i <= skip:
+                continue
+            try:
+                yield normalize_row(r)
+            except Exception as e:
+                errors['count'] += 1
+                if len(errors['samples']) < MAX_ERRORS_KEPT:
+                    errors['samples'].append((i, str(e)))
+
+
+def batched(iterable, size):
+    it = iter(iterable)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _source_id(csv_path):
+    st = os.stat(csv_path)
+    return os.path.abspath(csv_path), st.st_size, st.st_mtime
+
+
+def _committed_rows(conn, source, size, mtime):
+    row = conn.execute(
+        "SELECT size, mtime, rows_committed FROM ingest_progress WHERE source = ?;", (source,)
+    ).fetchone()
+    if row and row[0] == size and row[1] == mtime:
+        return row[2]
+    return 0
+
+
+def print_progress(rows, elapsed):
+    rate = rows / elapsed if elapsed > 0 else 0.0
+    print(f'  {rows} rows in {elapsed:.1f}s ({rate:,.0f} rows/s)', flush=True)
+
+
+@contextmanager
+def bulk_load(conn, defer_indexes=False):
+    """Tune `conn` for a bulk load and restore it afterwards.
+
+    No WAL checkpoints until the load is done. Commits keep connect()'s synchronous=NORMAL:
+    in WAL mode they don't fsync either, and a power loss or OS crash can cost the last
+    committed batches but never corrupts the file (synchronous=OFF could). With `defer_indexes`, secondary indexes and sync triggers are
+    dropped for the duration and rebuilt once at the end. Yields a dict whose 'venues' the
+    caller increases by the venue rows it inserts or updates; when the load succeeds and that
+    count is not 0, the approximate summary's sample and sketches are refreshed (src/approx.py).
+    """
+    before = get_data_version(conn)
+    load = {'venues': 0}
+    if defer_indexes:
+        drop_derived(conn)
+    conn.execute('PRAGMA wal_autocheckpoint=0;')
+    succeeded = False
+    try:
+        yield load
+        succeeded = True
+    finally:
+        if not succeeded:
+            conn.rollback()  # the batch in progress
+        if defer_indexes:
+            ensure_schema(conn)
+        if succeeded and load['venues']:
+            approx.refresh(conn, get_data_version(conn))
+        elif succeeded:
+            approx.keep_current(conn, before, get_data_version(conn))
+        conn.execute('PRAGMA wal_autocheckpoint=1000;')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE);')
+
+
+def ingest_csv(conn, csv_path, batch_size=BATCH_SIZE, resume=False, defer_indexes=False, progress=print_progress):
+    """Stream `csv_path` into venues in batches of `batch_size` rows.
+
+    Each batch is inserted and committed together with its ingest_progress record, so with
+    `resume` a rerun skips the rows already committed for the same (unchanged) file. Rows of
+    entities already in venues are skipped (counted as 'existing').
+    `defer_indexes` drops secondary indexes and sync triggers for the load and rebuilds them
+    once at the end (worth it for large loads). `progress(rows, elapsed)` is called every
+    PROGRESS_EVERY rows and at the end. Returns a stats dict.
+    """
+    ensure_schema(conn)
+    conn.execute(PROGRESS_TABLE_SQL)
+    source, size, mtime = _source_id(csv_path)
+    skip = _committed_rows(conn, source, size, mtime) if resume else 0
+    conn.commit()
+
+    errors = {'count': 0, 'samples': []}
+    read = inserted = 0
+    started = time.perf_counter()
+    next_report = PROGRESS_EVERY
+    with bulk_load(conn, defer_indexes) as load:
+        for batch in batched(iter_rows(csv_path, errors, skip), batch_size):
+            written = conn.executemany(INSERT_NEW_SQL, map(with_hash, batch)).rowcount
+            read += len(batch)
+            inserted += written
+            load['venues'] += written
+            conn.execute(
+                "INSERT OR REPLACE INTO ingest_progress (source, size, mtime, rows_committed) VALUES (?, ?, ?, ?);",
+                (source, size, mtime, skip + read + errors['count']),
+            )
+            if written:
+                bump_data_version(conn)
+            conn.commit()
+            if progress and read >= next_report:
+                progress(read, time.perf_counter() - started)
+                next_report += PROGRESS_EVERY
+        # the file is fully loaded; a later run starts from the top again
+        conn.execute("DELETE FROM ingest_progress WHERE source = ?;", (source,))
+        conn.commit()
+    elapsed = time.perf_counter() - started
+    if progress:
+        progress(read, elapsed)
+    return {
+        'inserted': inserted,
+        'existing': read - inserted,
+        'skipped': skip,
+        'errors': errors['count'],
+        'error_samples': errors['samples'],
+        'seconds': elapsed,
+    }
+
+
+# Byte-range size handed to one parse worker; bounds the rows each worker returns at once.
+CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def expand_sources(spec):
+    """Resolve --csv to a sorted list of files: a directory (all *.csv in it), a glob, or a path."""
+    if os.path.isdir(spec):
+        return sorted(glob.glob(os.path.join(spec, '*.csv')))
+    if glob.has_magic(spec):
+        return sorted(p for p in glob.glob(spec) if os.path.isfile(p))
+    return [spec] if os.path.exists(spec) else []
+
+
+def plan_chunks(paths, chunk_bytes=CHUNK_BYTES):
+    """Split files into (path, start, end) byte ranges of about chunk_bytes each.
+
+    Ranges are aligned to line boundaries by the worker (parse_range), which assumes quoted
+    fields don't contain newlines - true for the Bigbox metrics exports.
+    """
+    chunks = []
+    for path in paths:
+        size = os.path.getsize(path)
+        start = 0
+        while True:
+            end = min(start + chunk_bytes, size)
+            chunks.append((path, start, end))
+            if end >= size:
+                break
+            start = end
+    return chunks
+
+
+def parse_range(path, start, end):
+    """Parse the CSV lines that start within [start, end) of `path` (runs in a worker process).
+
+    Returns (rows, error_count, error_samples, cpu_seconds); rows carry their row_hash, so the
+    hashing is spread over the workers too.
+    """
+    cpu_started = time.process_time()
+    with open(path, 'rb') as fh:
+        header = fh.readline()
+        if start <= fh.tell():
+            start = fh.tell()
+        else:
+            # finish the line straddling `start`; it belongs to the previous range
+            fh.seek(start - 1)
+            fh.readline()
+        lines = []
+        while fh.tell() < end:
+            line = fh.readline()
+            if not line:
+                break
+            lines.append(line)
+    fieldnames = next(csv.reader([header.decode('utf-8')]))
+    reader = csv.DictReader(io.StringIO(b''.join(lines).decode('utf-8'), newline=''), fieldnames=fieldnames)
+    rows = []
+    error_count = 0
+    samples = []
+    for i, r in enumerate(reader, start=1):
+        try:
+            rows.append(with_hash(normalize_row(r)))
+        except Exception as e:
+            error_count += 1
+            if len(samples) < MAX_ERRORS_KEPT:
+                samples.append((f'{os.path.basename(path)}@{start}+{i}', str(e)))
+    return rows, error_count, samples, time.process_time() - cpu_started
+
+
+def ingest_parallel(conn, paths, workers=os.cpu_count(), chunk_bytes=CHUNK_BYTES, batch_size=BATCH_SIZE,
+                    defer_indexes=False, progress=print_progress):
+    """Parse `paths` in a pool of `workers` processes and insert the rows through `conn`.
+
+    At most 2 * workers chunks are in flight, so parsed-but-unwritten rows stay bounded.
+    Rows of entities already in venues are skipped, as in ingest_csv().
+    Returns a stats dict including parse CPU seconds (summed over workers), writer seconds
+    and wall seconds, which show whether the pool or the single writer is the bottleneck.
+    """
+    ensure_schema(conn)
+    chunks = plan_chunks(paths, chunk_bytes)
+    window = max(1, 2 * workers)
+    errors = 0
+    samples = []
+    read = inserted = 0
+    parse_cpu = 0.0
+    write_seconds = 0.0
+    started = time.perf_counter()
+    next_report = PROGRESS_EVERY
+    with bulk_load(conn, defer_indexes) as load, ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = iter(chunks)
+        in_flight = set()
+
+        def refill():
+            for task in itertools.islice(pending, window - len(in_flight)):
+                in_flight.add(pool.submit(parse_range, *task))
+
+        refill()
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            refill()
+            for future in done:
+                rows, error_count, error_samples, cpu = future.result()
+                parse_cpu += cpu
+                errors += error_count
+                samples.extend(error_samples[:MAX_ERRORS_KEPT - len(samples)])
+                write_started = time.perf_counter()
+                for batch in batched(rows, batch_size):
+                    written = conn.executemany(INSERT_NEW_SQL, batch).rowcount
+                    if written:
+                        bump_data_version(conn)
+                    conn.commit()
+                    inserted += written
+                    load['venues'] += written
+                write_seconds += time.perf_counter() - write_started
+                read += len(rows)
+                if progress and read >= next_report:
+                    progress(read, time.perf_counter() - started)
+                    next_report = (read // PROGRESS_EVERY + 1) * PROGRESS_EVERY
+    elapsed = time.perf_counter() - started
+    if progress:
+        progress(read, elapsed)
+    return {
+        'files': len(paths),
+        'chunks': len(chunks),
+        'workers': workers,
+        'inserted': inserted,
+        'existing': read - inserted,
+        'skipped': 0,
+        'errors': errors,
+        'error_samples': samples,
+        'seconds': elapsed,
+        'parse_cpu_seconds': parse_cpu,
+        'write_seconds': write_seconds,
+    }
+
+
+# Delta (refresh) mode: upsert keyed on entity_id, writing only rows whose content hash changed.
+UPSERT_SQL = (
+    INSERT_SQL + ' ON CONFLICT (entity_id) DO UPDATE SET '
+    + ', '.join(f'{f} = excluded.{f}' for f in ROW_FIELDS if f != 'entity_id')
+    + ', row_hash = excluded.row_hash'
+)
+ENTITY_ID = FIELD_ORDER.index('entity_id')
+
+# Format of date_closed values written when an entity disappears from the feed
+# (matches the feed's own timestamps, e.g. '2017-01-01 00:00:00.000000 UTC').
+TOMBSTONE_FORMAT = '%Y-%m-%d 00:00:00.000000 UTC'
+
+
+def backfill_row_hashes(conn, batch_size=BATCH_SIZE):
+    """Hash the stored rows that have no row_hash yet; returns how many were hashed.
+
+    Rows loaded before inserts stored a hash have none, nor do rows a delta tombstoned. Stored
+    values read back as the types normalize_row produced, so the hash matches that of
+    the same CSV row.
+    """
+    rows = conn.execute(f"SELECT id, {','.join(FIELD_ORDER)} FROM venues WHERE row_hash IS NULL;").fetchall()
+    for batch in batched(rows, batch_size):
+        conn.executemany('UPDATE venues SET row_hash = ? WHERE id = ?;', [(row_hash(list(r[1:])), r[0]) for r in batch])
+    conn.commit()
+    return len(rows)
+
+
+def _has_entity_key(conn):
+    row = conn.execute("SELECT \"unique\" FROM pragma_index_list('venues') WHERE name = 'idx_venues_entity_id';").fetchone()
+    return bool(row and row[0])
+
+
+def ingest_delta(conn, paths, batch_size=BATCH_SIZE, tombstone=True, progress=print_progress):
+    """Refresh venues from `paths` in place, keyed on entity_id.
+
+    Each incoming row is hashed; rows whose entity is new are inserted, rows whose hash differs
+    from the stored row_hash are updated, and identical rows are not written at all. With
+    `tombstone`, open entities absent from every file get date_closed set to today (pass
+    tombstone=False for partial feeds). The data version is only bumped when something changed,
+    so a no-op refresh keeps every cache warm. Returns inserted/updated/unchanged/tombstoned counts.
+    """
+    ensure_schema(conn)
+    if not _has_entity_key(conn):
+        raise ValueError('delta loads need a unique entity_id index; remove duplicate entity_id rows first')
+    backfill_row_hashes(conn, batch_size)
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS delta_seen (entity_id TEXT PRIMARY KEY);')
+    conn.execute('DELETE FROM temp.delta_seen;')
+    conn.commit()
+
+    errors = {'count': 0, 'samples': []}
+    stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'tombstoned': 0, 'missing_id': 0}
+    started = time.perf_counter()
+    next_report = PROGRESS_EVERY
+    seen_rows = 0
+    with bulk_load(conn) as load:
+        for path in paths:
+            for batch in batched(iter_rows(path, errors), batch_size):
+                keyed = {}
+                for row in batch:
+                    if row[ENTITY_ID] is None:
+                        stats['missing_id'] += 1
+                    else:
+                        keyed[row[ENTITY_ID]] = row  # last occurrence wins within a batch
+                seen_rows += len(batch)
+                ids = list(keyed)
+                existing = {}
+                # stay under SQLITE_MAX_VARIABLE_NUMBER on older SQLite builds
+                for part in batched(ids, 500):
+                    existing.update(conn.execute(
+                        f"SELECT entity_id, row_hash FROM venues WHERE entity_id IN ({','.join('?' for _ in part)});", part
+                    ).fetchall())
+                writes = []
+                for entity_id, row in keyed.items():
+                    h = row_hash(row)
+                    if entity_id not in existing:
+                        stats['inserted'] += 1
+                    elif existing[entity_id] != h:
+                        stats['updated'] += 1
+                    else:
+                        stats['unchanged'] += 1
+                        continue
+                    writes.append(row + [h])
+                conn.executemany('INSERT OR IGNORE INTO temp.delta_seen (entity_id) VALUES (?);', [(i,) for i in ids])
+                if writes:
+                    conn.executemany(UPSERT_SQL, writes)
+                    bump_data_version(conn)
+                    load['venues'] += len(writes)
+                conn.commit()
+                if progress and seen_rows >= next_report:
+                    progress(seen_rows, time.perf_counter() - started)
+                    next_report += PROGRESS_EVERY
+        if tombstone:
+            today = datetime.datetime.now(datetime.timezone.utc).strftime(TOMBSTONE_FORMAT)
+            # clearing row_hash makes the next delta rehash the closed row (backfill_row_hashes),
+            # so a reappearing entity counts as changed and reopens
+            cur = conn.execute(
+                "UPDATE venues SET date_closed = ?, row_hash = NULL "
+                "WHERE (date_closed IS NULL OR date_closed = '') AND entity_id IS NOT NULL "
+                "AND entity_id NOT IN (SELECT entity_id FROM temp.delta_seen);",
+                (today,),
+            )
+            stats['tombstoned'] = cur.rowcount
+            if cur.rowcount:
+                bump_data_version(conn)
+                load['venues'] += cur.rowcount
+            conn.commit()
+    conn.execute('DROP TABLE IF EXISTS temp.delta_seen;')
+    elapsed = time.perf_counter() - started
+    if progress:
+        progress(seen_rows, elapsed)
+    stats.update(errors=errors['count'], error_samples=errors['samples'], seconds=elapsed)
+    return stats
+
+
+# Columns of a metrics history file; entity_id and date are required, the metrics may be empty.
+METRICS_FIELDS = ('entity_id', 'date', 'foot_traffic', 'sales', 'avg_dwell_time_min')
+
+
+def iter_metric_rows(csv_path, errors):
+    """Yield (day, foot_traffic, sales, avg_dwell_time_min, entity_id) rows of a history file."""
+    with open(csv_path, newline='', encoding='utf-8') as fh:
+        reader = csv.DictReader(fh)
+        missing = {'entity_id', 'date'} - {(f or '').strip() for f in reader.fieldnames or ()}
+        if missing:
+            raise ValueError(f'{csv_path}: missing column(s) {", ".join(sorted(missing))}')
+        for i, r in enumerate(reader, start=1):
+            r = {(k or '').strip(): (v.strip() if isinstance(v, str) else v) for k, v in r.items()}
+            try:
+                if not r.get('entity_id'):
+                    raise ValueError('missing entity_id')
+                yield (to_day(r['date'] or ''), parse_int(r.get('foot_traffic')), parse_float(r.get('sales')),
+                       parse_float(r.get('avg_dwell_time_min')), r['entity_id'])
+            except ValueError as e:
+                errors['count'] += 1
+                if len(errors['samples']) < MAX_ERRORS_KEPT:
+                    errors['samples'].append((i, str(e)))
+
+
+def ingest_metrics(conn, paths, batch_size=BATCH_SIZE, progress=print_progress):
+    """Stream metrics history files (METRICS_FIELDS columns, one row per entity and day) into venue_metrics.
+
+    Rows are matched to venues on entity_id and upserted on (venue, day), so reloading an
+    overlapping period replaces it; rows whose entity is not in venues are counted as unknown.
+    Each batch is committed with a data version bump. Returns a stats dict.
+    """
+    ensure_schema(conn)
+    errors = {'count': 0, 'samples': []}
+    rows = written = 0
+    started = time.perf_counter()
+    next_report = PROGRESS_EVERY
+    with bulk_load(conn):
+        for path in paths:
+            for batch in batched(iter_metric_rows(path, errors), batch_size):
+                before = conn.total_changes
+                conn.executemany(UPSERT_METRICS_SQL, batch)
+                written += conn.total_changes - before
+                rows += len(batch)
+                days = [r[0] for r in batch]
+                record_range(conn, min(days), max(days))
+                bump_data_version(conn)
+                conn.commit()
+                if progress and rows >= next_report:
+                    progress(rows, time.perf_counter() - started)
+                    next_report += PROGRESS_EVERY
+    elapsed = time.perf_counter() - started
+    if progress:
+        progress(rows, elapsed)
+    return {
+        'rows': rows,
+        'written': written,
+        'unknown': rows - written,
+        'errors': errors['count'],
+        'error_samples': errors['samples'],
+        'seconds': elapsed,
+    }
@@ -0,0 +1,208 @@
+# Memory-mapped column file shared by every worker process (FOOT_TRAFFIC_ENGINE=mapped).
+# Purpose: the columnar engine keeps a private copy of the venues in each worker (row tuples plus
+# arrays), so N uvicorn workers hold N copies and each rebuilds its own from SQLite. write()
+# encodes the venues once into a single read-only file next to the database ('<db>.columns'):
+# fixed-width columns, dictionary codes, strings as offsets into a UTF-8 blob and the list and
+# metric sort orders, each 64-byte aligned after a JSON header. MappedStore maps it with np.memmap, so every worker reads the same
+# physical pages through the OS page cache and opening it only parses the header and dictionaries.
+# Interaction: columnar.get_store() returns open_store(); MappedStore has the ColumnarStore
+# interface (mask / summary / page), so app.py serves both engines the same way. A file behind the
+# DB's data version is rewritten by the first worker to notice (under a lock, the others wait and
+# map the result); snapshot.build() writes it for a new snapshot before publishing.
+
+import bisect
+import json
+import os
+import struct
+
+import numpy as np
+
+from . import columnar
+from .db import writer_lock
+from .pagination import SORT_METRICS
+
+# DictColumn and ColumnarStore use columnar's lazily imported numpy
+columnar.load_numpy()
+
+MAGIC = b'FTCOLS2\n'
+ALIGN = 64
+
+# Dictionary-encoded columns: (LOAD_SQL column, store attribute).
+DICT_COLUMNS = (('chain_name', 'chain'), ('sub_category', 'category'), ('dma', 'dma'),
+                ('city', 'city'), ('state_name', 'state'))
+# Plain strings, stored as UTF-8 with an offsets array; NULL rows are flagged in '<name>_null'.
+STR_COLUMNS = ('entity_id', 'name', 'date_opened', 'date_closed')
+FLOAT_COLUMNS = ('sales', 'area_sqft', 'lat', 'lon', 'avg_dwell_time_min', 'ft_per_sqft')
+
+
+def columns_path(db_path):
+    return db_path + '.columns'
+
+
+def database_file(conn):
+    """Path of the main database of `conn` (the pool may be serving a snapshot)."""
+    return conn.execute('PRAGMA database_list;').fetchone()[2]
+
+
+def _floats(values):
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+def _strings(values):
+    encoded = [b'' if v is None else v.encode('utf-8') for v in values]
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return offsets, blob, np.array([v is None for v in values], dtype=bool)
+
+
+def encode(rows):
+    """Arrays and dictionaries for the venues rows of columnar.LOAD_SQL."""
+    n = len(rows)
+    cols = list(zip(*rows)) if rows else [()] * (columnar.ROW_WIDTH + 6)
+    ids, names = cols[0], cols[2]
+    arrays = {
+        'ids': np.array(ids, dtype=np.int64),
+        'foot_traffic': np.array([v or 0 for v in cols[8]], dtype=np.int64),
+        'foot_traffic_null': np.array([v is None for v in cols[8]], dtype=bool),
+        'closed': np.array([bool(v) for v in cols[10]], dtype=bool),
+    }
+    for name, values in zip(FLOAT_COLUMNS, cols[11:17]):
+        arrays[name] = _floats(values)
+    for name, values in zip(STR_COLUMNS, (cols[1], cols[2], cols[9], cols[10])):
+        arrays[f'{name}_offsets'], arrays[f'{name}_blob'], arrays[f'{name}_null'] = _strings(values)
+    dictionaries = {}
+    for (_, attr), values in zip(DICT_COLUMNS, cols[3:8]):
+        column = columnar.DictColumn(values)
+        arrays[f'{attr}_codes'], dictionaries[attr] = column.codes, column.dictionary
+    key = columnar.ColumnarStore.sort_key
+    arrays['order'] = np.array(sorted(range(n), key=lambda i: key(names[i], ids[i])), dtype=np.int64)
+    # the sorted list of every sort metric, shared like the columns instead of built per worker
+    foot_traffic = np.where(arrays['foot_traffic_null'], np.nan, arrays['foot_traffic'])
+    for name in SORT_METRICS:
+        values = foot_traffic if name == 'foot_traffic' else arrays[name]
+        arrays[f'order_{name}'] = columnar.metric_order(values, arrays['ids'])
+    return arrays, dictionaries
+
+
+def write(conn, path, version):
+    """Write the column file for the venues visible to `conn`; replaces `path` atomically."""
+    arrays, dictionaries = encode(conn.execute(columnar.LOAD_SQL).fetchall())
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = [array.dtype.str, offset, len(array)]
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    header = json.dumps({'version': version, 'rows': len(arrays['ids']), 'arrays': layout,
+                         'dictionaries': dictionaries}).encode('utf-8')
+    start = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, 'wb') as fh:
+            fh.write(MAGIC + struct.pack('<Q', len(header)) + header)
+            for name, array in arrays.items():
+                fh.seek(start + layout[name][1])
+                fh.write(np.ascontiguousarray(array).tobytes())
+            fh.truncate(start + offset)
+            fh.flush()
+            os.fsync(fh.fileno())
+        # readers that mapped the old file keep its inode until they drop the mapping
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def read_header(path):
+    """(header dict, offset of the first array), or None when the file is missing or not ours."""
+    try:
+        with open(path, 'rb') as fh:
+            if fh.read(len(MAGIC)) != MAGIC:
+                return None
+            (length,) = struct.unpack('<Q', fh.read(8))
+            header = json.loads(fh.read(length))
+    except (FileNotFoundError, struct.error, ValueError):
+        return None
+    return header, -(-(len(MAGIC) + 8 + length) // ALIGN) * ALIGN
+
+
+class StrColumn:
+    """Read-only view of a string column: offsets into a UTF-8 blob plus a NULL flag per row."""
+
+    def __init__(self, offsets, blob, nulls):
+        self.offsets = offsets
+        self.blob = blob
+        self.nulls = nulls
+
+    def __getitem__(self, i):
+        if self.nulls[i]:
+            return None
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+
+class MappedStore(columnar.ColumnarStore):
+    """ColumnarStore over a column file mapped read-only; rows are decoded per page."""
+
+    engine = 'mapped'
+
+    def __init__(self, path, header, start):
+        self.version = header['version']
+        self.path = path
+        self.buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        arrays = {name: np.frombuffer(self.buffer, dtype=np.dtype(dtype), count=count, offset=start + offset)
+                  for name, (dtype, offset, count) in header['arrays'].items()}
+        for (_, attr) in DICT_COLUMNS:
+            setattr(self, attr, columnar.DictColumn.from_codes(header['dictionaries'][attr], arrays[f'{attr}_codes']))
+        for name in ('ids', 'foot_traffic', 'closed', 'order') + FLOAT_COLUMNS:
+            setattr(self, name, arrays[name])
+        self.foot_traffic_null = arrays['foot_traffic_null']
+        self.metric_orders = {name: arrays[f'order_{name}'] for name in SORT_METRICS}
+        self.strings = {name: StrColumn(arrays[f'{name}_offsets'], arrays[f'{name}_blob'], arrays[f'{name}_null'])
+                        for name in STR_COLUMNS}
+
+    def sort_key_at(self, position):
+        i = self.order[position]
+        return self.sort_key(self.strings['name'][i], int(self.ids[i]))
+
+    def position_after(self, key):
+        # binary search through the mapped order instead of a per-process list of sort keys
+        return bisect.bisect_right(range(len(self)), key, key=self.sort_key_at)
+
+    def row(self, i):
+        # the shape of columnar.LOAD_SQL[:ROW_WIDTH], as Python values
+        s = self.strings
+        return (int(self.ids[i]), s['entity_id'][i], s['name'][i], self.chain.value(i), self.category.value(i),
+                self.dma.value(i), self.city.value(i), self.state.value(i),
+                None if self.foot_traffic_null[i] else int(self.foot_traffic[i]),
+                s['date_opened'][i], s['date_closed'][i])
+
+
+def build(conn, db_path, version):
+    """Bring the column file of `db_path` up to `version`; returns True when it was rewritten.
+
+    Serialized by a lock on the column file, so of several workers noticing a new version at
+    once one writes and the rest find the file current when they get the lock.
+    """
+    path = columns_path(db_path)
+    with writer_lock(path):
+        found = read_header(path)
+        if found is not None and found[0]['version'] >= version:
+            return False
+        write(conn, path, version)
+        return True
+
+
+def open_store(conn, version):
+    """Map the column file of the database `conn` reads, rewriting it first if it is older than `version`.
+
+    A file newer than `version` (another worker already saw the next load) is used as is.
+    """
+    db_path = database_file(conn)
+    path = columns_path(db_path)
+    found = read_header(path)
+    if found is None or found[0]['version'] < version:
+        build(conn, db_path, version)
+        found = read_header(path)
+    return MappedStore(path, *found)
@@ -0,0 +1,363 @@
+# Request-level performance instrumentation: Prometheus metrics and the slow-query log.
+# Purpose: shows where a request's time goes. MetricsMiddleware times every request per route
+# template; the DB executors add the time spent in DB work, cached_json the time spent encoding
+# JSON and the cache outcome; traced connections count rows fetched and SQLite VM steps, and log
+# any statement slower than SLOW_QUERY_MS with its parameters and EXPLAIN QUERY PLAN.
+# Interaction: db.connect() opens TracedConnections and db.ConnectionPool makes its read
+# connections count VM steps; executor.DBExecutor runs jobs in the request's context inside
+# db_time(); app.py installs the middleware and serves render() on GET /metrics (text format
+# 0.0.4, no client library needed) and slow_queries on /api/stats/slow-queries.
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Statements running at least this long (milliseconds, execute until the result is consumed) are
+# logged with their plan; 0 logs every statement, a negative value disables the log.
+SLOW_QUERY_MS = float(os.environ.get('FOOT_TRAFFIC_SLOW_QUERY_MS', '500'))
+
+# Most recent slow queries kept for /api/stats/slow-queries.
+SLOW_QUERY_KEEP = 50
+
+# Parameters longer than this (characters of their repr) are truncated in the log.
+MAX_PARAMS_CHARS = 500
+
+# The progress handler runs every PROGRESS_STEPS SQLite VM instructions; VM steps are the
+# closest thing to "rows scanned" SQLite exposes to Python.
+PROGRESS_STEPS = 1000
+
+# Latency histogram buckets in seconds.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+log = logging.getLogger('foot_traffic.slow_query')
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        lines += [f'{name}{_labels(self.labels, labels)} {_number(value)}' for name, labels, value in self.samples()]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        for labels, values in series:
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                le = _labels(self.labels + ('le',), labels + (_number(bound) if bound != '+Inf' else bound,))
+                lines.append(f'{self.name}_bucket{le} {count}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, labels)} {_number(values[-1])}')
+            lines.append(f'{self.name}_count{_labels(self.labels, labels)} {values[-2]}')
+        return lines
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(round(value, 9))
+    return str(value)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, escaped)) + '}'
+
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Request latency, until the last body chunk is sent.',
+                            ('method', 'endpoint', 'status'))
+DB_SECONDS = Histogram('http_request_db_seconds', 'Time per request spent in DB work on the executors.', ('endpoint',))
+SERIALIZE_SECONDS = Histogram('http_request_serialize_seconds', 'Time per request spent encoding JSON responses.',
+                              ('endpoint',))
+ROWS_RETURNED = Counter('db_rows_returned_total', 'Rows fetched from SQLite result sets.', ('endpoint',))
+VM_STEPS = Counter('db_vm_steps_total', 'SQLite VM instructions executed (a proxy for rows scanned).', ('endpoint',))
+CACHE_REQUESTS = Counter('response_cache_requests_total', 'Response cache lookups by outcome (hit, miss, revalidated).',
+                         ('endpoint', 'result'))
+SLOW_QUERIES = Counter('db_slow_queries_total', 'Statements slower than the slow-query threshold.', ('endpoint',))
+
+METRICS = (REQUEST_SECONDS, DB_SECONDS, SERIALIZE_SECONDS, ROWS_RETURNED, VM_STEPS, CACHE_REQUESTS, SLOW_QUERIES)
+
+
+class RequestStats:
+    """What one request spent; shared with the executor threads running its DB work."""
+
+    __slots__ = ('scope', 'db_seconds', 'serialize_seconds', 'rows', 'vm_steps')
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.rows = 0
+        self.vm_steps = 0
+
+    @property
+    def endpoint(self):
+        # FastAPI stores the matched route in the scope; the template keeps label cardinality low
+        route = self.scope.get('route')
+        return getattr(route, 'path', None) or 'unmatched'
+
+
+_current = ContextVar('request_stats', default=None)
+
+
+def current():
+    return _current.get()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the request metrics for every HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        stats = RequestStats(scope)
+        token = _current.set(stats)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            endpoint = stats.endpoint
+            REQUEST_SECONDS.observe((scope['method'], endpoint, str(status)), elapsed)
+            if stats.db_seconds:
+                DB_SECONDS.observe((endpoint,), stats.db_seconds)
+            if stats.serialize_seconds:
+                SERIALIZE_SECONDS.observe((endpoint,), stats.serialize_seconds)
+            if stats.rows:
+                ROWS_RETURNED.inc((endpoint,), stats.rows)
+            if stats.vm_steps:
+                VM_STEPS.inc((endpoint,), stats.vm_steps)
+
+
+@contextmanager
+def db_time():
+    """Add the enclosed DB work to the current request, minus any JSON encoding done inside it."""
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    serialized = stats.serialize_seconds
+    try:
+        yield
+    finally:
+        stats.db_seconds += time.perf_counter() - started - (stats.serialize_seconds - serialized)
+
+
+@contextmanager
+def serialize_time():
+    stats = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats.serialize_seconds += time.perf_counter() - started
+
+
+def record_cache(result):
+    stats = _current.get()
+    CACHE_REQUESTS.inc((stats.endpoint if stats else 'unmatched', result))
+
+
+def _progress():
+    stats = _current.get()
+    if stats is not None:
+        stats.vm_steps += PROGRESS_STEPS
+    return 0
+
+
+slow_queries = deque(maxlen=SLOW_QUERY_KEEP)
+
+
+def _explain(conn, sql, params):
+    if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    try:
+        # plain Connection.execute: explaining must not be traced itself
+        rows = sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    except sqlite3.Error as e:
+        return [f'unavailable: {e}']
+    return [row[3] for row in rows]
+
+
+def _slow_query(conn, sql, params, seconds):
+    stats = _current.get()
+    endpoint = stats.endpoint if stats else None
+    params_repr = repr(params)
+    if len(params_repr) > MAX_PARAMS_CHARS:
+        params_repr = params_repr[:MAX_PARAMS_CHARS] + '...'
+    entry = {
+        'at': time.time(),
+        'ms': round(seconds * 1000, 3),
+        'endpoint': endpoint,
+        'sql': ' '.join(sql.split()),
+        'params': params_repr,
+        'plan': _explain(conn, sql, params),
+    }
+    slow_queries.append(entry)
+    SLOW_QUERIES.inc((endpoint or 'none',))
+    log.warning('slow query %s', json.dumps(entry, ensure_ascii=False))
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that counts fetched rows and times each statement for the slow-query log.
+
+    A statement's time runs from execute() until its result is exhausted, the cursor runs its
+    next statement or is released, or the executor job ends (TracedConnection.finish_statements).
+    """
+
+    _sql = None
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+    def _finish(self):
+        sql = self._sql
+        if sql is None:
+            return
+        self._sql = None
+        self.connection._active.discard(self)
+        elapsed = time.perf_counter() - self._started
+        if 0 <= SLOW_QUERY_MS <= elapsed * 1000:
+            _slow_query(self.connection, sql, self._params, elapsed)
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        self._sql, self._params, self._started = sql, parameters, time.perf_counter()
+        self.connection._active.add(self)
+        super().execute(sql, parameters)
+        if self.description is None:
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        return super().executemany(sql, seq_of_parameters)
+
+    def _fetched(self, rows):
+        stats = _current.get()
+        if stats is not None:
+            stats.rows += rows
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is None:
+            self._finish()
+        else:
+            self._fetched(1)
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = super().fetchmany(size)
+        self._fetched(len(rows))
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._fetched(len(rows))
+        self._finish()
+        return rows
+
+
+class TracedConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors are TracedCursors (and which counts VM steps on request)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._active = weakref.WeakSet()  # cursors with a statement still being timed
+
+    def count_vm_steps(self):
+        """Count this connection's VM steps towards the current request.
+
+        Only for connections serving requests: the handler is a Python call every
+        PROGRESS_STEPS instructions, which bulk writers would pay for nothing.
+        """
+        self.set_progress_handler(_progress, PROGRESS_STEPS)
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def finish_statements(self):
+        """Close the timing of statements whose results were not consumed to the end."""
+        for cur in list(self._active):
+            cur._finish()
+
+
+def render(gauges=()):
+    """Prometheus text exposition of every metric plus `gauges`: (name, help, {labels: value})."""
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    for name, help, values in gauges:
+        lines += [f'# HELP {name} {help}', f'# TYPE {name} gauge']
+        for labels, value in values.items():
+            lines.append(f'{name}{_labels(tuple(k for k, _ in labels), tuple(v for _, v in labels))} {_number(value)}')
+    return '\n'.join(lines) + '\n'
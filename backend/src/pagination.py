@@ -0,0 +1,150 @@
+# Venue list pages: the row shape of /api/venues and its keyset cursor.
+# Purpose: one definition of the list columns, item JSON and cursor seek, shared by /api/venues
+# and the page output of POST /api/batch.
+# Interaction: app.list_venues and batch.run_batch call fetch_page() / finish_page(); the
+# columnar engine returns rows in the same shape (columnar.ROW_WIDTH).
+# Lists are ordered by name unless `sort` names a metric (sort=(metric, 'asc' | 'desc')): then they
+# are ordered by (metric, id), walking idx_venues_<metric>_id, and rows carry the metric value as
+# an extra last column for the cursor. Venues without a value for the metric are not listed.
+# Pages come in two shapes: 'objects' (items: one object per venue) and 'columns' (columns: the
+# field names once, rows: one array per venue), which skips building a dict per row and is
+# roughly half the bytes at large page sizes.
+
+import base64
+import json
+
+from fastapi import HTTPException
+
+from .aggregate import METRIC_COLUMNS
+
+ITEM_COLUMNS = "id, entity_id, name, chain_name, sub_category, dma, city, state_name, foot_traffic, date_opened, date_closed"
+
+# Response field names for ITEM_COLUMNS, in the same order.
+ITEM_FIELDS = ('id', 'entity_id', 'name', 'chain_name', 'category', 'dma', 'city', 'state', 'foot_traffic',
+               'date_opened', 'date_closed')
+FOOT_TRAFFIC = ITEM_FIELDS.index('foot_traffic')
+
+SHAPES = ('objects', 'columns')
+SHAPE_PATTERN = '^(objects|columns)$'
+
+# sort param: 'name' (the default list order) or a metric column.
+SORT_METRICS = METRIC_COLUMNS
+SORT_PATTERN = '^(' + '|'.join(('name',) + SORT_METRICS) + ')$'
+ORDER_PATTERN = '^(asc|desc)$'
+
+
+def parse_sort(sort, order=None):
+    """None for the name order, else (metric, order); metrics default to descending."""
+    if sort == 'name':
+        if order == 'desc':
+            raise HTTPException(status_code=400, detail='order=desc needs a metric sort')
+        return None
+    return sort, order or 'desc'
+
+
+def sort_where(where_sql, sort):
+    """where_sql limited to venues that have the sort metric (the rows a sorted list contains)."""
+    if sort is None:
+        return where_sql
+    return where_sql + (" AND " if where_sql else " WHERE ") + f"{sort[0]} IS NOT NULL"
+
+
+# Encode / decode the opaque keyset cursor used by /api/venues.
+# The cursor carries the (name, id) of the last row of a page (or (metric value, id) for a
+# sorted list) so the next page can seek directly in the index instead of skipping `offset` rows.
+def encode_cursor(name, venue_id):
+    raw = json.dumps([name, venue_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, sort=None):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        name, venue_id = json.loads(raw)
+        if sort is None:
+            valid = name is None or isinstance(name, str)
+        else:
+            valid = isinstance(name, (int, float)) and not isinstance(name, bool)
+        if not isinstance(venue_id, int) or not valid:
+            raise ValueError
+        return name, venue_id
+    except Exception:
+        raise HTTPException(status_code=400, detail='invalid cursor')
+
+
+# Rows strictly after (name, id) in ORDER BY name COLLATE NOCASE, id. Written as a range on name
+# plus a tie-break so SQLite can SEARCH the index (a row-value comparison would SCAN it).
+# NULL names sort first, so a NULL cursor continues within the NULLs and then every named row.
+def keyset_clause(name, venue_id):
+    if name is None:
+        return "((name IS NULL AND id > ?) OR name IS NOT NULL)", [venue_id]
+    return "(name >= ? COLLATE NOCASE AND (name > ? COLLATE NOCASE OR id > ?))", [name, name, venue_id]
+
+
+# Rows strictly after (value, id) in ORDER BY metric <order>, id <order>, as a range on the
+# metric plus a tie-break for the same reason as keyset_clause().
+def metric_keyset_clause(metric, order, value, venue_id):
+    op = '<' if order == 'desc' else '>'
+    return f"({metric} {op}= ? AND ({metric} {op} ? OR id {op} ?))", [value, value, venue_id]
+
+
+def fetch_page(cur, where_sql, params, per_page, offset=0, cursor=None, sort=None, index=None):
+    """Return up to per_page + 1 rows in list order; the extra row signals a next page.
+
+    With a `sort`, where_sql must come from sort_where() and each row ends with the metric value.
+    `index` names an index SQLite must read the rows through (INDEXED BY).
+    """
+    page_sql = "FROM venues" + (f" INDEXED BY {index}" if index else "") + where_sql
+    page_params = list(params)
+    if cursor:
+        clause, clause_params = keyset_clause(*cursor) if sort is None else metric_keyset_clause(*sort, *cursor)
+        page_sql += (" AND " if where_sql else " WHERE ") + clause
+        page_params += clause_params
+    if sort is None:
+        select_sql = f"SELECT {ITEM_COLUMNS} {page_sql} ORDER BY name COLLATE NOCASE ASC, id ASC LIMIT ? OFFSET ?;"
+    else:
+        metric, order = sort
+        select_sql = (f"SELECT {ITEM_COLUMNS}, {metric} {page_sql} "
+                      f"ORDER BY {metric} {order.upper()}, id {order.upper()} LIMIT ? OFFSET ?;")
+    cur.execute(select_sql, page_params + [per_page + 1, offset])
+    return cur.fetchall()
+
+
+def item(r):
+    return {
+        "id": r[0],
+        "entity_id": r[1],
+        "name": r[2],
+        "chain_name": r[3],
+        "category": r[4],
+        "dma": r[5],
+        "city": r[6],
+        "state": r[7],
+        "foot_traffic": r[8] or 0,
+        "date_opened": r[9],
+        "date_closed": r[10],
+    }
+
+
+def row(r):
+    # the tuple as returned, with the same NULL foot_traffic -> 0 as item()
+    if r[FOOT_TRAFFIC] is None:
+        return r[:FOOT_TRAFFIC] + (0,) + r[FOOT_TRAFFIC + 1:]
+    return r
+
+
+def finish_page(rows, per_page, shape='objects', sort=None):
+    """Turn fetch_page() rows into (body, next_cursor).
+
+    body is {"items": [...]} for the 'objects' shape or {"columns": [...], "rows": [[...]]}
+    for 'columns'; it is merged into the page response.
+    """
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1][2] if sort is None else rows[-1][-1], rows[-1][0])
+    if sort is not None:
+        rows = [r[:-1] for r in rows]
+    if shape == 'columns':
+        return {"columns": ITEM_FIELDS, "rows": [row(r) for r in rows]}, next_cursor
+    return {"items": [item(r) for r in rows]}, next_cursor
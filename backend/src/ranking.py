@@ -0,0 +1,116 @@
+# Metric-ordered venue lists (GET /api/venues?sort=<metric>) and top-K venues with their standing
+# within their chain (GET /api/venues/top).
+# Purpose: a top-K should read K rows, not sort every match. The column stores keep a sorted
+# order per metric; in SQLite fetch_sorted() chooses between walking idx_venues_<metric>_id
+# (checking each venue against the filter until enough match) and letting the planner use a
+# selective filter index and sort its few matches. The choice needs the filter's selectivity,
+# which the planner can't know for skewed values (one chain can hold a third of all venues), so
+# it is estimated from the approximate-summary sample.
+# A venue's rank and percentile within its chain need the chain's whole value distribution,
+# which no filtered query has: ChainRanks keeps, per chain, the sorted values of one metric in
+# memory and answers both with a binary search.
+# Interaction: app.list_venues / app.top_venues call fetch_sorted() on the SQLite engine and
+# get_chain_ranks() for the current data version; like the typeahead index, chain ranks are
+# rebuilt from SQLite when the data changes, separately per metric and only when asked for.
+
+import array
+import bisect
+import threading
+
+from .approx import estimate_matches
+from .filters import VenueFilter, compile_filter, compile_scan_filter
+from .pagination import fetch_page, item, sort_where
+from .rollups import rollup_summary
+
+# Largest k for /api/venues/top.
+TOP_MAX = 500
+
+
+def walk_index(matches, venues, rows):
+    """True when reading `rows` of `matches` (out of `venues`) in metric order is cheaper
+    through the metric index.
+
+    Walking it visits about rows * venues / matches venues; the alternative fetches and sorts
+    all the matches.
+    """
+    return matches > 0 and rows * venues < matches * matches
+
+
+def fetch_sorted(cur, f, sort, per_page, offset=0, cursor=None):
+    """fetch_page() rows of the venues matching VenueFilter `f` in `sort` order, planned as above.
+
+    Without the metric index (dropped during a deferred load) the filter plan is used.
+    """
+    conn = cur.connection
+    index = None
+    if f != VenueFilter.create():
+        venues = rollup_summary(conn, '', [])['venues']
+        if walk_index(estimate_matches(conn, f), venues, offset + per_page + 1):
+            index = f'idx_venues_{sort[0]}_id'
+            # deferred bulk loads (the startup seed among them) drop the index until they finish
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?;", (index,)).fetchone():
+                index = None
+    # the FTS / R*Tree subqueries of compile_filter would collect every match up front
+    where_sql, params = (compile_scan_filter if index else compile_filter)(f)
+    return fetch_page(cur, sort_where(where_sql, sort), params, per_page, offset, cursor, sort, index)
+
+
+class ChainRanks:
+    """Sorted values of one metric per chain, for ranks within a chain."""
+
+    def __init__(self, rows, metric, version):
+        self.metric = metric
+        self.version = version
+        self.values = {}
+        # rows come ordered by value, so each chain's array is sorted as it is appended to
+        for chain, value in rows:
+            values = self.values.get(chain)
+            if values is None:
+                values = self.values[chain] = array.array('d')
+            values.append(value)
+
+    @classmethod
+    def load(cls, conn, metric, version):
+        rows = conn.execute(
+            f"SELECT chain_name, {metric} FROM venues WHERE chain_name IS NOT NULL AND {metric} IS NOT NULL "
+            f"ORDER BY {metric};")
+        return cls(rows, metric, version)
+
+    def standing(self, chain, value):
+        """(rank, size, percentile) of `value` among the chain's venues.
+
+        rank 1 is the highest value (ties share the best rank); percentile is the share of the
+        chain's venues with a value at most `value`, in percent (100 for the chain's best).
+        """
+        values = self.values.get(chain)
+        if values is None or value is None:
+            return None, None, None
+        at_most = bisect.bisect_right(values, value)
+        return len(values) - at_most + 1, len(values), round(100 * at_most / len(values), 1)
+
+
+def top_items(rows, ranks):
+    """Response items for fetch_page(..., sort=...) rows: the list item plus the metric value,
+    the position in the result and the venue's standing within its chain."""
+    items = []
+    for position, r in enumerate(rows, 1):
+        chain_rank, chain_size, chain_percentile = ranks.standing(r[3], r[-1])
+        items.append({**item(r), 'value': r[-1], 'rank': position, 'chain_rank': chain_rank,
+                      'chain_size': chain_size, 'chain_percentile': chain_percentile})
+    return items
+
+
+_ranks = {}
+_ranks_lock = threading.Lock()
+
+
+def get_chain_ranks(conn, metric, version):
+    """Return the ChainRanks of `metric` for `version`, rebuilding them when the data changed."""
+    ranks = _ranks.get(metric)
+    if ranks is None or ranks.version != version:
+        with _ranks_lock:
+            ranks = _ranks.get(metric)
+            if ranks is None or ranks.version != version:
+                ranks = ChainRanks.load(conn, metric, version)
+                _ranks[metric] = ranks
+    return ranks
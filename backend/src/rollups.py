@@ -0,0 +1,117 @@
+# Materialized summary rollups over venues.
+# Purpose: venues_summary mostly re-adds the same numbers; venue_rollups keeps count and sums per
+# chain x category x dma x state x open/closed, maintained incrementally by triggers, so exact-match
+# summaries read a handful of rollup rows instead of every matching venue.
+# Interaction: db.ensure_schema() installs the table and triggers (so init_db and load_csv.py
+# maintain it on every insert/update/delete); app.venues_summary calls rollup_where() with the
+# request's filters.VenueFilter and, when it qualifies, rollup_summary().
+
+# NULL dimensions are stored as '' so rows with missing values still merge on the primary key.
+ROLLUP_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS venue_rollups (
+    chain_name TEXT NOT NULL,
+    sub_category TEXT NOT NULL,
+    dma TEXT NOT NULL,
+    state_name TEXT NOT NULL,
+    is_closed INTEGER NOT NULL,
+    venues INTEGER NOT NULL,
+    foot_traffic INTEGER NOT NULL,
+    sales REAL NOT NULL,
+    area_sqft REAL NOT NULL,
+    PRIMARY KEY (chain_name, sub_category, dma, state_name, is_closed)
+) WITHOUT ROWID;'''
+
+_KEY = '''COALESCE({r}.chain_name, ''), COALESCE({r}.sub_category, ''), COALESCE({r}.dma, ''),
+        COALESCE({r}.state_name, ''), ({r}.date_closed IS NOT NULL AND {r}.date_closed <> '')'''
+
+_MATCH = '''chain_name = COALESCE({r}.chain_name, '') AND sub_category = COALESCE({r}.sub_category, '')
+        AND dma = COALESCE({r}.dma, '') AND state_name = COALESCE({r}.state_name, '')
+        AND is_closed = ({r}.date_closed IS NOT NULL AND {r}.date_closed <> '')'''
+
+_ADD = f'''INSERT INTO venue_rollups (chain_name, sub_category, dma, state_name, is_closed, venues, foot_traffic, sales, area_sqft)
+        VALUES ({_KEY.format(r='new')}, 1, COALESCE(new.foot_traffic, 0), COALESCE(new.sales, 0), COALESCE(new.area_sqft, 0))
+        ON CONFLICT (chain_name, sub_category, dma, state_name, is_closed) DO UPDATE SET venues = venues + 1, foot_traffic = foot_traffic + excluded.foot_traffic,
+        sales = sales + excluded.sales, area_sqft = area_sqft + excluded.area_sqft;'''
+
+_REMOVE = f'''UPDATE venue_rollups SET venues = venues - 1, foot_traffic = foot_traffic - COALESCE(old.foot_traffic, 0),
+        sales = sales - COALESCE(old.sales, 0), area_sqft = area_sqft - COALESCE(old.area_sqft, 0)
+        WHERE {_MATCH.format(r='old')};
+        DELETE FROM venue_rollups WHERE venues <= 0 AND {_MATCH.format(r='old')};'''
+
+ROLLUP_TRIGGERS_SQL = (
+    f'''CREATE TRIGGER IF NOT EXISTS venue_rollups_ai AFTER INSERT ON venues BEGIN
+        {_ADD}
+    END;''',
+    f'''CREATE TRIGGER IF NOT EXISTS venue_rollups_ad AFTER DELETE ON venues BEGIN
+        {_REMOVE}
+    END;''',
+    f'''CREATE TRIGGER IF NOT EXISTS venue_rollups_au
+    AFTER UPDATE OF chain_name, sub_category, dma, state_name, date_closed, foot_traffic, sales, area_sqft ON venues BEGIN
+        {_REMOVE}
+        {_ADD}
+    END;''',
+)
+
+# Full rebuild, used when the table is first created on a populated DB.
+ROLLUP_REBUILD_SQL = f'''INSERT INTO venue_rollups
+    SELECT {_KEY.format(r='venues')}, COUNT(*), COALESCE(SUM(foot_traffic), 0),
+        COALESCE(SUM(sales), 0), COALESCE(SUM(area_sqft), 0)
+    FROM venues GROUP BY 1, 2, 3, 4, 5;'''
+
+# Filter param -> rollup dimension compared case-insensitively like the *_key columns.
+ROLLUP_DIMENSIONS = {
+    'chain': 'chain_name',
+    'category': 'sub_category',
+    'dma': 'dma',
+}
+
+
+def ensure_rollups(conn):
+    cur = conn.cursor()
+    exists = cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'venue_rollups';").fetchone()
+    cur.execute(ROLLUP_TABLE_SQL)
+    for sql in ROLLUP_TRIGGERS_SQL:
+        cur.execute(sql)
+    if not exists:
+        cur.execute(ROLLUP_REBUILD_SQL)
+
+
+def rebuild_rollups(conn):
+    conn.execute('DELETE FROM venue_rollups;')
+    conn.execute(ROLLUP_REBUILD_SQL)
+
+
+def rollup_where(f):
+    """Return (where_sql, params) over venue_rollups for a VenueFilter, or None if the rollups can't answer.
+
+    Only exact-match filters on rollup dimensions qualify: city and location aren't
+    dimensions, and prefix / contains values can't be resolved without the base rows.
+    """
+    if f.city is not None or f.bbox or f.radius:
+        return None
+    where = []
+    params = []
+    for field, values in f.multi():
+        if not values:
+            continue
+        if f.match != 'exact':
+            return None
+        column = ROLLUP_DIMENSIONS[field]
+        where.append(f"lower({column}) IN ({','.join('?' for _ in values)})")
+        params.extend(values)
+    if f.state is not None:
+        where.append("state_name = ?")
+        params.append(f.state)
+    if f.open_status == 'open':
+        where.append("is_closed = 0")
+    elif f.open_status == 'closed':
+        where.append("is_closed = 1")
+    if not where:
+        return '', params
+    return " WHERE " + " AND ".join(where), params
+
+
+def rollup_summary(conn, where_sql, params):
+    row = conn.execute(
+        f"SELECT COALESCE(SUM(venues), 0), COALESCE(SUM(foot_traffic), 0) FROM venue_rollups{where_sql};", params
+    ).fetchone()
+    return {"venues": row[0], "total_foot_traffic": row[1]}
@@ -0,0 +1,35 @@
+# JSON encoding for the API's hand-built responses.
+# Purpose: responses that are cached or streamed are encoded once to bytes here instead of going
+# through FastAPI's jsonable_encoder. orjson (optional) encodes rows of tuples several times
+# faster than the json module; without it the stdlib encoder produces the same JSON.
+# Interaction: app.cached_json encodes every cached response with dumps(); export.py encodes
+# NDJSON lines with dumps_line().
+
+import json
+
+try:
+    import orjson
+except ImportError:  # optional; the json module is used without it
+    orjson = None
+
+if orjson is not None:
+    # numpy scalars come from the columnar engine; non-str keys are rare but shouldn't fail
+    _OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj):
+        """Encode obj as compact UTF-8 JSON bytes."""
+        return orjson.dumps(obj, option=_OPTIONS)
+
+    def dumps_line(obj):
+        """Encode obj as one NDJSON line (bytes, newline-terminated)."""
+        return orjson.dumps(obj, option=_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(obj):
+        """Encode obj as compact UTF-8 JSON bytes."""
+        return _encoder.encode(obj).encode('utf-8')
+
+    def dumps_line(obj):
+        """Encode obj as one NDJSON line (bytes, newline-terminated)."""
+        return (_encoder.encode(obj) + '\n').encode('utf-8')
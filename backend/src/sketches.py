@@ -0,0 +1,188 @@
+# Mergeable summaries of large value sets: HyperLogLog (distinct counts) and t-digest (quantiles).
+# Purpose: both fit in a few KB whatever the number of rows, merge by combining their parts, and
+# answer with a known error, so approximate summaries can be precomputed per stratum at ingest and
+# combined per request instead of scanning the matching rows.
+# Interaction: src/approx.py builds, stores (to_bytes / from_bytes) and merges them.
+
+import array
+import hashlib
+import math
+
+# HyperLogLog precision: 2**12 registers (4 KB), relative standard error 1.04 / 64 = 1.6%.
+HLL_P = 12
+
+# t-digest compression (delta): about `delta` centroids; quantile error is smallest at the tails.
+TDIGEST_COMPRESSION = 100
+
+
+class HyperLogLog:
+    """Distinct-count sketch; add() values, merge() others, estimate() the number of distinct values."""
+
+    def __init__(self, registers=None, p=HLL_P):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'little')
+        index = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    @classmethod
+    def union(cls, sketches):
+        """One sketch of all `sketches` (merged in a single pass over the registers)."""
+        sketches = list(sketches)
+        if not sketches:
+            return cls()
+        if len(sketches) == 1:
+            return sketches[0]
+        return cls(bytearray(map(max, *(s.registers for s in sketches))), sketches[0].p)
+
+    def estimate(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * self.m and zeros:
+            return self.m * math.log(self.m / zeros)  # linear counting, near exact for small sets
+        return raw
+
+    def error(self, z):
+        """Half-width of the `z`-sigma interval around estimate()."""
+        return z * 1.04 / math.sqrt(self.m) * self.estimate()
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(data, p=int(math.log2(len(data))))
+
+
+def _k(q, delta):
+    # k1 scale function: centroids are small near q=0 and q=1, so tail quantiles stay accurate
+    return delta / (2 * math.pi) * math.asin(2 * q - 1)
+
+
+def _k_inverse(k, delta):
+    return (math.sin(2 * math.pi * k / delta) + 1) / 2
+
+
+class TDigest:
+    """Merging t-digest over weighted values: a sorted list of (mean, weight) centroids plus min / max."""
+
+    def __init__(self, centroids=(), low=None, high=None, compression=TDIGEST_COMPRESSION):
+        self.centroids = list(centroids)
+        self.low = low
+        self.high = high
+        self.compression = compression
+
+    @property
+    def total(self):
+        return sum(w for _, w in self.centroids)
+
+    @classmethod
+    def from_sorted(cls, items, compression=TDIGEST_COMPRESSION):
+        """Digest of (value, weight) pairs sorted by value (e.g. GROUP BY value ORDER BY value)."""
+        items = [(v, w) for v, w in items if v is not None and w > 0]
+        if not items:
+            return cls(compression=compression)
+        return cls(cls._compress(items, compression), items[0][0], items[-1][0], compression)
+
+    @staticmethod
+    def _compress(items, delta):
+        total = sum(w for _, w in items)
+        out = []
+        done = 0.0
+        mean, weight = items[0]
+        limit = _k_inverse(_k(0, delta) + 1, delta) * total
+        for value, w in items[1:]:
+            if done + weight + w <= limit:
+                weight += w
+                mean += (value - mean) * w / weight
+            else:
+                out.append((mean, weight))
+                done += weight
+                limit = _k_inverse(min(_k(done / total, delta) + 1, delta / 4), delta) * total
+                mean, weight = value, w
+        out.append((mean, weight))
+        return out
+
+    def merge(self, other):
+        if not other.centroids:
+            return self
+        items = sorted(self.centroids + other.centroids)
+        self.centroids = self._compress(items, self.compression)
+        self.low = other.low if self.low is None else min(self.low, other.low)
+        self.high = other.high if self.high is None else max(self.high, other.high)
+        return self
+
+    @classmethod
+    def union(cls, digests, compression=TDIGEST_COMPRESSION):
+        """One digest of all `digests`, compressed once rather than pairwise."""
+        digests = [d for d in digests if d.centroids]
+        if not digests:
+            return cls(compression=compression)
+        items = sorted(c for d in digests for c in d.centroids)
+        return cls(cls._compress(items, compression), min(d.low for d in digests),
+                   max(d.high for d in digests), compression)
+
+    def quantile(self, q):
+        """Estimated value at quantile q (0..1), interpolating between centroid centers."""
+        if not self.centroids:
+            return None
+        total = self.total
+        target = q * total
+        seen = 0.0
+        prev_center, prev_mean = 0.0, self.low
+        for mean, weight in self.centroids:
+            center = seen + weight / 2
+            if target < center:
+                if center == prev_center:
+                    return mean
+                return prev_mean + (mean - prev_mean) * (target - prev_center) / (center - prev_center)
+            seen += weight
+            prev_center, prev_mean = center, mean
+        if total == prev_center:
+            return self.high
+        return prev_mean + (self.high - prev_mean) * (target - prev_center) / (total - prev_center)
+
+    def rank_error(self, q):
+        """Half-width, as a fraction of the total weight, of the ranks quantile(q) can have.
+
+        The estimate lies between the means of the two centroids around rank q * total, so its true
+        rank lies between the first and last rank those centroids cover. This is a bound for a digest
+        of sorted values and an estimate after union(), whose input centroids overlap.
+        """
+        if not self.centroids:
+            return None
+        total = self.total
+        target = q * total
+        seen = 0.0
+        prev_weight = 0.0
+        for _, weight in self.centroids:
+            if target < seen + weight / 2:
+                break
+            seen += weight
+            prev_weight = weight
+        else:
+            weight = 0.0
+        return max(target - (seen - prev_weight), seen + weight - target) / total
+
+    def to_bytes(self):
+        values = [self.compression, self.low, self.high]
+        for mean, weight in self.centroids:
+            values.extend((mean, weight))
+        return array.array('d', values).tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        values = array.array('d', data)
+        pairs = list(zip(values[3::2], values[4::2]))
+        return cls(pairs, values[1], values[2], values[0])
@@ -0,0 +1,147 @@
+# Snapshot serving mode: refresh the data by publishing a new database file, never by writing to
+# the file being served.
+# Purpose: a full reload into the live file (load_csv.py --clear) leaves readers looking at a
+# half-empty table and makes them contend with the writer. Instead, build() loads into a new file
+# next to it (starting empty, or from an online copy of the current data made with the SQLite
+# backup API), compacts it with VACUUM INTO and publishes it by atomically replacing the
+# '<db>.current' pointer file. Each API worker's pool notices the new pointer within POLL_SECONDS
+# and swaps to the new file; queries already running finish on the old one, whose connections
+# are closed as they are released. The data version only goes up, so caches invalidate as usual.
+# Interaction: enabled in the API with FOOT_TRAFFIC_SNAPSHOTS=1 (app.py makes db.pool follow
+# current_path()); load_csv.py --snapshot builds and publishes. Builds and publishes take
+# db.writer_lock() on the base path, so two refreshes never interleave.
+
+import datetime
+import os
+import sqlite3
+
+from . import columnar
+from .db import DB_PATH, connect, ensure_schema, get_data_version, writer_lock
+
+ENABLED = os.environ.get('FOOT_TRAFFIC_SNAPSHOTS', '0') == '1'
+
+# How often a worker re-reads the pointer file (seconds).
+POLL_SECONDS = float(os.environ.get('FOOT_TRAFFIC_SNAPSHOT_POLL', '1'))
+
+# Snapshots kept on disk besides the current one; the previous one is still draining briefly.
+KEEP = 1
+
+
+def pointer_path(db_path=None):
+    return (db_path or DB_PATH) + '.current'
+
+
+def snapshot_dir(db_path=None):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path or DB_PATH)), 'snapshots')
+
+
+def current_path(db_path=None):
+    """The published snapshot of `db_path`, or `db_path` itself until one is published."""
+    db_path = db_path or DB_PATH
+    try:
+        with open(pointer_path(db_path), encoding='utf-8') as fh:
+            name = fh.read().strip()
+    except FileNotFoundError:
+        return db_path
+    # stored relative to the snapshot directory, so the data directory can be moved as a whole
+    return os.path.join(snapshot_dir(db_path), name) if name else db_path
+
+
+def publish(db_path, path):
+    """Make `path` (a file in snapshot_dir) the current snapshot with one atomic rename."""
+    pointer = pointer_path(db_path)
+    tmp = f'{pointer}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        fh.write(os.path.basename(path))
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, pointer)
+
+
+def _remove(path):
+    for suffix in ('', '-wal', '-shm', '-journal', '.lock', '.columns', '.columns.lock'):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+        except OSError:  # still open somewhere (Windows); the next prune retries
+            pass
+
+
+def prune(db_path=None, keep=KEEP):
+    """Delete all but the current snapshot and the `keep` newest others; returns the removed paths."""
+    directory = snapshot_dir(db_path)
+    current = os.path.basename(current_path(db_path))
+    try:
+        names = sorted((n for n in os.listdir(directory) if n.endswith('.db')), reverse=True)
+    except FileNotFoundError:
+        return []
+    removed = [os.path.join(directory, n) for n in [n for n in names if n != current][keep:]]
+    for path in removed:
+        _remove(path)
+    return removed
+
+
+def build(load, db_path=None, base='empty', compact=True):
+    """Build a new snapshot with load(conn), publish it and return its path.
+
+    `base` is 'empty' (a full reload) or 'copy' (start from the current data, e.g. for a delta
+    refresh); the copy is taken with the backup API, which doesn't block readers. If load()
+    raises, nothing is published and the partial file is removed.
+    """
+    db_path = db_path or DB_PATH
+    directory = snapshot_dir(db_path)
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    # names sort by build time (UTC), which is what prune() relies on
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%d-%H%M%S-%f')
+    final = os.path.join(directory, f'{stem}-{stamp}.db')
+    building = final + '.building'
+    with writer_lock(db_path):
+        source = current_path(db_path)
+        src = connect(source) if os.path.exists(source) else None
+        try:
+            version = 0
+            if src is not None:
+                try:
+                    version = get_data_version(src)
+                except sqlite3.OperationalError:  # no meta table yet
+                    pass
+            conn = connect(building)
+            try:
+                if base == 'copy' and src is not None:
+                    src.backup(conn)
+                    conn.execute('PRAGMA journal_mode=WAL;')
+                ensure_schema(conn)
+                load(conn)
+                # strictly newer than what is being served, so every worker's caches invalidate
+                conn.execute("UPDATE meta SET value = MAX(value, ?) WHERE key = 'data_version';", (version + 1,))
+                conn.commit()
+                conn.execute('PRAGMA optimize;')
+                if compact:
+                    conn.execute('VACUUM INTO ?;', (final,))
+            finally:
+                conn.close()
+        except BaseException:
+            _remove(building)
+            _remove(final)
+            raise
+        finally:
+            if src is not None:
+                src.close()
+        if compact:
+            _remove(building)
+        else:
+            os.replace(building, final)
+        # readers open it in WAL mode; switch now rather than on the first read connection
+        conn = connect(final)
+        try:
+            if columnar.ENGINE == 'mapped' and columnar.enabled():
+                # workers map the new snapshot's column file as soon as they swap to it
+                from . import mapped
+                mapped.build(conn, final, get_data_version(conn))
+        finally:
+            conn.close()
+        publish(db_path, final)
+    prune(db_path)
+    return final
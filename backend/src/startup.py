@@ -0,0 +1,171 @@
+# Application startup that doesn't block on schema creation or CSV seeding.
+# Purpose: a worker accepts connections as soon as its modules are imported. Migrations, seeding
+# an empty DB from the CSV and cache warmup run in a background thread; migrations and seeding
+# happen once, in whichever worker takes db.writer_lock() first, while the other workers wait on
+# the lock and then find the work done. A seed interrupted by a crash resumes on the next start.
+# Interaction: app.on_startup calls start() and init_db() calls run() synchronously;
+# GET /api/ready serves status(); ReadinessGate answers 503 for data endpoints until the schema
+# exists. Progress of the seeding load is read from ingest_progress, so it is visible to every
+# worker, not just the one loading.
+
+import os
+import sqlite3
+import threading
+import time
+
+from .db import connect, ensure_schema, migrate, writer_lock
+
+# CSV used to seed an empty DB, looked up in backend/ and then in the project root.
+SEED_CSV_NAME = 'Bigbox Stores Metrics.csv'
+SEED_CSV_DIRS = (
+    os.path.dirname(os.path.dirname(__file__)),
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+)
+
+# Paths answered while the schema is still being created; everything else under /api/ gets a 503.
+UNGATED_PATHS = ('/api/ready', '/api/stats/')
+
+
+class StartupState:
+    """Where this worker's startup is: starting -> migrating -> seeding -> warming -> ready (or failed)."""
+
+    def __init__(self):
+        self.phase = 'starting'
+        self.schema_ready = False
+        self.started_at = None
+        self.ready_at = None
+        self.error = None
+
+    @property
+    def ready(self):
+        return self.phase == 'ready'
+
+
+state = StartupState()
+
+
+def find_seed_csv():
+    for d in SEED_CSV_DIRS:
+        path = os.path.join(d, SEED_CSV_NAME)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _meta(conn, key):
+    row = conn.execute('SELECT value FROM meta WHERE key = ?;', (key,)).fetchone()
+    return row[0] if row else 0
+
+
+def _set_meta(conn, key, value):
+    conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?);', (key, value))
+    conn.commit()
+
+
+def seed(path=None, csv_path=None):
+    """Seed venues from the CSV if the DB is empty or a previous seed was interrupted.
+
+    Runs under writer_lock(), so with several workers one loads and the rest block here until it
+    is done. The 'seeding' meta flag is set for the duration of the load; finding it set means
+    the loading process died, and the load resumes from its last committed batch. A deferred
+    bulk load that was interrupted (load_csv.py --defer-indexes) gets its indexes rebuilt.
+    Returns the ingest stats, or None if nothing was loaded.
+    """
+    csv_path = csv_path or find_seed_csv()
+    conn = connect(path)
+    try:
+        with writer_lock(path):
+            # a flag without rows in progress means the loader died after the load had finished
+            interrupted = _meta(conn, 'seeding') and rows_loaded(conn)
+            empty = conn.execute('SELECT 1 FROM venues LIMIT 1;').fetchone() is None
+            if csv_path and (empty or interrupted):
+                from .ingest import ingest_csv  # only the seeding worker pays for importing it
+
+                _set_meta(conn, 'seeding', 1)
+                try:
+                    return ingest_csv(conn, csv_path, resume=True, defer_indexes=True, progress=None)
+                except Exception as e:
+                    # don't fail startup on CSV parse errors; leave what was loaded
+                    print('Warning: failed to seed venues from CSV:', e)
+                finally:
+                    _set_meta(conn, 'seeding', 0)
+            if _meta(conn, 'seeding'):
+                _set_meta(conn, 'seeding', 0)
+            if _meta(conn, 'derived_stale'):
+                ensure_schema(conn)
+    finally:
+        conn.close()
+    return None
+
+
+def run(path=None, warm=None):
+    """Migrate, seed and then call `warm()`, recording each phase in `state`; errors are re-raised."""
+    state.started_at, state.ready_at, state.error = time.time(), None, None
+    try:
+        state.phase = 'migrating'
+        migrate(path)
+        state.schema_ready = True
+        state.phase = 'seeding'
+        seed(path)
+        if warm is not None:
+            state.phase = 'warming'
+            warm()
+    except Exception as e:
+        state.phase = 'failed'
+        state.error = f'{type(e).__name__}: {e}'
+        raise
+    state.phase = 'ready'
+    state.ready_at = time.time()
+
+
+def start(path=None, warm=None):
+    """Run startup in a daemon thread and return it; the caller keeps serving meanwhile."""
+    thread = threading.Thread(target=run, args=(path, warm), name='startup', daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_ready(timeout=None):
+    """Block until startup finished (ready or failed); returns whether it is ready."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while state.phase not in ('ready', 'failed'):
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        time.sleep(0.01)
+    return state.ready
+
+
+def rows_loaded(conn):
+    """Rows committed so far by loads in progress in any process (0 when none is running)."""
+    try:
+        return conn.execute('SELECT COALESCE(SUM(rows_committed), 0) FROM ingest_progress;').fetchone()[0]
+    except sqlite3.OperationalError:  # ingest_progress is created by the first load
+        return 0
+
+
+def status():
+    now = time.time()
+    return {
+        'ready': state.ready,
+        'phase': state.phase,
+        'seconds': round((state.ready_at or now) - state.started_at, 3) if state.started_at else None,
+        'error': state.error,
+    }
+
+
+class ReadinessGate:
+    """ASGI middleware answering 503 for /api/ requests until the schema exists."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (state.schema_ready or scope['type'] != 'http' or not scope['path'].startswith('/api/')
+                or scope['path'].startswith(UNGATED_PATHS)):
+            return await self.app(scope, receive, send)
+        body = b'{"detail":"starting up: database migrations are running"}'
+        await send({'type': 'http.response.start', 'status': 503, 'headers': [
+            (b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+            (b'retry-after', b'1'),
+        ]})
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,154 @@
+# Venue metrics history and date-range queries over it.
+# Purpose: venues holds a single foot_traffic / sales snapshot per store; venue_metrics keeps the
+# history, one row per venue and day. It is a WITHOUT ROWID table clustered on the integer key
+# (venue_id, day), so rows carry no rowid or separate index and one venue's history is a single
+# contiguous B-tree range. timeseries() sums the filtered venues per day in SQL and folds the days
+# into week / month buckets in Python, so a chart gets a few hundred points however many rows match.
+# Interaction: db.ensure_schema() installs the table; ingest.ingest_metrics() (load_csv.py
+# --metrics) fills it; app.venues_timeseries serves timeseries() on /api/venues/timeseries with
+# the request's filters.compile_filter() clause.
+
+import datetime
+
+# day is the number of days since 1970-01-01 (a 2-3 byte varint instead of a date string).
+METRICS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS venue_metrics (
+    venue_id INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    foot_traffic INTEGER,
+    sales REAL,
+    avg_dwell_time_min REAL,
+    PRIMARY KEY (venue_id, day)
+) WITHOUT ROWID;'''
+
+# A venue's history goes with it (venue ids are never reused, see AUTOINCREMENT on venues).
+METRICS_TRIGGERS_SQL = (
+    '''CREATE TRIGGER IF NOT EXISTS venue_metrics_ad AFTER DELETE ON venues BEGIN
+        DELETE FROM venue_metrics WHERE venue_id = old.id;
+    END;''',
+)
+
+# History rows are matched to venues by entity_id; unknown entities insert nothing.
+UPSERT_METRICS_SQL = '''INSERT OR REPLACE INTO venue_metrics (venue_id, day, foot_traffic, sales, avg_dwell_time_min)
+    SELECT id, ?, ?, ?, ? FROM venues WHERE entity_id = ?;'''
+
+INTERVAL_PATTERN = '^(auto|day|week|month)$'
+
+# `auto` picks the finest interval giving at most this many points.
+TARGET_POINTS = 400
+
+# Explicit intervals are refused when the range would need more points than this.
+MAX_POINTS = 5000
+
+# Average bucket width in days, used to estimate point counts.
+INTERVAL_DAYS = {'day': 1, 'week': 7, 'month': 30.44}
+
+_EPOCH = datetime.date(1970, 1, 1).toordinal()
+
+# The daily totals of the filtered venues; `venue_id IN (...)` lets SQLite seek each venue's day
+# range on the primary key instead of scanning the whole history.
+DAILY_SQL = '''SELECT m.day, COUNT(*), COALESCE(SUM(m.foot_traffic), 0), TOTAL(m.sales),
+        TOTAL(m.avg_dwell_time_min), COUNT(m.avg_dwell_time_min)
+    FROM venue_metrics m
+    WHERE m.venue_id IN (SELECT id FROM venues{where}) AND m.day BETWEEN ? AND ?
+    GROUP BY m.day ORDER BY m.day;'''
+
+
+def ensure_timeseries(conn):
+    conn.execute(METRICS_TABLE_SQL)
+    for sql in METRICS_TRIGGERS_SQL:
+        conn.execute(sql)
+
+
+def to_day(value):
+    """Day number of a date, or of a 'YYYY-MM-DD...' string (timestamps are cut to their date)."""
+    if isinstance(value, str):
+        value = datetime.date.fromisoformat(value.strip()[:10])
+    return value.toordinal() - _EPOCH
+
+
+def from_day(day):
+    return datetime.date.fromordinal(day + _EPOCH)
+
+
+def record_range(conn, first, last):
+    """Widen the [first, last] day range of the history kept in meta; call before commit."""
+    conn.execute("INSERT INTO meta (key, value) VALUES ('metrics_first_day', ?) "
+                 "ON CONFLICT (key) DO UPDATE SET value = MIN(value, excluded.value);", (first,))
+    conn.execute("INSERT INTO meta (key, value) VALUES ('metrics_last_day', ?) "
+                 "ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value);", (last,))
+
+
+def forget_range(conn):
+    """Drop the recorded range, e.g. after deleting every venue (and with it every history row)."""
+    conn.execute("DELETE FROM meta WHERE key IN ('metrics_first_day', 'metrics_last_day');")
+
+
+def data_range(conn):
+    """(first, last) day with history, or None when venue_metrics is empty.
+
+    Kept in meta because MIN(day) can't use the (venue_id, day) key.
+    """
+    rows = dict(conn.execute(
+        "SELECT key, value FROM meta WHERE key IN ('metrics_first_day', 'metrics_last_day');").fetchall())
+    if len(rows) < 2:
+        return None
+    return rows['metrics_first_day'], rows['metrics_last_day']
+
+
+def bucket(day, interval):
+    """First day of the day / week (Monday) / month bucket holding `day`."""
+    if interval == 'week':
+        return day - (day + 3) % 7  # 1970-01-01 was a Thursday
+    if interval == 'month':
+        return to_day(from_day(day).replace(day=1))
+    return day
+
+
+def pick_interval(first, last):
+    for interval in ('day', 'week'):
+        if (last - first) / INTERVAL_DAYS[interval] + 1 <= TARGET_POINTS:
+            return interval
+    return 'month'
+
+
+def timeseries(conn, where_sql, params, start=None, end=None, interval='auto'):
+    """Per-bucket totals for the venues matching where_sql between `start` and `end` (day numbers).
+
+    Missing bounds default to the range of the stored history. Each point has the bucket's first
+    date, venue_days (venue x day rows), summed foot_traffic and sales and the mean dwell time;
+    buckets without history are omitted. Raises ValueError for an empty or too finely bucketed range.
+    """
+    bounds = data_range(conn)
+    if bounds is None and (start is None or end is None):
+        return {'interval': None if interval == 'auto' else interval, 'start': None, 'end': None, 'points': []}
+    start = bounds[0] if start is None else start
+    end = bounds[1] if end is None else end
+    if start > end:
+        raise ValueError('start is after end')
+    if interval == 'auto':
+        interval = pick_interval(start, end)
+    elif (end - start) / INTERVAL_DAYS[interval] + 1 > MAX_POINTS:
+        raise ValueError(f'range too long for interval={interval} (more than {MAX_POINTS} points)')
+
+    buckets = {}
+    for day, venue_days, foot_traffic, sales, dwell_sum, dwell_n in conn.execute(
+            DAILY_SQL.format(where=where_sql), (*params, start, end)):
+        key = bucket(day, interval)
+        acc = buckets.get(key)
+        if acc is None:
+            buckets[key] = [venue_days, foot_traffic, sales, dwell_sum, dwell_n]
+        else:
+            acc[0] += venue_days
+            acc[1] += foot_traffic
+            acc[2] += sales
+            acc[3] += dwell_sum
+            acc[4] += dwell_n
+    points = [{
+        'date': from_day(key).isoformat(),
+        'venue_days': venue_days,
+        'foot_traffic': foot_traffic,
+        'sales': round(sales, 2),
+        'avg_dwell_time_min': round(dwell_sum / dwell_n, 2) if dwell_n else None,
+    } for key, (venue_days, foot_traffic, sales, dwell_sum, dwell_n) in buckets.items()]
+    return {'interval': interval, 'start': from_day(start).isoformat(), 'end': from_day(end).isoformat(),
+            'points': points}
@@ -0,0 +1,115 @@
+# In-memory typeahead index for /api/distinct/{field}.
+# Purpose: the filter inputs ask for suggestions on every keystroke; instead of a
+# SELECT DISTINCT ... LIKE '%q%' scan and sort per request, the distinct values of each field
+# (with their venue counts) are kept in memory, sorted for prefix lookups by binary search and
+# joined into one string for substring lookups with str.find.
+# Interaction: app.get_distinct asks get_index() for the index matching the current data
+# version; it is rebuilt from SQLite (one GROUP BY per field) whenever the data changes.
+
+import bisect
+import heapq
+import threading
+
+from .filters import fold
+
+# field param -> venues column
+FIELDS = {
+    'chain': 'chain_name',
+    'category': 'sub_category',
+    'dma': 'dma',
+    'city': 'city',
+    'state': 'state_name',
+    'name': 'name',
+}
+
+# Separates values in FieldIndex.haystack; can't occur in a folded query.
+_SEP = '\n'
+
+
+class FieldIndex:
+    """Distinct values of one field with their venue counts.
+
+    Values are ordered by their case-folded form (matching is ASCII case-insensitive, like
+    SQLite's LIKE), so all values starting with a prefix form one contiguous range.
+    """
+
+    def __init__(self, counts):
+        entries = sorted(counts, key=lambda e: (fold(e[0]), e[0]))
+        self.values = [v for v, _ in entries]
+        self.counts = [c for _, c in entries]
+        self.keys = [fold(v) for v in self.values]
+        self.haystack = _SEP.join(self.keys)
+        # haystack offset where each value starts, to map a find() hit back to its value
+        self.starts = []
+        pos = 0
+        for key in self.keys:
+            self.starts.append(pos)
+            pos += len(key) + 1
+
+    def __len__(self):
+        return len(self.values)
+
+    def _rank(self, positions, limit):
+        # most venues first, then alphabetical
+        return heapq.nsmallest(limit, positions, key=lambda i: (-self.counts[i], self.keys[i], self.values[i]))
+
+    def suggest(self, q, limit):
+        """Return up to `limit` (value, count) pairs containing q; prefix matches rank first."""
+        needle = fold(q)
+        if _SEP in needle:
+            return []
+        lo = bisect.bisect_left(self.keys, needle)
+        hi = lo
+        while hi < len(self.keys) and self.keys[hi].startswith(needle):
+            hi += 1
+        ranked = self._rank(range(lo, hi), limit)
+        if len(ranked) < limit:
+            others = set()
+            at = self.haystack.find(needle)
+            while at != -1:
+                i = bisect.bisect_right(self.starts, at) - 1
+                if not lo <= i < hi:
+                    others.add(i)
+                # continue after this value: one hit per value is enough
+                at = self.haystack.find(needle, self.starts[i] + len(self.keys[i]) + 1)
+            ranked += self._rank(others, limit - len(ranked))
+        return [(self.values[i], self.counts[i]) for i in ranked]
+
+    def listing(self, limit):
+        """First `limit` (value, count) pairs in alphabetical order (the no-query dropdown)."""
+        return [(self.values[i], self.counts[i]) for i in range(min(limit, len(self.values)))]
+
+
+class TypeaheadIndex:
+    """FieldIndex per supported field for one data version of the venues table."""
+
+    def __init__(self, fields, version):
+        self.fields = fields
+        self.version = version
+
+    @classmethod
+    def load(cls, conn, version):
+        fields = {}
+        for field, column in FIELDS.items():
+            rows = conn.execute(
+                f"SELECT {column}, COUNT(*) FROM venues WHERE {column} IS NOT NULL AND {column} <> '' GROUP BY {column};"
+            ).fetchall()
+            fields[field] = FieldIndex(rows)
+        return cls(fields, version)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index(conn, version):
+    """Return the index for `version`, rebuilding it from SQLite when the data changed."""
+    global _index
+    index = _index
+    if index is None or index.version != version:
+        with _index_lock:
+            index = _index
+            if index is None or index.version != version:
+                index = TypeaheadIndex.load(conn, version)
+                _index = index
+    return index
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# Run the suite against a throwaway database seeded from the repo CSV on startup, so tests
+# never modify the committed src/data.db.
+os.environ.setdefault('FOOT_TRAFFIC_DB', os.path.join(tempfile.mkdtemp(prefix='foot-traffic-'), 'test.db'))
+
+# Ensure the backend package (src) is importable when tests run from backend/
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if BACKEND not in sys.path:
+    sys.path.insert(0, BACKEND)
@@ -1,16 +1,10 @@
-import sys
-import os
-
-# Ensure src is importable when tests run from backend/
-HERE = os.path.dirname(__file__)
-SRC = os.path.abspath(os.path.join(HERE, '..', 'src'))
-if SRC not in sys.path:
-    sys.path.insert(0, SRC)
-
+import pytest
 from fastapi.testclient import TestClient
-from app import app
+from src.app import app, init_db
+from src.db import pool
 
 
+init_db()
 client = TestClient(app)
 
 # Basic tests to verify API endpoints are reachable and return expected structures.
@@ -69,4 +63,338 @@ def test_distinct_invalid_field():
     # unsupported field should return 400
     r = client.get('/api/distinct/unsupported_field')
     assert r.status_code == 400
-        
+
+
+# Typeahead ranking: prefix matches first, then substring matches, each by venue count.
+def test_typeahead_ranking():
+    from src.typeahead import FieldIndex
+    index = FieldIndex([('Walmart', 5), ('Target', 9), ('Art Store', 1), ('Mart', 2), ('Smart', 7), ('WALGREENS', 3)])
+    assert index.suggest('ar', 10) == [('Art Store', 1), ('Target', 9), ('Smart', 7), ('Walmart', 5), ('Mart', 2)]
+    assert index.suggest('wal', 10) == [('Walmart', 5), ('WALGREENS', 3)]
+    assert index.suggest('mart', 2) == [('Mart', 2), ('Smart', 7)]
+    assert index.suggest('zzz', 10) == []
+    assert index.listing(3) == [('Art Store', 1), ('Mart', 2), ('Smart', 7)]
+
+
+def test_distinct_counts_match_sql():
+    from src.app import get_conn
+    conn = get_conn()
+    expected = dict(conn.execute(
+        "SELECT city, COUNT(*) FROM venues WHERE city IS NOT NULL AND city <> '' AND city LIKE '%an%' GROUP BY city;"
+    ).fetchall())
+    conn.close()
+    data = client.get('/api/distinct/city?q=an&counts=true&limit=500').json()
+    assert {d['value']: d['count'] for d in data} == expected
+    prefix = [d for d in data if d['value'].lower().startswith('an')]
+    assert data[:len(prefix)] == prefix
+    for field in ('state', 'name'):
+        assert client.get(f'/api/distinct/{field}?q=a').status_code == 200
+
+
+def test_typeahead_rebuilds_on_data_change():
+    from src.app import get_conn
+    from src.db import bump_data_version
+    assert 'Zzyzx Outlet' not in client.get('/api/distinct/chain?q=zzyzx').json()
+    conn = get_conn()
+    conn.execute("INSERT INTO venues (name, chain_name) VALUES ('Zzyzx Outlet', 'Zzyzx Outlet');")
+    bump_data_version(conn)
+    conn.commit()
+    try:
+        assert client.get('/api/distinct/chain?q=zzyzx').json() == ['Zzyzx Outlet']
+    finally:
+        conn.execute("DELETE FROM venues WHERE chain_name = 'Zzyzx Outlet';")
+        bump_data_version(conn)
+        conn.commit()
+        conn.close()
+
+
+# Connection pool
+# repeated requests should reuse pooled connections rather than opening new ones.
+def test_pool_reuses_connections():
+    for _ in range(5):
+        assert client.get('/api/venues/summary').status_code == 200
+    r = client.get('/api/stats/pool')
+    assert r.status_code == 200
+    stats = r.json()
+    assert stats['open'] <= stats['size']
+    assert stats['hits'] > 0
+    assert stats['in_use'] <= 1
+
+
+def test_pooled_connections_are_read_only_wal():
+    with pool.connection() as conn:
+        assert conn.execute('PRAGMA journal_mode;').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA query_only;').fetchone()[0] == 1
+
+
+# Filter engine
+# each match mode should return consistent results and be answered from an index.
+def test_match_modes():
+    full = client.get('/api/venues/summary').json()['venues']
+    exact = client.get('/api/venues/summary?chain=walmart&match=exact').json()['venues']
+    prefix = client.get('/api/venues/summary?chain=WAL&match=prefix').json()['venues']
+    contains = client.get('/api/venues/summary?chain=almar').json()['venues']
+    assert 0 < exact <= prefix <= full
+    assert exact <= contains <= full
+    r = client.get('/api/venues?chain=walmart&match=exact&per_page=5')
+    assert all(i['chain_name'].lower() == 'walmart' for i in r.json()['items'])
+    assert client.get('/api/venues?match=fuzzy').status_code == 422
+
+
+def test_filters_use_indexes():
+    from src.filters import build_where
+    cases = [
+        dict(chain=['Walmart', 'Target'], match='exact'),
+        dict(category=['big'], match='prefix'),
+        dict(dma=['633'], chain=['mart'], match='contains'),
+        dict(city='Pecos'),
+        dict(state='Texas', open_status='open'),
+    ]
+    with pool.connection() as conn:
+        for kwargs in cases:
+            where_sql, params = build_where(**kwargs)
+            plan = conn.execute(f"EXPLAIN QUERY PLAN SELECT COUNT(*) FROM venues{where_sql}", params).fetchall()
+            details = [row[3] for row in plan]
+            assert not any(d.split()[:2] == ['SCAN', 'venues'] for d in details), (kwargs, details)
+
+
+# Equivalent filters are one canonical VenueFilter; filters of the same shape share SQL text.
+def test_filter_compiler_canonical_and_cached():
+    from src.filters import VenueFilter, compile_filter
+    a = VenueFilter.create(chain=['Target', 'walmart', 'WALMART', 'all'], state='all', open_status='OPEN')
+    b = VenueFilter.create(chain=['Walmart', 'target'], open_status='open')
+    assert a == b and hash(a) == hash(b)
+    assert VenueFilter.create(open_status='all') == VenueFilter()
+
+    same_shape = VenueFilter.create(chain=['costco', 'kroger'], open_status='closed')
+    other_shape = VenueFilter.create(chain=['costco', 'ab'], open_status='closed')
+    costco = VenueFilter.create(chain=['Costco', 'Kroger'], open_status='open')
+    assert costco.shape() == a.shape()
+    assert compile_filter(costco).where_sql == compile_filter(a).where_sql
+    assert compile_filter(costco).params != compile_filter(a).params
+    # a short (non-trigram) value changes the shape
+    assert other_shape.shape() != same_shape.shape()
+    assert compile_filter(other_shape).where_sql != compile_filter(same_shape).where_sql
+
+    compile_filter(a)
+    hits = compile_filter.cache_info().hits
+    compile_filter(b)
+    assert compile_filter.cache_info().hits == hits + 1
+    assert client.get('/api/stats/cache').json()['compiled_filters']['hits'] >= hits + 1
+
+
+# Requests differing only in value order / case share a cache entry (and ETag).
+def test_equivalent_filters_share_cache_entry():
+    r1 = client.get('/api/venues/summary?chain=Target&chain=walmart&open_status=all')
+    r2 = client.get('/api/venues/summary?chain=WALMART&chain=target')
+    assert r1.headers['etag'] == r2.headers['etag']
+    assert r1.json() == r2.json()
+
+
+# Keyset pagination
+# walking the cursor should visit the same rows as offset pages, without counting.
+def test_cursor_pagination_matches_offset():
+    offset_ids = []
+    for page in (1, 2, 3):
+        offset_ids += [i['id'] for i in client.get(f'/api/venues?per_page=20&page={page}').json()['items']]
+
+    cursor_ids = []
+    url = '/api/venues?per_page=20&count=none'
+    for _ in range(3):
+        data = client.get(url).json()
+        assert data['total'] is None
+        cursor_ids += [i['id'] for i in data['items']]
+        url = f"/api/venues?per_page=20&count=none&after={data['next_cursor']}"
+    assert cursor_ids == offset_ids
+    assert len(set(cursor_ids)) == 60
+
+
+def test_cursor_last_page_and_invalid():
+    total = client.get('/api/venues?chain=target&match=exact&count=cached').json()['total']
+    data = client.get(f'/api/venues?chain=target&match=exact&per_page={total}').json()
+    assert data['next_cursor'] is None and len(data['items']) == total
+    assert client.get('/api/venues?after=not-a-cursor').status_code == 400
+
+
+# Response cache
+# equivalent filter sets share a cache entry and ETag; a write bumps the data version.
+def test_cache_hits_and_etag():
+    from src.cache import response_cache
+    r1 = client.get('/api/venues/summary?chain=Walmart&chain=Target')
+    hits = response_cache.stats()['hits']
+    r2 = client.get('/api/venues/summary?chain=target&chain=walmart&chain=all')
+    assert r2.json() == r1.json()
+    assert r2.headers['etag'] == r1.headers['etag']
+    assert response_cache.stats()['hits'] == hits + 1
+
+    r3 = client.get('/api/venues/summary?chain=Walmart&chain=Target', headers={'If-None-Match': r1.headers['etag']})
+    assert r3.status_code == 304
+    assert client.get('/api/venues?per_page=5', headers={'If-None-Match': r1.headers['etag']}).status_code == 200
+
+
+def test_data_version_invalidates_cache():
+    from src.app import get_conn
+    from src.db import bump_data_version
+    r1 = client.get('/api/venues/summary?dma=633')
+    conn = get_conn()
+    bump_data_version(conn)
+    conn.commit()
+    conn.close()
+    r2 = client.get('/api/venues/summary?dma=633', headers={'If-None-Match': r1.headers['etag']})
+    assert r2.status_code == 200
+    assert r2.headers['etag'] != r1.headers['etag']
+    assert r2.json() == r1.json()
+
+
+# Group-by aggregation
+# per-group counts and sums should add up to the summary for the same filters.
+def test_aggregate_matches_summary():
+    summary = client.get('/api/venues/summary?open_status=open').json()
+    r = client.get('/api/venues/aggregate?group_by=chain&metric=count&metric=sum:foot_traffic&limit=1000&open_status=open')
+    assert r.status_code == 200
+    data = r.json()
+    assert data['metrics'] == ['count', 'sum_foot_traffic']
+    groups = data['groups']
+    assert sum(g['count'] for g in groups) == summary['venues']
+    assert sum(g['sum_foot_traffic'] or 0 for g in groups) == summary['total_foot_traffic']
+    counts = [g['count'] for g in groups]
+    assert counts == sorted(counts, reverse=True)
+
+
+def test_aggregate_percentiles_and_top_n():
+    from src.aggregate import percentile
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    r = client.get('/api/venues/aggregate?group_by=state&metric=p50:foot_traffic&metric=max:foot_traffic'
+                   '&metric=min:foot_traffic&order_by=p50:foot_traffic&limit=3')
+    groups = r.json()['groups']
+    assert len(groups) == 3
+    medians = [g['p50_foot_traffic'] for g in groups]
+    assert medians == sorted(medians, reverse=True)
+    for g in groups:
+        assert g['min_foot_traffic'] <= g['p50_foot_traffic'] <= g['max_foot_traffic']
+
+
+# ordered by a plain metric, the percentile pass reads only the rows of the top N groups
+# (open_year's top groups include venues without an opening date).
+@pytest.mark.parametrize('group_by, order', [('state', 'asc'), ('open_year', 'desc')])
+def test_aggregate_percentiles_only_for_output_groups(group_by, order):
+    from src.aggregate import aggregate
+    metrics = ['count', 'p50:foot_traffic', 'p90:sales']
+    statements = []
+    with pool.connection() as conn:
+        full = aggregate(conn, '', [], group_by, metrics, limit=1000)
+        conn.set_trace_callback(statements.append)
+        try:
+            top = aggregate(conn, '', [], group_by, metrics, descending=order == 'desc', limit=4)
+        finally:
+            conn.set_trace_callback(None)
+    expected = sorted(full['groups'], key=lambda g: g['count'], reverse=order == 'desc')
+    assert top['groups'] == [g for g in expected if g[group_by] in {t[group_by] for t in top['groups']}]
+    assert len(top['groups']) == 4
+    passes = [sql for sql in statements if 'ORDER BY g, ' in sql]
+    assert len(passes) == 2 and all(' IN (' in sql for sql in passes)
+
+
+def test_aggregate_rejects_unknown():
+    assert client.get('/api/venues/aggregate?group_by=name').status_code == 400
+    assert client.get('/api/venues/aggregate?group_by=chain&metric=sum:name').status_code == 400
+    assert client.get('/api/venues/aggregate?group_by=chain&metric=median:sales').status_code == 400
+
+
+# Streaming export
+def test_export_csv_matches_list():
+    import csv
+    import io
+    r = client.get('/api/venues/export?chain=Walmart&match=exact', headers={'Accept-Encoding': 'identity'})
+    assert r.status_code == 200
+    assert 'content-encoding' not in r.headers
+    rows = list(csv.reader(io.StringIO(r.text)))
+    assert rows[0] == ['id', 'entity_id', 'name', 'chain_name', 'category', 'dma', 'city', 'state',
+                       'foot_traffic', 'date_opened', 'date_closed']
+    listed = client.get('/api/venues?chain=Walmart&match=exact&per_page=500').json()
+    assert [int(row[0]) for row in rows[1:]] == [i['id'] for i in listed['items']]
+
+
+def test_export_gzip_ndjson_columns():
+    import json
+    r = client.get('/api/venues/export?format=ndjson&columns=id,name&columns=sales,area_sqft&compress=gzip&state=Texas')
+    assert r.status_code == 200
+    assert r.headers['content-encoding'] == 'gzip'
+    assert r.headers['content-type'].startswith('application/x-ndjson')
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert lines and list(lines[0]) == ['id', 'name', 'sales', 'area_sqft']
+    summary = client.get('/api/venues/summary?state=Texas').json()
+    assert len(lines) == summary['venues']
+
+
+def test_export_streams_in_chunks(monkeypatch):
+    import zlib
+    from src import export
+    from src.db import pool
+    monkeypatch.setattr(export, 'CHUNK_BYTES', 4096)
+    with pool.connection() as conn:
+        plain = list(export.stream(conn, 'csv', list(export.DEFAULT_COLUMNS), '', []))
+        packed = b''.join(export.stream(conn, 'csv', list(export.DEFAULT_COLUMNS), '', [], 'gzip'))
+    assert len(plain) > 5 and all(len(c) < 2 * 4096 for c in plain)
+    assert zlib.decompress(packed, 31) == b''.join(plain)
+
+
+# Optional formats round-trip to the same rows as the CSV export (skipped without their packages).
+def test_export_parquet_round_trip():
+    import csv
+    import io
+    pq = pytest.importorskip('pyarrow.parquet')
+    url = '/api/venues/export?state=Texas&columns=id,name,foot_traffic,sales,lat'
+    table = pq.read_table(io.BytesIO(client.get(url + '&format=parquet').content))
+    assert table.schema.field('sales').type == 'double'
+    rows = list(csv.DictReader(io.StringIO(client.get(url, headers={'Accept-Encoding': 'identity'}).text)))
+    assert table.column('id').to_pylist() == [int(r['id']) for r in rows]
+    assert table.column('foot_traffic').to_pylist() == [int(r['foot_traffic']) for r in rows]
+    assert table.column('sales').to_pylist() == [float(r['sales']) if r['sales'] else None for r in rows]
+
+
+@pytest.mark.parametrize('threads', [0, 2])
+def test_export_zstd_round_trip(monkeypatch, threads):
+    zstandard = pytest.importorskip('zstandard')
+    from src import export
+    monkeypatch.setattr(export, 'ZSTD_THREADS', threads)
+    monkeypatch.setattr(export, 'CHUNK_BYTES', 4096)
+    with pool.connection() as conn:
+        plain = b''.join(export.stream(conn, 'ndjson', list(export.COLUMNS), '', []))
+        packed = b''.join(export.stream(conn, 'ndjson', list(export.COLUMNS), '', [], 'zstd'))
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(packed) == plain
+    r = client.get('/api/venues/export?compress=auto', headers={'Accept-Encoding': 'zstd, gzip'})
+    assert r.headers['content-encoding'] == 'zstd'
+
+
+def test_export_rejects_bad_params():
+    from src import export
+    assert client.get('/api/venues/export?columns=id,password').status_code == 400
+    assert client.get('/api/venues/export?format=xml').status_code == 422
+    if not export.PARQUET_AVAILABLE:
+        assert client.get('/api/venues/export?format=parquet').status_code == 400
+    if export.zstandard is None:
+        assert client.get('/api/venues/export?compress=zstd').status_code == 400
+
+
+# shape=columns carries the same data as the default object items.
+def test_columns_shape_matches_objects():
+    objects = client.get('/api/venues?per_page=40&chain=mart').json()
+    columns = client.get('/api/venues?per_page=40&chain=mart&shape=columns').json()
+    assert 'items' not in columns and 'rows' not in objects
+    assert [dict(zip(columns['columns'], r)) for r in columns['rows']] == objects['items']
+    assert columns['next_cursor'] == objects['next_cursor'] and columns['total'] == objects['total']
+    assert client.get('/api/venues?shape=csv').status_code == 422
+    r = client.post('/api/batch', json={'items': {'per_page': 5, 'shape': 'columns'}})
+    assert len(r.json()['items']['rows']) == 5
+
+
+def test_serialize_matches_json_module():
+    import json
+    import numpy as np
+    from src import serialize
+    data = {'name': 'Café – Señor', 'n': None, 'x': 1.25, 'rows': [(1, 'a', None)], 'k': np.int64(7)}
+    expected = {'name': 'Café – Señor', 'n': None, 'x': 1.25, 'rows': [[1, 'a', None]], 'k': 7}
+    assert json.loads(serialize.dumps(data)) == expected
+    line = serialize.dumps_line({'a': 1})
+    assert line.endswith(b'\n') and json.loads(line) == {'a': 1}
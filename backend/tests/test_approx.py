@@ -0,0 +1,256 @@
+import bisect
+import os
+import random
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+from src import approx, ingest
+from src.aggregate import percentile
+from src.app import app, init_db
+from src.db import connect, drop_derived, ensure_schema, get_data_version
+from src.filters import VenueFilter
+from src.sketches import HyperLogLog, TDigest
+
+
+init_db()
+client = TestClient(app)
+
+CSV_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Bigbox Stores Metrics.csv'))
+STATES = ['Texas'] * 6 + ['Ohio'] * 3 + ['Utah']
+CHAINS = ['Walmart', 'Target', 'Costco', 'Kmart', 'Meijer']
+
+
+def venue(rnd):
+    ft = int(rnd.lognormvariate(11, 0.8))
+    return (rnd.choice(CHAINS), rnd.choice(CHAINS), 'Big Box Store', str(rnd.randrange(20)),
+            f'City {rnd.randrange(60)}', rnd.choice(STATES), ft, round(ft / rnd.uniform(5e3, 2e5), 3),
+            '2020-01-01' if rnd.random() < 0.1 else None)
+
+
+def populate(conn, n, seed=0):
+    rnd = random.Random(seed)
+    conn.executemany(
+        "INSERT INTO venues (name, chain_name, sub_category, dma, city, state_name, foot_traffic, ft_per_sqft, "
+        "date_closed) VALUES (?,?,?,?,?,?,?,?,?)", [venue(rnd) for _ in range(n)])
+
+
+@pytest.fixture(scope='module')
+def sampled_image():
+    """20k venues with a sample of about 2k of them (at least 200 per state) and current sketches."""
+    size, approx.SAMPLE_SIZE = approx.SAMPLE_SIZE, 2000
+    conn = sqlite3.connect(':memory:')
+    try:
+        ensure_schema(conn)
+        populate(conn, 20000)
+        approx.rebuild_sample(conn)
+        approx.refresh(conn, 1)
+        return conn.serialize()
+    finally:
+        approx.SAMPLE_SIZE = size
+        conn.close()
+
+
+@pytest.fixture
+def sampled(sampled_image):
+    conn = sqlite3.connect(':memory:')
+    conn.deserialize(sampled_image)
+    yield conn
+    conn.close()
+
+
+def exact_count(conn, where='', params=()):
+    return conn.execute(f"SELECT COUNT(*), COALESCE(SUM(foot_traffic), 0) FROM venues {where}", params).fetchone()
+
+
+def test_hyperloglog_estimates_and_merges():
+    small, large, other = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for i in range(100):
+        small.add(f'v{i}')
+    for i in range(50000):
+        large.add(i)
+        other.add(i + 25000)
+    assert round(small.estimate()) == 100  # linear counting is near exact for small sets
+    assert abs(large.estimate() - 50000) < large.error(3)
+    union = HyperLogLog.union([HyperLogLog.from_bytes(large.to_bytes()), other])
+    assert abs(union.estimate() - 75000) < union.error(3)
+    assert union.registers == HyperLogLog(large.registers).merge(other).registers
+
+
+def test_tdigest_quantiles_and_merge():
+    rnd = random.Random(1)
+    values = sorted(rnd.expovariate(1e-4) for _ in range(20000))
+    halves = [TDigest.from_sorted((v, 1) for v in values[i::2]) for i in (0, 1)]
+    for digest in (TDigest.from_sorted((v, 1) for v in values), TDigest.union(halves),
+                   TDigest.from_bytes(halves[0].to_bytes()).merge(halves[1])):
+        assert digest.total == len(values)
+        assert len(digest.centroids) <= 2 * digest.compression
+        for q in (50, 90, 99):
+            assert digest.quantile(q / 100) == pytest.approx(percentile(values, q), rel=0.03)
+        assert (digest.quantile(0), digest.quantile(1)) == (values[0], values[-1])
+    assert TDigest.union([]).quantile(0.5) is None
+    # the rank error bounds the true rank of each estimate of a digest of sorted values
+    digest = TDigest.from_sorted((v, 1) for v in values)
+    for q in (0.01, 0.5, 0.9, 0.99, 0.999):
+        rank = bisect.bisect(values, digest.quantile(q)) / len(values)
+        assert 0 < digest.rank_error(q) < 0.05 and abs(rank - q) <= digest.rank_error(q)
+    assert TDigest.union([]).rank_error(0.5) is None
+
+
+def test_allocate_is_proportional_with_a_floor():
+    rates = approx.allocate({'Texas': 100000, 'Ohio': 10000, 'Utah': 50, 'Empty': 0}, size=1000, minimum=200)
+    assert rates == {'Texas': pytest.approx(1000 / 110050), 'Ohio': 0.02, 'Utah': 1.0}
+
+
+# Every estimate must cover the exact answer within its 95% interval (seeded, so deterministic).
+@pytest.mark.parametrize('kwargs, where, params', [
+    (dict(chain=['mart']), "WHERE chain_name LIKE ?", ['%mart%']),
+    (dict(chain=['Target'], state='Ohio', match='exact'), "WHERE chain_name = ? AND state_name = ?", ['Target', 'Ohio']),
+    (dict(dma=['1', '2'], match='exact', open_status='open'),
+     "WHERE dma IN (?, ?) AND (date_closed IS NULL OR date_closed = '')", ['1', '2']),
+    (dict(category=['box'], state='Texas'), "WHERE sub_category LIKE ? AND state_name = ?", ['%box%', 'Texas']),
+])
+def test_sample_estimates_cover_exact(sampled, kwargs, where, params):
+    result = approx.summarize(sampled, VenueFilter.create(**kwargs), 1)
+    venues, total = exact_count(sampled, where, params)
+    assert result['method']['totals'] in ('sample', 'rollups')
+    assert abs(result['venues'] - venues) <= result['error']['venues']
+    assert abs(result['total_foot_traffic'] - total) <= result['error']['total_foot_traffic']
+    assert result['quantiles']['foot_traffic']['p50'] == pytest.approx(
+        percentile(sorted(r[0] for r in sampled.execute(f"SELECT foot_traffic FROM venues {where}", params)), 50),
+        rel=0.15)
+
+
+def test_state_filters_use_rollups_and_sketches(sampled):
+    result = approx.summarize(sampled, VenueFilter.create(state='Ohio'), 1)
+    assert result['method'] == {'totals': 'rollups', 'distinct': 'sketch', 'quantiles': 'sketch'}
+    assert (result['venues'], result['total_foot_traffic']) == exact_count(sampled, "WHERE state_name = 'Ohio'")
+    assert result['distinct']['chains'] == 5
+    assert abs(result['distinct']['cities'] - 60) <= result['error']['cities']
+    # sketches built for another data version are not used
+    stale = approx.summarize(sampled, VenueFilter.create(state='Ohio'), 2)
+    assert stale['method']['quantiles'] == 'sample' and stale['distinct'] is None
+
+
+# Quantile errors are rank errors: the true rank of each estimate lies within q ± error.
+@pytest.mark.parametrize('kwargs, where, params, method', [
+    (dict(state='Texas'), "WHERE state_name = ?", ['Texas'], 'sketch'),
+    (dict(open_status='open'), "WHERE date_closed IS NULL OR date_closed = ''", [], 'sketch'),
+    (dict(chain=['mart']), "WHERE chain_name LIKE ?", ['%mart%'], 'sample'),
+    (dict(dma=['1', '2', '3'], match='exact'), "WHERE dma IN (?, ?, ?)", ['1', '2', '3'], 'sample'),
+])
+def test_quantile_rank_errors_cover_exact(sampled, kwargs, where, params, method):
+    result = approx.summarize(sampled, VenueFilter.create(**kwargs), 1)
+    assert result['method']['quantiles'] == method
+    for column in approx.QUANTILE_COLUMNS:
+        values = sorted(r[0] for r in sampled.execute(f"SELECT {column} FROM venues {where}", params))
+        for q in approx.QUANTILES:
+            estimate, error = result['quantiles'][column][f'p{q}'], result['error']['quantiles'][column][f'p{q}']
+            assert 0 < error < 10
+            low, high = bisect.bisect_left(values, estimate), bisect.bisect_right(values, estimate)
+            assert low / len(values) * 100 - error <= q <= high / len(values) * 100 + error
+
+
+def test_small_matches_are_exact(sampled):
+    result = approx.summarize(sampled, VenueFilter.create(city='City 7', chain=['Costco'], state='Utah'), 1)
+    assert result['method'] == {'totals': 'exact', 'distinct': 'exact', 'quantiles': 'exact'}
+    assert (result['venues'], result['total_foot_traffic']) == exact_count(
+        sampled, "WHERE city = 'City 7' AND chain_name LIKE '%Costco%' AND state_name = 'Utah'")
+    assert result['error']['quantiles']['foot_traffic'] == {'p50': 0, 'p90': 0, 'p99': 0}
+
+
+# A refresh rebuilds only the sketches of states whose venues changed, to the same result as a
+# full rebuild; a deferred load, which bypasses the triggers, rebuilds them all.
+def test_refresh_rebuilds_only_changed_states(sampled, monkeypatch):
+    def snapshot():
+        return dict(((s, c, n), d) for s, c, n, d in sampled.execute('SELECT * FROM venue_sketches'))
+
+    before = snapshot()
+    sampled.execute("UPDATE venues SET foot_traffic = foot_traffic * 2 WHERE state_name = 'Ohio' AND id % 3 = 0")
+    sampled.execute("UPDATE venues SET state_name = NULL WHERE state_name = 'Utah' AND id % 5 = 0")
+    sampled.execute("UPDATE venues SET dma = 'x' WHERE state_name = 'Texas'")  # not in any sketch
+    assert sorted(r[0] for r in sampled.execute('SELECT * FROM venue_sketch_dirty')) == ['', 'Ohio', 'Utah']
+    rebuilt = []
+    rebuild = approx.rebuild_sketches
+    monkeypatch.setattr(approx, 'rebuild_sketches', lambda conn, states=None: rebuilt.append(states) or rebuild(conn, states))
+    approx.refresh(sampled, 2)
+    assert sorted(rebuilt[0]) == ['', 'Ohio', 'Utah']
+    assert sampled.execute('SELECT COUNT(*) FROM venue_sketch_dirty').fetchone()[0] == 0
+    incremental = snapshot()
+    assert {k: v for k, v in incremental.items() if k[0] == 'Texas'} == {k: v for k, v in before.items() if k[0] == 'Texas'}
+    assert incremental != before
+    rebuild(sampled)
+    assert snapshot() == incremental
+
+    drop_derived(sampled)
+    sampled.execute("UPDATE venues SET city = 'Elsewhere' WHERE state_name = 'Texas'")
+    ensure_schema(sampled)
+    approx.refresh(sampled, 3)
+    assert rebuilt[-1] is None
+    assert approx.summarize(sampled, VenueFilter.create(state='Texas'), 3)['distinct']['cities'] == 1
+
+
+# Triggers keep the sample a deterministic function of the venues and the strata rates.
+def test_triggers_keep_sample_in_sync(sampled):
+    def snapshot():
+        return sampled.execute('SELECT * FROM venue_sample ORDER BY id').fetchall()
+
+    populate(sampled, 500, seed=1)
+    sampled.execute("UPDATE venues SET foot_traffic = foot_traffic + 1, city = 'Elsewhere' WHERE id % 7 = 0")
+    sampled.execute("DELETE FROM venues WHERE id % 11 = 0")
+    maintained = snapshot()
+    assert 1500 < len(maintained) < 3000
+    # redraw with the same rates
+    sampled.execute('DELETE FROM venue_sample')
+    sampled.execute(approx._SAMPLE_REBUILD_SQL)
+    assert snapshot() == maintained
+
+
+def test_summary_api_accuracy():
+    exact = client.get('/api/venues/summary?chain=walmart').json()
+    body = client.get('/api/venues/summary?chain=walmart&accuracy=approx').json()
+    assert set(body) == {'venues', 'total_foot_traffic', 'distinct', 'quantiles', 'error', 'method', 'confidence'}
+    assert body['confidence'] == approx.CONFIDENCE
+    assert abs(body['venues'] - exact['venues']) <= body['error']['venues']
+    assert set(body['quantiles']) == set(approx.QUANTILE_COLUMNS)
+    assert client.get('/api/venues/summary?accuracy=roughly').status_code == 422
+
+
+# Loads refresh the sample and sketches only when they succeed and change venues; a load that
+# only changes metrics keeps the sketches current without rebuilding them.
+def test_loads_refresh_only_after_venue_changes(tmp_path, monkeypatch):
+    refreshed = []
+    refresh = approx.refresh
+    monkeypatch.setattr(approx, 'refresh', lambda conn, version: refreshed.append(version) or refresh(conn, version))
+
+    def sketch_version():
+        return conn.execute("SELECT value FROM meta WHERE key = 'sketch_version';").fetchone()[0]
+
+    conn = connect(str(tmp_path / 'loads.db'))
+    ingest.ingest_csv(conn, CSV_PATH, progress=None)
+    assert refreshed == [get_data_version(conn)] == [sketch_version()]
+    venues = conn.execute("SELECT COUNT(*) FROM venues;").fetchone()
+
+    ingest.ingest_delta(conn, [CSV_PATH], progress=None)
+    history = tmp_path / 'history.csv'
+    entity_id = conn.execute("SELECT entity_id FROM venues LIMIT 1;").fetchone()[0]
+    history.write_text(f'entity_id,date,foot_traffic\n{entity_id},2024-01-01,5\n', encoding='utf-8')
+    ingest.ingest_metrics(conn, [str(history)], progress=None)
+    assert len(refreshed) == 1
+    assert sketch_version() == get_data_version(conn)
+    assert approx.summarize(conn, VenueFilter.create(state='Texas'), get_data_version(conn))['method']['distinct'] == 'sketch'
+
+    # a load that fails after committing some batches of new venues refreshes nothing
+    def interrupt(rows, elapsed):
+        raise RuntimeError('interrupted')
+
+    with open(CSV_PATH, encoding='utf-8') as fh:
+        header, *lines = fh.readlines()
+    renamed = tmp_path / 'renamed.csv'
+    renamed.write_text(header + ''.join('x' + line for line in lines), encoding='utf-8')
+    monkeypatch.setattr(ingest, 'PROGRESS_EVERY', 300)
+    with pytest.raises(RuntimeError):
+        ingest.ingest_csv(conn, str(renamed), batch_size=100, progress=interrupt)
+    assert len(refreshed) == 1
+    assert conn.execute("SELECT COUNT(*) FROM venues;").fetchone()[0] == venues[0] + 300
+    conn.close()
@@ -0,0 +1,56 @@
+from fastapi.testclient import TestClient
+from src.app import app, init_db
+from src.db import pool
+
+
+init_db()
+client = TestClient(app)
+
+QUERY = 'chain=walmart&open_status=open&per_page=7'
+FILTERS = {'chain': ['walmart'], 'open_status': 'open'}
+
+
+# Every batch output must equal the response of the matching single endpoint.
+def test_batch_matches_single_endpoints():
+    body = client.post('/api/batch', json={
+        'filters': FILTERS,
+        'items': {'per_page': 7},
+        'summary': True,
+        'aggregates': [{'group_by': 'state', 'metric': ['count', 'p50:foot_traffic'], 'limit': 5}],
+    }).json()
+    assert body['items'] == client.get(f'/api/venues?{QUERY}').json()
+    assert body['summary'] == client.get(f'/api/venues/summary?{QUERY}').json()
+    agg = client.get(f'/api/venues/aggregate?{QUERY}&group_by=state&metric=count&metric=p50:foot_traffic&limit=5').json()
+    assert body['aggregates'] == [agg]
+
+
+def test_batch_cursor_and_unfiltered():
+    first = client.post('/api/batch', json={'items': {'per_page': 5}}).json()['items']
+    after = first['next_cursor']
+    second = client.post('/api/batch', json={'items': {'per_page': 5, 'after': after, 'count': 'none'}}).json()['items']
+    assert second == client.get(f'/api/venues?per_page=5&after={after}&count=none').json()
+
+
+def test_batch_distinct_facets():
+    body = client.post('/api/batch', json={
+        'filters': {'state': 'Texas'}, 'summary': True, 'distinct': [{'field': 'chain'}, {'field': 'city', 'limit': 3}],
+    }).json()
+    chains = body['distinct']['chain']
+    assert sum(d['count'] for d in chains) == body['summary']['venues']
+    assert [d['count'] for d in chains] == sorted((d['count'] for d in chains), reverse=True)
+    assert len(body['distinct']['city']) == 3
+
+
+def test_batch_leaves_connection_read_only():
+    client.post('/api/batch', json={'filters': FILTERS, 'summary': True})
+    with pool.connection() as conn:
+        assert conn.execute('PRAGMA query_only;').fetchone()[0] == 1
+        assert not conn.in_transaction
+        assert conn.execute("SELECT COUNT(*) FROM temp.sqlite_master WHERE name = 'batch_ids';").fetchone()[0] == 0
+
+
+def test_batch_rejects_bad_specs():
+    assert client.post('/api/batch', json={'distinct': [{'field': 'password'}]}).status_code == 400
+    assert client.post('/api/batch', json={'aggregates': [{'group_by': 'nope'}]}).status_code == 400
+    assert client.post('/api/batch', json={'items': {'after': '!!'}}).status_code == 400
+    assert client.post('/api/batch', json={'items': {'per_page': 0}}).status_code == 422
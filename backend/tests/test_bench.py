@@ -0,0 +1,49 @@
+import csv
+import io
+
+from bench import synth
+from bench.scenarios import ENDPOINTS, pick
+from bench.stats import compare, summarize
+from fastapi.testclient import TestClient
+from src.app import app, init_db
+from src.ingest import FIELD_ORDER, normalize_row
+
+
+init_db()
+client = TestClient(app)
+
+
+# Synthetic rows follow the CSV schema, parse like real ones and are deterministic per seed.
+def test_synth_rows_parse_and_are_deterministic():
+    templates = synth.load_templates()
+    rows = list(synth.synth_rows(500, seed=1, templates=templates))
+    assert rows == list(synth.synth_rows(500, seed=1, templates=templates))
+    assert len({r['entity_id'] for r in rows}) == 500
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=FIELD_ORDER, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(rows)
+    for r in csv.DictReader(io.StringIO(out.getvalue())):
+        row = normalize_row(r)
+        assert row[-2] is not None and row[-1] is not None  # lat / lon parsed from geolocation
+    assert synth.parse_venues('10k') == 10_000 and synth.parse_venues('1.5m') == 1_500_000
+    assert synth.label(10_000_000) == '10m'
+
+
+def test_compare_flags_regressions():
+    base = {'benchmarks': {'a': summarize([0.010]), 'b': summarize([0.010])}, 'load': {'throughput_rps': 100}}
+    current = {'benchmarks': {'a': summarize([0.011]), 'b': summarize([0.020])}, 'load': {'throughput_rps': 50}}
+    lines, regressions = compare(base, current, threshold=0.25)
+    assert regressions == ['b', 'load']
+    assert compare(base, base)[1] == []
+
+
+# Every benchmark and load request is valid against the current API.
+def test_scenarios_are_valid_requests():
+    import random
+    for name, (method, url, body) in ENDPOINTS.items():
+        assert client.request(method, url, json=body).status_code == 200, name
+    rnd = random.Random(0)
+    for _ in range(30):
+        name, method, url, body = pick(rnd)
+        assert client.request(method, url, json=body).status_code == 200, (name, url)
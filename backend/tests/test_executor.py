@@ -0,0 +1,122 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+from src.app import app, init_db
+from src.db import ConnectionPool, DB_PATH
+from src.executor import DBExecutor, Overloaded, QueryTimeout
+
+
+init_db()
+client = TestClient(app)
+
+# Runs until interrupted (counts to a billion).
+SLOW_SQL = 'WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000000000) SELECT COUNT(*) FROM n;'
+
+
+def make_executor(**kwargs):
+    return DBExecutor('test', kwargs.pop('workers', 2), pool=ConnectionPool(DB_PATH, size=2), **kwargs)
+
+
+def test_run_returns_result_and_counts():
+    ex = make_executor()
+    assert asyncio.run(ex.run(lambda conn: conn.execute('SELECT COUNT(*) FROM venues;').fetchone()[0])) > 0
+    stats = ex.stats()
+    assert stats['submitted'] == stats['completed'] == 1
+    assert stats['queued'] == stats['running'] == 0
+    ex.shutdown()
+
+
+# A slow query is interrupted on timeout and its connection is usable again afterwards.
+def test_timeout_interrupts_query():
+    ex = make_executor(workers=1, timeout=0.2)
+    with pytest.raises(QueryTimeout):
+        asyncio.run(ex.run(lambda conn: conn.execute(SLOW_SQL).fetchone()))
+    # the worker finishes unwinding the interrupted statement before taking the next job
+    assert asyncio.run(ex.run(lambda conn: conn.execute('SELECT 1;').fetchone()[0], timeout=5)) == 1
+    stats = ex.stats()
+    assert stats['timeouts'] == 1 and stats['failed'] == 1
+    assert ex.pool.stats()['in_use'] == 0
+    ex.shutdown()
+
+
+def test_full_queue_is_rejected():
+    ex = make_executor(workers=1, queue_limit=1)
+    release = threading.Event()
+
+    async def scenario():
+        blocker = asyncio.ensure_future(ex.run(lambda conn: release.wait(5)))
+        await asyncio.sleep(0.05)  # blocker is running, the queue is empty
+        waiting = asyncio.ensure_future(ex.run(lambda conn: 'queued'))
+        await asyncio.sleep(0.05)
+        with pytest.raises(Overloaded):
+            await ex.run(lambda conn: 'rejected')
+        release.set()
+        return await blocker, await waiting
+
+    assert asyncio.run(scenario()) == (True, 'queued')
+    stats = ex.stats()
+    assert stats['rejected'] == 1 and stats['max_queued'] == 1
+    ex.shutdown()
+
+
+# Closing a stream early (client disconnect) releases its connection.
+def test_stream_releases_connection_when_closed():
+    ex = make_executor()
+
+    def chunks(conn):
+        for (i,) in conn.execute('SELECT id FROM venues;'):
+            yield i
+
+    async def scenario():
+        stream = ex.stream(chunks)
+        first = [await stream.__anext__() for _ in range(3)]
+        await stream.aclose()
+        return first
+
+    assert len(asyncio.run(scenario())) == 3
+    assert ex.pool.stats()['in_use'] == 0
+    ex.shutdown()
+
+
+# More open streams than export workers: the extra streams wait for a slot instead of taking
+# connections, so interactive queries still get theirs.
+def test_streams_are_capped_by_workers():
+    pool = ConnectionPool(DB_PATH, size=3, timeout=0.5)
+    queries = DBExecutor('query', 2, pool=pool)
+    exports = DBExecutor('export', 1, pool=pool)
+
+    release = threading.Event()
+
+    def chunks(conn):
+        for (i,) in conn.execute('SELECT id FROM venues ORDER BY id LIMIT 5;'):
+            yield i
+            release.wait(5)  # hold the stream open
+
+    async def read(stream):
+        return [chunk async for chunk in stream]
+
+    async def scenario():
+        streams = [asyncio.ensure_future(read(exports.stream(chunks))) for _ in range(3)]
+        await asyncio.sleep(0.1)
+        assert exports.stats()['streams'] == 1
+        # every interactive worker can take a connection while the streams are open
+        both = await asyncio.gather(*(queries.run(lambda conn: conn.execute('SELECT 1;').fetchone()[0]) for _ in range(2)))
+        release.set()
+        return both, await asyncio.gather(*streams)
+
+    both, results = asyncio.run(scenario())
+    assert both == [1, 1]
+    assert len(results) == 3 and all(r == results[0] and len(r) == 5 for r in results)
+    assert exports.stats()['streams'] == 0 and pool.stats()['in_use'] == 0
+    queries.shutdown()
+    exports.shutdown()
+
+
+def test_executor_stats_endpoint():
+    client.get('/api/venues/summary?chain=executor-stats')
+    data = client.get('/api/stats/executor').json()
+    assert set(data) == {'query', 'export'}
+    assert data['query']['completed'] > 0
+    assert data['query']['queued'] == 0
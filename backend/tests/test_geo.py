@@ -0,0 +1,130 @@
+import sqlite3
+
+from fastapi.testclient import TestClient
+from src.app import app, init_db
+from src.db import DB_PATH, ensure_schema
+from src.filters import VenueFilter, compile_filter, compile_scan_filter
+from src.geo import circle_bbox, distance_mi, parse_bbox, parse_point
+
+
+init_db()
+client = TestClient(app)
+
+TEXAS = '-107,25.8,-93.5,36.5'
+PECOS = (31.4087, -103.4884)
+
+
+def located_rows():
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        return conn.execute(
+            "SELECT id, chain_name, state_name, date_closed, lat, lon FROM venues WHERE lat IS NOT NULL;").fetchall()
+    finally:
+        conn.close()
+
+
+def all_items(url):
+    r = client.get(url + '&per_page=500&count=none')
+    assert r.status_code == 200
+    return r.json()['items']
+
+
+def test_parse_point():
+    assert parse_point('POINT (-103.48 31.40)') == (31.40, -103.48)
+    assert parse_point(' point(-1 2) ') == (2.0, -1.0)
+    assert parse_point(None) == (None, None)
+    assert parse_point('POINT EMPTY') == (None, None)
+    assert parse_point('POINT (200 95)') == (None, None)
+
+
+def test_ingest_populates_coordinates_and_rtree():
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        total, located = conn.execute("SELECT COUNT(*), COUNT(lat) FROM venues;").fetchone()
+        indexed = conn.execute("SELECT COUNT(*) FROM venues_rtree;").fetchone()[0]
+    finally:
+        conn.close()
+    assert total > 0 and located == total
+    assert indexed == located
+
+
+def test_bbox_matches_brute_force():
+    west, south, east, north = map(float, TEXAS.split(','))
+    expected = {r[0] for r in located_rows() if south <= r[4] <= north and west <= r[5] <= east}
+    items = all_items(f'/api/venues?bbox={TEXAS}')
+    assert expected and {i['id'] for i in items} == expected
+    summary = client.get(f'/api/venues/summary?bbox={TEXAS}').json()
+    assert summary['venues'] == len(expected)
+
+
+def test_radius_combines_with_filters():
+    lat, lon = PECOS
+    expected = {r[0] for r in located_rows()
+                if r[1] == 'Walmart' and not r[3] and distance_mi(lat, lon, r[4], r[5]) <= 250}
+    items = all_items(f'/api/venues?lat={lat}&lon={lon}&radius_mi=250&chain=Walmart&match=exact&open_status=open')
+    assert expected and {i['id'] for i in items} == expected
+
+
+def test_nearest_is_sorted_and_exact():
+    lat, lon = PECOS
+    ranked = sorted((distance_mi(lat, lon, r[4], r[5]), r[0]) for r in located_rows() if r[1] == 'Target')
+    body = client.get(f'/api/venues/nearest?lat={lat}&lon={lon}&k=5&chain=Target&match=exact').json()
+    assert [i['id'] for i in body['items']] == [i for _, i in ranked[:5]]
+    distances = [i['distance_mi'] for i in body['items']]
+    assert distances == sorted(distances)
+
+
+def test_bad_geo_params():
+    assert client.get('/api/venues?bbox=1,2,3').status_code == 400
+    assert client.get('/api/venues?bbox=0,10,10,0').status_code == 400
+    assert client.get('/api/venues?bbox=-190,0,0,10').status_code == 400
+    assert client.get('/api/venues?radius_mi=5').status_code == 400
+    assert client.get('/api/venues/nearest?lat=95&lon=0').status_code == 422
+
+
+# Boxes and circles across the antimeridian cover both sides of it.
+def test_antimeridian():
+    assert parse_bbox('170,-10,-170,10') == (170.0, -10.0, -170.0, 10.0)
+    west, south, east, north = circle_bbox(0.0, 179.9, 100)
+    assert west > east and 178 < west < 179.9 and -180 < east < -178
+    assert circle_bbox(89.0, 10.0, 100)[::2] == (-180.0, 180.0)  # holds the north pole
+
+    conn = sqlite3.connect(':memory:')
+    ensure_schema(conn)
+    conn.create_function('distance_mi', 4, distance_mi)
+    conn.executemany("INSERT INTO venues (name, lat, lon) VALUES (?, ?, ?);",
+                     [('east', 0.5, 179.5), ('west', -0.5, -179.5), ('far', 0.0, 0.0), ('north', 5.0, 179.5)])
+    for compile_fn in (compile_filter, compile_scan_filter):
+        for f, expected in ((VenueFilter.create(bbox=(179.0, -1.0, -179.0, 1.0)), ['east', 'west']),
+                            (VenueFilter.create(radius=(0.0, 179.9, 100.0)), ['east', 'west'])):
+            where_sql, params = compile_fn(f)
+            assert [r[0] for r in conn.execute(f"SELECT name FROM venues{where_sql} ORDER BY name;", params)] == expected
+    conn.close()
+
+
+def test_bbox_uses_rtree():
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM venues WHERE id IN (SELECT id FROM venues_rtree "
+            "WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?);", (25, 36, -107, -93)).fetchall()
+    finally:
+        conn.close()
+    details = [r[3] for r in plan]
+    assert any('venues_rtree VIRTUAL TABLE' in d for d in details)
+    assert not any(d.split()[:2] == ['SCAN', 'venues'] for d in details)
+
+
+# Older DBs without lat/lon gain the columns, backfilled from geolocation, plus a populated R*Tree.
+def test_schema_upgrade_backfills_coordinates():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE venues (id INTEGER PRIMARY KEY AUTOINCREMENT, entity_id TEXT, name TEXT, "
+                 "geolocation TEXT, chain_name TEXT, sub_category TEXT, dma TEXT, city TEXT, state_name TEXT, "
+                 "foot_traffic INTEGER, sales REAL, area_sqft REAL, date_closed TEXT);")
+    conn.execute("INSERT INTO venues (name, geolocation) VALUES ('a', 'POINT (-103.5 31.4)'), ('b', NULL);")
+    ensure_schema(conn)
+    assert conn.execute("SELECT lat, lon FROM venues ORDER BY id;").fetchall() == [(31.4, -103.5), (None, None)]
+    assert conn.execute("SELECT COUNT(*) FROM venues_rtree;").fetchone()[0] == 1
+    conn.execute("UPDATE venues SET lat = 40.0, lon = -75.0 WHERE name = 'b';")
+    conn.execute("DELETE FROM venues WHERE name = 'a';")
+    assert conn.execute("SELECT id FROM venues_rtree;").fetchall() == [(2,)]
@@ -0,0 +1,186 @@
+import os
+
+import pytest
+
+from src import ingest
+from src.db import connect
+
+CSV_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Bigbox Stores Metrics.csv'))
+
+
+def csv_rows():
+    with open(CSV_PATH, encoding='utf-8') as fh:
+        return sum(1 for _ in fh) - 1
+
+
+def counts(conn):
+    return conn.execute("SELECT COUNT(*), COUNT(DISTINCT entity_id) FROM venues;").fetchone()
+
+
+# Batched streaming ingest: every row lands once, derived structures are rebuilt afterwards.
+@pytest.mark.parametrize('defer_indexes', [False, True])
+def test_ingest_in_batches(tmp_path, defer_indexes):
+    conn = connect(str(tmp_path / 'ingest.db'))
+    stats = ingest.ingest_csv(conn, CSV_PATH, batch_size=100, defer_indexes=defer_indexes, progress=None)
+    n = csv_rows()
+    assert stats['inserted'] == n and stats['errors'] == 0
+    assert counts(conn) == (n, n)
+    # indexes, FTS and rollups are back after a deferred load
+    names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master;")}
+    assert 'idx_venues_chain_key' in names and 'venues_fts_ai' in names
+    fts = conn.execute("SELECT COUNT(*) FROM venues_fts WHERE chain_name LIKE '%mart%';").fetchone()[0]
+    like = conn.execute("SELECT COUNT(*) FROM venues WHERE chain_name LIKE '%mart%';").fetchone()[0]
+    assert fts == like
+    assert conn.execute("SELECT SUM(venues) FROM venue_rollups;").fetchone()[0] == n
+    assert conn.execute("SELECT COUNT(*) FROM ingest_progress;").fetchone()[0] == 0
+    conn.close()
+
+
+def test_resume_after_interruption(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, 'PROGRESS_EVERY', 300)
+
+    def interrupt(rows, elapsed):
+        raise RuntimeError('interrupted')
+
+    conn = connect(str(tmp_path / 'resume.db'))
+    with pytest.raises(RuntimeError):
+        ingest.ingest_csv(conn, CSV_PATH, batch_size=100, defer_indexes=True, progress=interrupt)
+    committed = counts(conn)[0]
+    assert 0 < committed < csv_rows()
+
+    stats = ingest.ingest_csv(conn, CSV_PATH, batch_size=100, resume=True, progress=None)
+    assert stats['skipped'] == committed
+    n = csv_rows()
+    assert counts(conn) == (n, n)
+    conn.close()
+
+
+# Parallel ingest: byte-range chunks of several files, parsed in worker processes, must add up
+# to exactly the rows of the serial path.
+def test_parallel_ingest_matches_serial(tmp_path):
+    src_dir = tmp_path / 'regional'
+    src_dir.mkdir()
+    with open(CSV_PATH, encoding='utf-8') as fh:
+        header, *lines = fh.readlines()
+    half = len(lines) // 2
+    for name, part in (('east.csv', lines[:half]), ('west.csv', lines[half:])):
+        (src_dir / name).write_text(header + ''.join(part), encoding='utf-8')
+
+    paths = ingest.expand_sources(str(src_dir))
+    assert [os.path.basename(p) for p in paths] == ['east.csv', 'west.csv']
+    assert ingest.expand_sources(str(src_dir / '*.csv')) == paths
+
+    conn = connect(str(tmp_path / 'parallel.db'))
+    stats = ingest.ingest_parallel(conn, paths, workers=2, chunk_bytes=16 * 1024, batch_size=100, progress=None)
+    n = csv_rows()
+    assert stats['chunks'] > 2
+    assert stats['inserted'] == n and stats['errors'] == 0
+    assert counts(conn) == (n, n)
+
+    serial = connect(str(tmp_path / 'serial.db'))
+    ingest.ingest_csv(serial, CSV_PATH, progress=None)
+    columns = ','.join(ingest.FIELD_ORDER)
+    sql = f"SELECT {columns} FROM venues ORDER BY entity_id;"
+    assert conn.execute(sql).fetchall() == serial.execute(sql).fetchall()
+    conn.close()
+    serial.close()
+
+
+# Delta refresh: unchanged rows are not written, changes are upserted, missing entities closed.
+def test_delta_refresh(tmp_path):
+    from src.db import get_data_version
+    with open(CSV_PATH, encoding='utf-8') as fh:
+        header, *lines = [line.rstrip('\n') + '\n' for line in fh]
+    conn = connect(str(tmp_path / 'delta.db'))
+    n = csv_rows()
+
+    first = ingest.ingest_delta(conn, [CSV_PATH], batch_size=100, progress=None)
+    assert (first['inserted'], first['updated'], first['unchanged']) == (n, 0, 0)
+    version = get_data_version(conn)
+
+    again = ingest.ingest_delta(conn, [CSV_PATH], batch_size=100, progress=None)
+    assert (again['inserted'], again['updated'], again['unchanged'], again['tombstoned']) == (0, 0, n, 0)
+    assert get_data_version(conn) == version  # nothing written, caches stay valid
+
+    # drop an open store, change the first row's foot_traffic, add a new entity
+    first_fields = lines[0].split(',')
+    changed_id = first_fields[0]
+    first_fields[3] = '1'
+    new_line = 'ffffffffffffffffffffffff' + lines[1][len(first_fields[0]):]
+    dropped = next(i for i in range(len(lines) - 1, 0, -1) if lines[i].rstrip('\n').endswith(','))
+    dropped_id = lines[dropped].split(',')[0]
+    kept = lines[1:dropped] + lines[dropped + 1:]
+    refreshed = tmp_path / 'refresh.csv'
+    refreshed.write_text(header + ','.join(first_fields) + ''.join(kept) + new_line, encoding='utf-8')
+
+    stats = ingest.ingest_delta(conn, [str(refreshed)], batch_size=100, progress=None)
+    assert (stats['inserted'], stats['updated'], stats['unchanged'], stats['tombstoned']) == (1, 1, n - 2, 1)
+    assert get_data_version(conn) > version
+    assert conn.execute("SELECT foot_traffic FROM venues WHERE entity_id = ?", (changed_id,)).fetchone() == (1,)
+    assert conn.execute("SELECT date_closed FROM venues WHERE entity_id = ?", (dropped_id,)).fetchone()[0]
+    assert conn.execute("SELECT COUNT(*) FROM venues").fetchone() == (n + 1,)
+    # rollups follow the upserts
+    assert conn.execute("SELECT SUM(venues), SUM(foot_traffic) FROM venue_rollups").fetchone() == \
+        conn.execute("SELECT COUNT(*), SUM(foot_traffic) FROM venues").fetchone()
+
+    # the original file reverts the changed row and reopens the tombstoned one
+    back = ingest.ingest_delta(conn, [CSV_PATH], batch_size=100, tombstone=False, progress=None)
+    assert (back['inserted'], back['updated'], back['unchanged']) == (0, 2, n - 2)
+    assert conn.execute("SELECT date_closed FROM venues WHERE entity_id = ?", (dropped_id,)).fetchone() == (None,)
+    conn.close()
+
+
+# A delta after a plain load (serial or parallel), or on a DB loaded before rows were hashed,
+# must find every row unchanged.
+@pytest.mark.parametrize('load', ['serial', 'parallel', 'unhashed'])
+def test_delta_after_plain_load(tmp_path, load):
+    from src.db import get_data_version
+    conn = connect(str(tmp_path / 'plain.db'))
+    if load == 'parallel':
+        ingest.ingest_parallel(conn, [CSV_PATH], workers=2, chunk_bytes=64 * 1024, progress=None)
+    else:
+        ingest.ingest_csv(conn, CSV_PATH, progress=None)
+    if load == 'unhashed':
+        conn.execute("UPDATE venues SET row_hash = NULL;")
+        conn.commit()
+    else:
+        assert conn.execute("SELECT COUNT(*) FROM venues WHERE row_hash IS NULL;").fetchone() == (0,)
+    version = get_data_version(conn)
+
+    stats = ingest.ingest_delta(conn, [CSV_PATH], batch_size=100, progress=None)
+    n = csv_rows()
+    assert (stats['inserted'], stats['updated'], stats['unchanged'], stats['tombstoned']) == (0, 0, n, 0)
+    assert get_data_version(conn) == version
+    conn.close()
+
+
+# Plain loads of entities that are already there skip them instead of failing on the unique
+# entity_id index, whether the repeat comes from a second run or from another file of the feed.
+def test_plain_load_twice(tmp_path):
+    import contextlib
+    import io
+    from load_csv import load_into_db
+    n = csv_rows()
+    db_path = str(tmp_path / 'twice.db')
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        assert load_into_db(CSV_PATH, db_path) == 0
+        assert load_into_db(CSV_PATH, db_path, defer_indexes=True) == 0
+    assert f'Skipped {n} rows whose entity_id is already loaded' in out.getvalue()
+    conn = connect(db_path)
+    assert counts(conn) == (n, n)
+    stats = ingest.ingest_parallel(conn, [CSV_PATH, CSV_PATH], workers=2, chunk_bytes=64 * 1024, progress=None)
+    assert (stats['inserted'], stats['existing']) == (0, 2 * n)
+    assert counts(conn) == (n, n)
+    conn.close()
+
+    # two files sharing entities: the second one's repeats are skipped, its new rows loaded
+    with open(CSV_PATH, encoding='utf-8') as fh:
+        header, *lines = fh.readlines()
+    (tmp_path / 'a.csv').write_text(header + ''.join(lines[:600]), encoding='utf-8')
+    (tmp_path / 'b.csv').write_text(header + ''.join(lines[400:]), encoding='utf-8')
+    conn = connect(str(tmp_path / 'overlap.db'))
+    first = ingest.ingest_csv(conn, str(tmp_path / 'a.csv'), batch_size=100, progress=None)
+    second = ingest.ingest_csv(conn, str(tmp_path / 'b.csv'), batch_size=100, progress=None)
+    assert (first['inserted'], second['inserted'], second['existing']) == (600, n - 600, 200)
+    assert counts(conn) == (n, n)
+    conn.close()
@@ -0,0 +1,95 @@
+import re
+
+from fastapi.testclient import TestClient
+from src import metrics
+from src.app import app, init_db
+from src.cache import response_cache
+
+
+init_db()
+client = TestClient(app)
+
+
+def sample(text, name, **labels):
+    wanted = ','.join(f'{k}="{v}"' for k, v in labels.items())
+    for line in text.splitlines():
+        if line.startswith(name + '{') and all(f'{k}="{v}"' in line for k, v in labels.items()):
+            return float(line.rsplit(' ', 1)[1])
+    raise AssertionError(f'{name}{{{wanted}}} not found')
+
+
+def test_histogram_render():
+    h = metrics.Histogram('t_seconds', 'test', ('endpoint',), buckets=(0.1, 1.0))
+    h.observe(('/a',), 0.05)
+    h.observe(('/a',), 0.5)
+    h.observe(('/a',), 5)
+    lines = h.render()
+    assert 't_seconds_bucket{endpoint="/a",le="0.1"} 1' in lines
+    assert 't_seconds_bucket{endpoint="/a",le="1.0"} 2' in lines
+    assert 't_seconds_bucket{endpoint="/a",le="+Inf"} 3' in lines
+    assert 't_seconds_count{endpoint="/a"} 3' in lines
+
+
+# A request is labelled with its route template and reports DB time, rows and cache outcome.
+def test_request_metrics():
+    response_cache.clear()
+    before = client.get('/metrics').text
+    client.get('/api/venues?per_page=5&chain=metrics-test-mart')
+    client.get('/api/venues?per_page=5&chain=metrics-test-mart')
+    client.get('/api/venues/7')  # unmatched route
+    text = client.get('/metrics').text
+    assert text.count('# TYPE http_request_duration_seconds histogram') == 1
+    count = lambda t: sample(t, 'http_request_duration_seconds_count', method='GET', endpoint='/api/venues', status='200')
+    try:
+        previous = count(before)
+    except AssertionError:
+        previous = 0
+    assert count(text) == previous + 2
+    assert sample(text, 'http_request_db_seconds_count', endpoint='/api/venues') >= 1
+    assert sample(text, 'http_request_serialize_seconds_count', endpoint='/api/venues') >= 1
+    assert sample(text, 'response_cache_requests_total', endpoint='/api/venues', result='hit') >= 1
+    assert sample(text, 'response_cache_requests_total', endpoint='/api/venues', result='miss') >= 1
+    client.get('/api/venues/aggregate?group_by=state&metric=p90:foot_traffic')
+    text = client.get('/metrics').text
+    assert sample(text, 'db_vm_steps_total', endpoint='/api/venues/aggregate') > 0
+    assert sample(text, 'db_pool', stat='size') > 0
+    assert re.search(r'http_request_duration_seconds_count\{method="GET",endpoint="unmatched",status="404"\}', text)
+
+
+def test_rows_returned_counted():
+    response_cache.clear()
+    client.get('/api/venues?per_page=3')
+    text = client.get('/metrics').text
+    assert sample(text, 'db_rows_returned_total', endpoint='/api/venues') >= 4  # count row + page rows
+
+
+def test_slow_query_log_has_sql_params_and_plan(monkeypatch):
+    monkeypatch.setattr(metrics, 'SLOW_QUERY_MS', 0)
+    response_cache.clear()
+    client.get('/api/venues/summary?chain=slow-query-probe')
+    monkeypatch.setattr(metrics, 'SLOW_QUERY_MS', 500)
+    entries = client.get('/api/stats/slow-queries').json()
+    entry = next(e for e in entries if "'%slow-query-probe%'" in e['params'])
+    assert entry['endpoint'] == '/api/venues/summary'
+    assert entry['sql'].startswith('SELECT COUNT(*)')
+    assert entry['plan'] and all(isinstance(p, str) for p in entry['plan'])
+    assert entry['ms'] >= 0
+
+
+# Only the pool's read connections pay for the progress handler; writers (loads) don't.
+def test_vm_steps_counted_on_pooled_connections_only():
+    from src.db import DB_PATH, ConnectionPool, connect
+    stats = metrics.RequestStats({})
+    token = metrics._current.set(stats)
+    try:
+        writer = connect(DB_PATH)
+        writer.execute('SELECT COUNT(*) FROM venues WHERE name LIKE ?;', ('%a%',)).fetchone()
+        writer.close()
+        assert stats.vm_steps == 0
+        pool = ConnectionPool(DB_PATH, size=1)
+        with pool.connection() as conn:
+            conn.execute('SELECT COUNT(*) FROM venues WHERE name LIKE ?;', ('%a%',)).fetchone()
+        pool.close_all()
+        assert stats.vm_steps > 0
+    finally:
+        metrics._current.reset(token)
@@ -0,0 +1,163 @@
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+from src import columnar, ranking
+from src.app import app, init_db
+from src.cache import response_cache
+from src.db import ensure_schema, pool
+from src.filters import VenueFilter
+from src.pagination import SORT_METRICS, fetch_page, sort_where
+from src.ranking import ChainRanks
+
+
+init_db()
+client = TestClient(app)
+
+ENGINES = ['sqlite', 'columnar', 'mapped'] if columnar.load_numpy() else ['sqlite']
+
+
+def fetch(url, engine='sqlite'):
+    columnar.ENGINE = engine
+    response_cache.clear()
+    try:
+        r = client.get(url)
+    finally:
+        columnar.ENGINE = 'sqlite'
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def expected_ids(metric, order, where="", params=()):
+    with pool.connection() as conn:
+        return [r[0] for r in conn.execute(
+            f"SELECT id FROM venues WHERE {metric} IS NOT NULL {where} ORDER BY {metric} {order}, id {order}", params)]
+
+
+def walk(url, engine):
+    ids = []
+    next_url = url
+    while True:
+        data = fetch(next_url, engine)
+        ids += [i['id'] for i in data['items']]
+        if not data['next_cursor']:
+            return ids, data['total']
+        next_url = f"{url}&after={data['next_cursor']}"
+
+
+# Cursor walks in metric order must visit every venue once, in (metric, id) order, on every engine.
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('metric', SORT_METRICS)
+def test_sorted_cursor_walk(engine, metric):
+    for order in ('desc', 'asc'):
+        ids, total = walk(f'/api/venues?sort={metric}&order={order}&per_page=97', engine)
+        assert ids == expected_ids(metric, order)
+        assert total == len(ids)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_sorted_filtered_offset_pages(engine):
+    url = '/api/venues?sort=ft_per_sqft&chain=mart&per_page=25&page=3&shape=columns'
+    data = fetch(url, engine)
+    expected = expected_ids('ft_per_sqft', 'desc', "AND chain_name LIKE '%mart%'")
+    assert [r[0] for r in data['rows']] == expected[50:75]
+    assert data['total'] == len(expected)
+    assert data == fetch(url, 'sqlite')
+
+
+def test_sorted_list_skips_missing_values():
+    conn = sqlite3.connect(':memory:')
+    ensure_schema(conn)
+    conn.executemany("INSERT INTO venues (name, sales) VALUES (?, ?)", [('a', 5.0), ('b', None), ('c', 7.5), ('d', 5.0)])
+    sort = ('sales', 'desc')
+    rows = fetch_page(conn.cursor(), sort_where('', sort), [], 10, sort=sort)
+    assert [(r[2], r[-1]) for r in rows] == [('c', 7.5), ('d', 5.0), ('a', 5.0)]
+    # the top-K of an unfiltered list reads the (metric, id) index without sorting
+    plan = ' '.join(r[3] for r in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM venues WHERE sales IS NOT NULL ORDER BY sales DESC, id DESC LIMIT 5"))
+    assert 'idx_venues_sales_id' in plan and 'TEMP B-TREE' not in plan
+
+
+def test_sort_params_validated():
+    assert client.get('/api/venues?sort=name&order=desc').status_code == 400
+    assert client.get('/api/venues?sort=entity_id').status_code == 422
+    name_cursor = fetch('/api/venues?per_page=5')['next_cursor']
+    assert client.get(f'/api/venues?sort=sales&after={name_cursor}').status_code == 400
+    sales_cursor = fetch('/api/venues?sort=sales&per_page=5')['next_cursor']
+    assert client.get(f'/api/venues?after={sales_cursor}').status_code == 400
+
+
+def test_chain_standing():
+    ranks = ChainRanks([('A', 1), ('B', 2), ('A', 3), ('A', 3), ('A', 9)], 'sales', 1)
+    assert ranks.standing('A', 9) == (1, 4, 100.0)
+    assert ranks.standing('A', 3) == (2, 4, 75.0)
+    assert ranks.standing('A', 1) == (4, 4, 25.0)
+    assert ranks.standing('B', 2) == (1, 1, 100.0)
+    assert ranks.standing('C', 2) == (None, None, None)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_top_matches_sorted_list_and_chain_ranks(engine):
+    data = fetch('/api/venues/top?metric=sales&k=20&dma=6', engine)
+    assert (data['metric'], data['order'], data['k']) == ('sales', 'desc', 20)
+    listed = fetch('/api/venues?sort=sales&dma=6&per_page=20', engine)['items']
+    assert [i['id'] for i in data['items']] == [i['id'] for i in listed]
+    assert [i['rank'] for i in data['items']] == list(range(1, len(listed) + 1))
+    with pool.connection() as conn:
+        for venue in data['items']:
+            chain = conn.execute(
+                "SELECT sales FROM venues WHERE chain_name = ? AND sales IS NOT NULL", (venue['chain_name'],)).fetchall()
+            values = [v for (v,) in chain]
+            assert venue['value'] == conn.execute("SELECT sales FROM venues WHERE id = ?", (venue['id'],)).fetchone()[0]
+            assert venue['chain_size'] == len(values)
+            assert venue['chain_rank'] == 1 + sum(v > venue['value'] for v in values)
+            assert venue['chain_percentile'] == round(100 * sum(v <= venue['value'] for v in values) / len(values), 1)
+
+
+def test_top_ascending_and_limits():
+    data = fetch('/api/venues/top?metric=foot_traffic&order=asc&k=3')
+    assert [i['id'] for i in data['items']] == expected_ids('foot_traffic', 'asc')[:3]
+    assert all(i['value'] == i['foot_traffic'] for i in data['items'])
+    assert client.get('/api/venues/top?k=0').status_code == 422
+    assert client.get('/api/venues/top?metric=name').status_code == 422
+
+
+def test_walk_index_threshold():
+    assert ranking.walk_index(30000, 100000, 51)  # dense matches: ~170 index entries to read
+    assert not ranking.walk_index(300, 100000, 51)  # sparse: sorting 300 rows is cheaper
+    assert not ranking.walk_index(0, 100000, 51)
+
+
+# Both SQLite plans (walk the metric index / sort the matches) must return the same rows.
+@pytest.mark.parametrize('walk', [True, False])
+@pytest.mark.parametrize('kwargs, where, params', [
+    (dict(chain=['mart']), "AND chain_name LIKE ?", ['%mart%']),
+    (dict(state='Texas', open_status='open'), "AND state_name = ? AND (date_closed IS NULL OR date_closed = '')", ['Texas']),
+    (dict(bbox=(-107, 25.8, -93.5, 36.5)), "AND lat BETWEEN 25.8 AND 36.5 AND lon BETWEEN -107 AND -93.5", []),
+])
+def test_fetch_sorted_plans_agree(monkeypatch, walk, kwargs, where, params):
+    monkeypatch.setattr(ranking, 'walk_index', lambda *args: walk)
+    f = VenueFilter.create(**kwargs)
+    expected = expected_ids('area_sqft', 'asc', where, params)
+    with pool.connection() as conn:
+        rows = ranking.fetch_sorted(conn.cursor(), f, ('area_sqft', 'asc'), 10, offset=5)
+        assert [r[0] for r in rows] == expected[5:16]
+        after = (rows[9][-1], rows[9][0])
+        rows = ranking.fetch_sorted(conn.cursor(), f, ('area_sqft', 'asc'), 10, cursor=after)
+        assert [r[0] for r in rows] == expected[15:26]
+
+
+# During a deferred load (the startup seed among them) the metric indexes are dropped; sorted
+# lists must fall back to the filter plan instead of failing on the INDEXED BY hint.
+def test_fetch_sorted_without_derived_indexes(monkeypatch):
+    from src.db import DB_PATH, drop_derived
+    monkeypatch.setattr(ranking, 'walk_index', lambda *args: True)
+    conn = sqlite3.connect(':memory:')
+    source = sqlite3.connect(DB_PATH)
+    source.backup(conn)
+    source.close()
+    drop_derived(conn)
+    f = VenueFilter.create(chain=['mart'])
+    rows = ranking.fetch_sorted(conn.cursor(), f, ('foot_traffic', 'desc'), 10)
+    assert [r[0] for r in rows] == expected_ids('foot_traffic', 'desc', "AND chain_name LIKE ?", ['%mart%'])[:11]
+    conn.close()
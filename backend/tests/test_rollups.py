@@ -0,0 +1,70 @@
+import sqlite3
+
+from fastapi.testclient import TestClient
+from src.app import app, init_db
+from src.db import ensure_schema
+from src.filters import VenueFilter
+from src.rollups import rollup_summary, rollup_where
+
+
+init_db()
+client = TestClient(app)
+
+GROUP_SQL = '''SELECT COALESCE(chain_name, ''), COALESCE(sub_category, ''), COALESCE(dma, ''),
+    COALESCE(state_name, ''), (date_closed IS NOT NULL AND date_closed <> ''), COUNT(*),
+    COALESCE(SUM(foot_traffic), 0) FROM venues GROUP BY 1, 2, 3, 4, 5 ORDER BY 1, 2, 3, 4, 5;'''
+ROLLUP_SQL = '''SELECT chain_name, sub_category, dma, state_name, is_closed, venues, foot_traffic
+    FROM venue_rollups ORDER BY 1, 2, 3, 4, 5;'''
+
+
+def insert(conn, chain, state, ft, closed=None, dma='1'):
+    conn.execute(
+        "INSERT INTO venues (name, chain_name, sub_category, dma, state_name, foot_traffic, date_closed) VALUES (?,?,?,?,?,?,?)",
+        (chain, chain, 'Big Box Store', dma, state, ft, closed))
+
+
+# Incremental maintenance: rollups must equal a fresh GROUP BY after inserts, updates and deletes.
+def test_triggers_keep_rollups_in_sync():
+    conn = sqlite3.connect(':memory:')
+    ensure_schema(conn)
+    insert(conn, 'Walmart', 'Texas', 10)
+    insert(conn, 'Walmart', 'Texas', 5)
+    insert(conn, 'Target', 'Ohio', None, closed='2020-01-01')
+    insert(conn, None, None, 7, dma=None)
+    assert conn.execute(ROLLUP_SQL).fetchall() == conn.execute(GROUP_SQL).fetchall()
+
+    conn.execute("UPDATE venues SET state_name = 'Ohio', foot_traffic = 3 WHERE foot_traffic = 5")
+    conn.execute("UPDATE venues SET date_closed = NULL WHERE chain_name = 'Target'")
+    assert conn.execute(ROLLUP_SQL).fetchall() == conn.execute(GROUP_SQL).fetchall()
+
+    conn.execute("DELETE FROM venues WHERE chain_name = 'Walmart'")
+    assert conn.execute(ROLLUP_SQL).fetchall() == conn.execute(GROUP_SQL).fetchall()
+    conn.execute("DELETE FROM venues")
+    assert conn.execute(ROLLUP_SQL).fetchall() == []
+
+
+def test_rollup_eligibility():
+    assert rollup_where(VenueFilter()) == ('', [])
+    assert rollup_where(VenueFilter.create(chain=['Walmart'], match='exact')) is not None
+    assert rollup_where(VenueFilter.create(chain=['Walmart'])) is None  # contains needs the base rows
+    assert rollup_where(VenueFilter.create(city='Pecos')) is None
+    assert rollup_where(VenueFilter.create(chain=['all'], city='all', open_status='open')) is not None
+
+
+# The rollup answer must equal the base-table answer for the same filters.
+def test_rollup_summary_matches_base_table():
+    from src.db import pool
+    from src.filters import compile_filter
+    cases = [
+        {},
+        dict(chain=['walmart', 'Target'], match='exact'),
+        dict(category=['big box store'], state='Texas', match='exact'),
+        dict(open_status='closed'),
+        dict(dma=['633'], open_status='open', match='exact'),
+    ]
+    with pool.connection() as conn:
+        for kwargs in cases:
+            f = VenueFilter.create(**kwargs)
+            where_sql, params = compile_filter(f)
+            cnt, ft = conn.execute(f"SELECT COUNT(*), COALESCE(SUM(foot_traffic), 0) FROM venues{where_sql}", params).fetchone()
+            assert rollup_summary(conn, *rollup_where(f)) == {'venues': cnt, 'total_foot_traffic': ft}, kwargs
@@ -0,0 +1,128 @@
+import contextlib
+import io
+import os
+import threading
+
+import pytest
+
+from load_csv import load_into_db
+from src import ingest, snapshot
+from src.db import ConnectionPool, connect, get_data_version
+
+CSV_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Bigbox Stores Metrics.csv'))
+
+
+def make_db(path, rows):
+    conn = connect(path)
+    conn.execute('CREATE TABLE t (n INTEGER);')
+    conn.executemany('INSERT INTO t VALUES (?);', [(i,) for i in range(rows)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def count(conn, table='t'):
+    return conn.execute(f'SELECT COUNT(*) FROM {table};').fetchone()[0]
+
+
+def load_csv(conn):
+    ingest.ingest_csv(conn, CSV_PATH, defer_indexes=True, progress=None)
+
+
+# Swapping files: new acquisitions read the new file, connections busy on the old one keep
+# working and are closed when released.
+def test_pool_swap_drains_old_connections(tmp_path):
+    a = make_db(str(tmp_path / 'a.db'), 1)
+    b = make_db(str(tmp_path / 'b.db'), 2)
+    pool = ConnectionPool(a, size=2, timeout=5)
+    old = pool.acquire()
+    idle = pool.acquire()
+    pool.release(idle)
+    assert pool.swap(b) and not pool.swap(b)
+    assert pool.stats()['drained'] == 1  # the idle one goes at once
+    with pool.connection() as conn:
+        assert count(conn) == 2
+    assert count(old) == 1
+    pool.release(old)
+    stats = pool.stats()
+    assert stats['drained'] == 2 and stats['open'] == 1 and stats['swaps'] == 1 and stats['path'] == b
+    pool.close_all()
+
+
+def test_waiter_gets_connection_to_new_file(tmp_path):
+    a = make_db(str(tmp_path / 'a.db'), 1)
+    b = make_db(str(tmp_path / 'b.db'), 2)
+    pool = ConnectionPool(a, size=1, timeout=5)
+    held = pool.acquire()
+    pool.swap(b)
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(count(pool.acquire())))
+    waiter.start()
+    pool.release(held)
+    waiter.join(timeout=5)
+    assert got == [2]
+    assert pool.stats()['timeouts'] == 0
+
+
+def test_build_publishes_and_pool_follows(tmp_path):
+    db_path = str(tmp_path / 'live.db')
+    conn = connect(db_path)
+    load_csv(conn)
+    live_version = get_data_version(conn)
+    conn.close()
+    assert snapshot.current_path(db_path) == db_path
+
+    pool = ConnectionPool(db_path, size=2)
+    pool.follow(lambda: snapshot.current_path(db_path), poll=0)
+
+    first = snapshot.build(load_csv, db_path)
+    assert snapshot.current_path(db_path) == first
+    assert not [n for n in os.listdir(os.path.dirname(first)) if n.endswith('.building')]
+    with pool.connection() as conn:
+        assert count(conn, 'venues') == count(connect(db_path), 'venues')
+        assert get_data_version(conn) > live_version
+        first_version = get_data_version(conn)
+
+    # a copy-based refresh starts from the published data
+    second = snapshot.build(lambda conn: conn.execute("DELETE FROM venues WHERE id % 2 = 0;"), db_path, base='copy')
+    with pool.connection() as conn:
+        assert get_data_version(conn) > first_version
+        assert 0 < count(conn, 'venues') < count(connect(first), 'venues')
+    assert pool.stats()['swaps'] == 2
+
+    # a failed load publishes nothing and leaves no files behind
+    before = sorted(os.listdir(snapshot.snapshot_dir(db_path)))
+
+    def fail(conn):
+        raise RuntimeError('bad feed')
+    with pytest.raises(RuntimeError):
+        snapshot.build(fail, db_path)
+    assert snapshot.current_path(db_path) == second
+    assert sorted(os.listdir(snapshot.snapshot_dir(db_path))) == before
+    pool.close_all()
+
+
+def test_prune_keeps_current_and_previous(tmp_path):
+    db_path = str(tmp_path / 'live.db')
+    directory = snapshot.snapshot_dir(db_path)
+    os.makedirs(directory)
+    paths = [make_db(os.path.join(directory, f'live-2024010{i}-000000-000000.db'), 1) for i in range(1, 5)]
+    snapshot.publish(db_path, paths[1])
+    removed = snapshot.prune(db_path, keep=1)
+    assert sorted(removed) == sorted([paths[0], paths[2]])
+    assert snapshot.current_path(db_path) == paths[1]
+
+
+def test_load_csv_snapshot(tmp_path):
+    db_path = str(tmp_path / 'cli.db')
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        assert load_into_db(CSV_PATH, db_path, snapshot=True) == 0
+        assert load_into_db(CSV_PATH, db_path, snapshot=True, delta=True) == 0
+        assert load_into_db(CSV_PATH, db_path, snapshot=True, clear=True) == 1
+    assert 'Published snapshot' in out.getvalue()
+    conn = connect(snapshot.current_path(db_path))
+    n = count(conn, 'venues')
+    assert n == sum(1 for _ in open(CSV_PATH, encoding='utf-8')) - 1
+    assert conn.execute("SELECT value FROM meta WHERE key = 'derived_stale';").fetchone()[0] == 0
+    conn.close()
+    assert not os.path.exists(db_path) or count(connect(db_path), 'venues') == 0
@@ -0,0 +1,101 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src import ingest, startup
+from src.app import app, init_db
+from src.db import SCHEMA_VERSION, connect, migrate, schema_version, writer_lock
+
+init_db()
+client = TestClient(app)
+
+CSV_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Bigbox Stores Metrics.csv'))
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def csv_rows():
+    with open(CSV_PATH, encoding='utf-8') as fh:
+        return sum(1 for _ in fh) - 1
+
+
+def venue_count(path):
+    conn = connect(path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM venues;').fetchone()[0]
+    finally:
+        conn.close()
+
+
+# Migrations run once per schema version; a migrated DB is left alone.
+def test_migrate_once(tmp_path):
+    path = str(tmp_path / 'migrate.db')
+    assert migrate(path) is True
+    conn = connect(path)
+    assert schema_version(conn) == SCHEMA_VERSION
+    conn.close()
+    assert migrate(path) is False
+
+
+def test_writer_lock_is_exclusive(tmp_path):
+    path = str(tmp_path / 'lock.db')
+    with writer_lock(path) as held:
+        assert held
+        with writer_lock(path, blocking=False) as other:
+            assert not other
+    with writer_lock(path, blocking=False) as held:
+        assert held
+
+
+# Seeding loads an empty DB once; a seed that died midway resumes instead of starting over.
+def test_seed_resumes_interrupted_seed(tmp_path, monkeypatch):
+    path = str(tmp_path / 'seed.db')
+    migrate(path)
+    monkeypatch.setattr(ingest, 'PROGRESS_EVERY', 300)
+
+    def crash(rows, elapsed):
+        raise RuntimeError('worker killed')
+
+    conn = connect(path)
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('seeding', 1);")
+    conn.commit()
+    with pytest.raises(RuntimeError):
+        ingest.ingest_csv(conn, CSV_PATH, batch_size=100, resume=True, defer_indexes=True, progress=crash)
+    assert 0 < startup.rows_loaded(conn) < csv_rows()
+    conn.close()
+
+    stats = startup.seed(path, CSV_PATH)
+    assert stats['skipped'] > 0
+    assert venue_count(path) == csv_rows()
+    assert startup.seed(path, CSV_PATH) is None
+    assert venue_count(path) == csv_rows()
+
+
+def test_ready_endpoint_and_gate(monkeypatch):
+    r = client.get('/api/ready')
+    assert r.status_code == 200
+    assert r.json()['phase'] == 'ready'
+
+    monkeypatch.setattr(startup.state, 'phase', 'migrating')
+    monkeypatch.setattr(startup.state, 'schema_ready', False)
+    r = client.get('/api/ready')
+    assert r.status_code == 503 and r.json()['phase'] == 'migrating'
+    r = client.get('/api/venues?per_page=1')
+    assert r.status_code == 503 and r.headers['retry-after'] == '1'
+    assert client.get('/api/stats/pool').status_code == 200
+
+    monkeypatch.setattr(startup.state, 'phase', 'seeding')
+    monkeypatch.setattr(startup.state, 'schema_ready', True)
+    r = client.get('/api/ready')
+    assert r.status_code == 503 and r.json()['rows_loaded'] == 0
+    assert client.get('/api/venues?per_page=1').status_code == 200
+
+
+# Workers on the default engine don't import numpy, pyarrow or the ingest pipeline.
+def test_lazy_imports(tmp_path):
+    env = {**os.environ, 'FOOT_TRAFFIC_DB': str(tmp_path / 'lazy.db'), 'FOOT_TRAFFIC_ENGINE': 'sqlite'}
+    code = "import sys, src.app; print(sorted({'numpy', 'pyarrow', 'src.ingest'} & set(sys.modules)))"
+    out = subprocess.run([sys.executable, '-c', code], cwd=BACKEND, env=env, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == '[]'
@@ -0,0 +1,108 @@
+import csv
+import datetime
+import os
+
+from fastapi.testclient import TestClient
+
+from src import ingest
+from src.app import app, get_conn, init_db
+from src.db import connect
+from src.timeseries import bucket, from_day, to_day
+
+init_db()
+client = TestClient(app)
+
+CSV_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Bigbox Stores Metrics.csv'))
+START = datetime.date(2024, 1, 1)
+DAYS = 120
+
+
+def write_history(path, entity_ids):
+    """One row per entity and day, with values derived from both so sums are checkable."""
+    with open(path, 'w', newline='', encoding='utf-8') as fh:
+        w = csv.writer(fh)
+        w.writerow(['entity_id', 'date', 'foot_traffic', 'sales', 'avg_dwell_time_min'])
+        for i, entity_id in enumerate(entity_ids):
+            for d in range(DAYS):
+                w.writerow([entity_id, (START + datetime.timedelta(days=d)).isoformat(), 100 + i + d,
+                            f'{(i + 1) * 10.5:.2f}', '' if d % 10 == 0 else 20 + i % 5])
+        w.writerow(['not-a-venue', START.isoformat(), 1, 1, 1])
+        w.writerow([entity_ids[0], 'yesterday', 1, 1, 1])
+
+
+def load_history(tmp_path_factory):
+    conn = get_conn()
+    entity_ids = [r[0] for r in conn.execute(
+        "SELECT entity_id FROM venues WHERE entity_id IS NOT NULL ORDER BY id LIMIT 40;")]
+    path = tmp_path_factory.mktemp('history') / 'history.csv'
+    write_history(path, entity_ids)
+    stats = ingest.ingest_metrics(conn, [str(path)], batch_size=500, progress=None)
+    conn.close()
+    return entity_ids, stats
+
+
+def test_day_buckets():
+    assert from_day(to_day('2024-03-15 00:00:00.000000 UTC')) == datetime.date(2024, 3, 15)
+    wednesday = to_day('2024-01-03')
+    assert from_day(bucket(wednesday, 'week')) == datetime.date(2024, 1, 1)  # Monday
+    assert from_day(bucket(to_day('2024-02-29'), 'month')) == datetime.date(2024, 2, 1)
+
+
+def test_ingest_and_downsample(tmp_path_factory):
+    entity_ids, stats = load_history(tmp_path_factory)
+    assert stats['written'] == len(entity_ids) * DAYS
+    assert stats['unknown'] == 1 and stats['errors'] == 1
+
+    daily = client.get('/api/venues/timeseries')
+    assert daily.status_code == 200
+    body = daily.json()
+    assert body['interval'] == 'day' and len(body['points']) == DAYS
+    assert body['start'] == START.isoformat()
+    first = body['points'][0]
+    assert first['venue_days'] == len(entity_ids)
+    assert first['foot_traffic'] == sum(100 + i for i in range(len(entity_ids)))
+    assert first['avg_dwell_time_min'] is None  # no dwell reported on day 0
+
+    weekly = client.get('/api/venues/timeseries?interval=week').json()
+    monthly = client.get('/api/venues/timeseries?interval=month').json()
+    assert len(weekly['points']) == 18 and len(monthly['points']) == 4
+    assert [p['date'] for p in monthly['points']] == ['2024-01-01', '2024-02-01', '2024-03-01', '2024-04-01']
+    for series in (weekly, monthly):
+        assert sum(p['foot_traffic'] for p in series['points']) == sum(p['foot_traffic'] for p in body['points'])
+        assert sum(p['venue_days'] for p in series['points']) == len(entity_ids) * DAYS
+
+    # filters apply to the venues behind the history
+    conn = get_conn()
+    chain = conn.execute("SELECT chain_name FROM venues WHERE entity_id = ?;", (entity_ids[0],)).fetchone()[0]
+    expected = conn.execute(
+        "SELECT SUM(m.foot_traffic) FROM venue_metrics m JOIN venues v ON v.id = m.venue_id "
+        "WHERE v.chain_key = lower(?) AND m.day BETWEEN ? AND ?;",
+        (chain, to_day('2024-02-01'), to_day('2024-02-29'))).fetchone()[0]
+    conn.close()
+    r = client.get('/api/venues/timeseries', params={
+        'chain': chain, 'match': 'exact', 'start': '2024-02-01', 'end': '2024-02-29', 'interval': 'month'})
+    assert [p['foot_traffic'] for p in r.json()['points']] == [expected]
+
+    # reloading the same period replaces rows instead of adding to them
+    _, again = load_history(tmp_path_factory)
+    assert again['written'] == stats['written']
+    assert client.get('/api/venues/timeseries').json() == body
+
+
+def test_timeseries_rejects_bad_ranges():
+    assert client.get('/api/venues/timeseries?start=2024-02-01&end=2024-01-01').status_code == 400
+    assert client.get('/api/venues/timeseries?start=1990-01-01&end=2024-01-01&interval=day').status_code == 400
+    assert client.get('/api/venues/timeseries?interval=hour').status_code == 422
+
+
+def test_history_is_deleted_with_its_venue(tmp_path):
+    conn = connect(str(tmp_path / 'history.db'))
+    ingest.ingest_csv(conn, CSV_PATH, progress=None)
+    entity_id = conn.execute("SELECT entity_id FROM venues LIMIT 1;").fetchone()[0]
+    path = tmp_path / 'history.csv'
+    write_history(path, [entity_id])
+    ingest.ingest_metrics(conn, [str(path)], progress=None)
+    assert conn.execute("SELECT COUNT(*) FROM venue_metrics;").fetchone()[0] == DAYS
+    conn.execute("DELETE FROM venues WHERE entity_id = ?;", (entity_id,))
+    assert conn.execute("SELECT COUNT(*) FROM venue_metrics;").fetchone()[0] == 0
+    conn.close()
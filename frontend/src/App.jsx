@@ -19,22 +19,21 @@ export default function App() {
   useEffect(() => {
     async function load() {
       setLoading(true)
-      const q = new URLSearchParams()
-  q.append('page', String(page))
-  q.append('per_page', String(perPage))
-  // append multiple values for chain/category/dma
-  if (Array.isArray(chain) && chain.length > 0) chain.forEach(c => q.append('chain', c))
-  if (Array.isArray(category) && category.length > 0) category.forEach(c => q.append('category', c))
-  if (Array.isArray(dma) && dma.length > 0) dma.forEach(d => q.append('dma', d))
-      if (openOnly) q.append('open_status', 'open')
-      const suffix = q.toString() ? `?${q.toString()}` : ''
+      // one POST /api/batch returns the page and the summary for the same filters
+      const filters = {}
+      if (Array.isArray(chain) && chain.length > 0) filters.chain = chain
+      if (Array.isArray(category) && category.length > 0) filters.category = category
+      if (Array.isArray(dma) && dma.length > 0) filters.dma = dma
+      if (openOnly) filters.open_status = 'open'
       try {
-        const [resV, resS] = await Promise.all([
-          fetch(`/api/venues${suffix}`),
-          fetch(`/api/venues/summary${suffix}`),
-        ])
-        const dataV = await resV.json()
-        const dataS = await resS.json()
+        const res = await fetch('/api/batch', {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ filters, items: { page, per_page: perPage }, summary: true }),
+        })
+        const data = await res.json()
+        const dataV = data.items || {}
+        const dataS = data.summary || {}
         setItems(dataV.items || [])
         setTotal(dataV.total || 0)
         setSummary({ venues: dataS.venues || 0, total_foot_traffic: dataS.total_foot_traffic || 0 })
@@ -84,7 +83,7 @@ export default function App() {
               </select>
             </label>
             <button onClick={async () => {
-              // build query suffix like the load effect
+              // same filters as the load effect, as query params
               const q = new URLSearchParams()
               if (Array.isArray(chain) && chain.length > 0) chain.forEach(c => q.append('chain', c))
               if (Array.isArray(category) && category.length > 0) category.forEach(c => q.append('category', c))